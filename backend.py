@@ -0,0 +1,46 @@
+# ----------------------------------------------------------------------------
+# Pin/Bus Backend
+#
+# ICSP and I2C_Tool get their MCLR/ICSPCLK/ICSPDAT lines, PIO state machine,
+# I2C bus and clock from a backend, so the same code runs on the board or
+# against the simulated target in sim.py (Sim_Backend).
+#
+#   output(pin)      : digitalio.DigitalInOut look-alike, direction Output
+#   StateMachine     : rp2pio.StateMachine look-alike (ImportError if none)
+#   i2c(scl, sda)    : busio.I2C look-alike
+#   sleep(seconds)   : time.sleep, not shorter than seconds (precise_sleep)
+#   monotonic()      : time.monotonic
+
+import time
+
+SLEEP_TICK = 0.001          # time.sleep() of CircuitPython counts in milliseconds
+
+
+def precise_sleep(seconds):
+    # time.sleep() may end up to a tick early and can not wait under a tick,
+    # so the last tick (or all of a short wait) is a busy wait on monotonic_ns()
+    end = time.monotonic_ns() + int(seconds * 1e9)
+    if seconds > 2 * SLEEP_TICK:
+        time.sleep(seconds - 2 * SLEEP_TICK)
+    while time.monotonic_ns() < end:
+        pass
+
+
+class Board_Backend:
+    sleep = staticmethod(precise_sleep)
+    monotonic = staticmethod(time.monotonic)
+
+    def output(self, pin):
+        import digitalio
+        dio = digitalio.DigitalInOut(pin)
+        dio.direction = digitalio.Direction.OUTPUT
+        return dio
+
+    @property
+    def StateMachine(self):
+        from rp2pio import StateMachine     # ImportError: not a RP2040 board
+        return StateMachine
+
+    def i2c(self, scl, sda):
+        from busio import I2C
+        return I2C(scl, sda)
@@ -0,0 +1,14 @@
+# ----------------------------------------------------------------------------
+# Runs before code.py on every hard reset
+#
+# Enables the second USB serial (usb_cdc.data) for the upload channel, see
+# upload.py and tools/upload_hex.py. The console (REPL) stays as it is.
+
+import usb_cdc
+
+usb_cdc.enable(console=True, data=True)
+
+# Uncomment to let code.py write CIRCUITPY (RH readout, the cached .bin images).
+# The host can not write it then, so drop the .hex files by the upload channel.
+# import storage
+# storage.remount('/', readonly=False)
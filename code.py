@@ -18,346 +18,78 @@
 #   GP16 : GPO/GPI --- 10k ---  13 RA0: ICSPDAT
 
 import time
-import re
 import board
 import digitalio
-from busio import I2C
-from os import stat, listdir
+import supervisor
+from os import listdir
 from adafruit_datetime import datetime
+from backend import Board_Backend
+from icsp import ICSP
+from gang import Gang_ICSP
+from devicedb import find_device
+from util import NO_Printer, prinp, hexstr, print_data
+from hexfile import load_hex_file, write_hex_file, Hex_Watcher
+from upload import Upload_Channel
+from i2ctest import REPORTS, TRANSACTIONS, Latency_Histogram, Settle_Stats, Test_Error, Test_Result
+from i2ctest import compile_command, error_kind, format_response, load_test, wait_until
 
 if board.board_id == 'Seeeduino XIAO RP2040':
     import neopixel_write
 
-DEVICE_LIST = {
-    0x2700: {  # Device ID
-        'N': 'PIC12F1822',  # Device Name
-        'P': [0x0000, 0x0800, 0x3FFF],  # Address, Size, Value
-        'C': [0x8007, 0x0002, 0x3FFF],  # Address, Size, Value
-        'D': [0xF000, 0x0100, 0x00FF],  # Address, Size, Value
-    },
-    0x1BC0: {  # Device ID
-        'N': 'PIC12LF1840',  # Device Name
-        'P': [0x0000, 0x1000, 0x3FFF],  # Address, Size, Value
-        'C': [0x8007, 0x0002, 0x3FFF],  # Address, Size, Value
-        'D': [0xF000, 0x0100, 0x00FF],  # Address, Size, Value
-    },
-    0x2CE0: {  # Device ID
-        'N': 'PIC16F1503',  # Device Name
-        'P': [0x0000, 0x0800, 0x3FFF],  # Address, Size, Value
-        'C': [0x8007, 0x0002, 0x3FFF],  # Address, Size, Value
-        'D': [0xF000, 0x0000, 0x00FF],  # Address, Size, Value # TODO temporary disabled, High-Endurance Flash should be supported
-    },
-    0x2720: {  # Device ID
-        'N': 'PIC16F1823',  # Device Name
-        'P': [0x0000, 0x0800, 0x3FFF],  # Address, Size, Value
-        'C': [0x8007, 0x0002, 0x3FFF],  # Address, Size, Value
-        'D': [0xF000, 0x0100, 0x00FF],  # Address, Size, Value
-    },
-    0x2300: {  # Device ID
-        'N': 'PIC16F1933',  # Device Name
-        'P': [0x0000, 0x0800, 0x3FFF],  # Address, Size, Value
-        'C': [0x8007, 0x0002, 0x3FFF],  # Address, Size, Value
-        'D': [0xF000, 0x0000, 0x00FF],  # Address, Size, Value
-    },
-}
-
-# -----------------------------------------------------------------------------
-# Low-Voltage In-Circuit Serial Programming (LV-ICSP) Class
-
-class ICSP:
-    WAIT_TCLK = 200e-9  # 200 ns        ;; TODO time.sleep() under usec have no accurate waiting, find another way
-    WAIT_TDLY = 1e-6  # 1 us
-    WAIT_TENT = 1e-3  # 1 ms
-    WAIT_TERA = 5e-3  # 5 ms
-
-    COLUMN = 0x10
-
-    def __init__(self, MCLR, ICSPCLK, ICSPDAT):
-        self.MCLR = digitalio.DigitalInOut(MCLR)
-        self.MCLR.direction = digitalio.Direction.OUTPUT
-        self.ICSPCLK = digitalio.DigitalInOut(ICSPCLK)
-        self.ICSPCLK.direction = digitalio.Direction.OUTPUT
-        self.ICSPDAT = digitalio.DigitalInOut(ICSPDAT)
-        self.ICSPDAT.direction = digitalio.Direction.OUTPUT
-
-    def reset(self):
-        self.MCLR.value = False
-        time.sleep(0.5)
-        self.MCLR.value = True
-        time.sleep(0.5)
-
-    # Communication Routine
-
-    def send_bit(self, length, value):
-        for i in range(length):
-            # TCKH: Min 100 ns
-            self.ICSPCLK.value = True
-            self.ICSPDAT.value = value & 1
-            # TDS: Min 100 ns
-            time.sleep(self.WAIT_TCLK)
-            # TCKL: Min 100 ns
-            self.ICSPCLK.value = False
-            # TDH: Min 100 ns
-            time.sleep(self.WAIT_TCLK)
-            value = value >> 1
-
-    def send_command(self, value):
-        self.send_bit(6, value)
-        # TDLY: Min 1 us
-        time.sleep(self.WAIT_TDLY)
-
-    def send_data(self, value):
-        self.send_bit(1, 0)
-        self.send_bit(14, value)
-        self.send_bit(1, 0)
-
-    def recv_data(self):
-        value = 0
-        self.send_bit(1, 0)
-        self.ICSPDAT.direction = digitalio.Direction.INPUT
-        for i in range(14):
-            # TCKH: Min 100 ns
-            self.ICSPCLK.value = True
-            # TCO: Max 80 ns
-            time.sleep(self.WAIT_TCLK)
-            value |= self.ICSPDAT.value << i
-            # TCKL: Min 100 ns
-            self.ICSPCLK.value = False
-            time.sleep(self.WAIT_TCLK)
-        self.ICSPDAT.direction = digitalio.Direction.OUTPUT
-        self.send_bit(1, 0)
-        return value
-
-    def set_lvp_mode(self):
-        # TENTS: Min 100 ns
-        self.MCLR.value = True
-        time.sleep(self.WAIT_TENT)
-        # TENTH: Min 250 us
-        self.MCLR.value = False
-        time.sleep(self.WAIT_TENT)
-        # Key Sequence: 0x4D434850 (MCHP in ASCII)
-        self.send_bit(8, 0x50)
-        self.send_bit(8, 0x48)
-        self.send_bit(8, 0x43)
-        self.send_bit(8, 0x4D)
-        # Total 33 Clocks
-        self.send_bit(1, 0)
-        time.sleep(self.WAIT_TENT)
-
-    def set_normal_mode(self):
-        self.MCLR.value = True
-
-    # Command Routine
-
-    def run_load_configuration(self):
-        self.send_command(0x00)
-        self.send_data(0x00)
-
-    def run_load_data_for_program_memory(self, value):
-        self.send_command(0x02)
-        self.send_data(value)
-
-    def run_load_data_for_data_memory(self, value):
-        self.send_command(0x03)
-        self.send_data(value)
-
-    def run_read_data_from_program_memory(self):
-        self.send_command(0x04)
-        return self.recv_data()
-
-    def run_read_data_from_data_memory(self):
-        self.send_command(0x05)
-        return self.recv_data()
-
-    def run_increment_address(self):
-        self.send_command(0x06)
-
-    def run_reset_address(self):
-        self.send_command(0x16)
-
-    def run_begin_internally_timed_programming(self):
-        self.send_command(0x08)
-        # TPINT: Max 5 ms
-        time.sleep(self.WAIT_TERA)
-
-    def run_bulk_erase_program_memory(self):
-        self.send_command(0x09)
-        # TERAB: Max 5 ms
-        time.sleep(self.WAIT_TERA)
-
-    def run_bulk_erase_data_memory(self):
-        self.send_command(0x0B)
-        # TERAB: Max 5 ms
-        time.sleep(self.WAIT_TERA)
-
-    # Read Routine
-
-    def read_memory(self, size, run_read_data, show=True):
-        base_address = 0
-        data = [0] * size
-        for address in range(size):
-            data[address] = run_read_data()
-            next_address = address + 1
-            self.run_increment_address()
-            if show is False:
-                continue
-            if ((next_address % self.COLUMN) == 0) or (next_address == size):
-                column_data = data[base_address:next_address] if show != 'config' else data[7:9]    # TODO so dirty
-                print_data_line(base_address, column_data)
-                base_address = next_address
-        return data
-
-    def read_program_memory(self, size):
-        run_read_data = self.run_read_data_from_program_memory
-        self.run_reset_address()
-        return self.read_memory(size, run_read_data)
-
-    def read_configuration(self, size, show=True):
-        run_read_data = self.run_read_data_from_program_memory
-        self.run_load_configuration()
-        return self.read_memory(size, run_read_data, show)
-
-    def read_data_memory(self, size):
-        run_read_data = self.run_read_data_from_data_memory
-        self.run_reset_address()
-        return self.read_memory(size, run_read_data)
-
-    # Erase Routine
-
-    def erase_program_memory(self):
-        self.run_load_configuration()
-        self.run_bulk_erase_program_memory()
-
-    def erase_data_memory(self):
-        self.run_bulk_erase_data_memory()
-
-    # Write Routine
-
-    def write_memory(self, data, latch, run_load_data):
-        base_address = 0
-        size = len(data)
-        for address in range(size):
-            run_load_data(data[address])
-            next_address = address + 1
-            if ((next_address % latch) == 0) or (next_address == size):
-                self.run_begin_internally_timed_programming()
-            self.run_increment_address()
-            if ((next_address % self.COLUMN) == 0) or (next_address == size):
-                column_data = data[base_address:next_address]
-                # print_data_line(base_address, column_data)
-                print('*', end='')
-                base_address = next_address
-        print()
-
-    def write_program_memory(self, data):
-        if data:
-            run_load_data = self.run_load_data_for_program_memory
-            self.erase_program_memory()
-            self.run_reset_address()
-            self.write_memory(data, 16, run_load_data)
-
-    def write_configulation(self, data):
-        if data:
-            run_load_data = self.run_load_data_for_program_memory
-            self.run_load_configuration()
-            for i in range(7):
-                self.run_increment_address()
-            self.write_memory(data[0:2], 1, run_load_data)
-
-    def write_data_memory(self, data):
-        if data:
-            run_load_data = self.run_load_data_for_data_memory
-            self.erase_data_memory()
-            self.run_reset_address()
-            self.write_memory(data, 1, run_load_data)
+try:
+    import usb_cdc          # data channel for the upload, enabled by boot.py
+except ImportError:
+    usb_cdc = None
 
 # -----------------------------------------------------------------------------
 # Sub Routine
 
-def hexstr(data):
-    return ' '.join([('%04X' % value) for value in data])
-
+def read_hex_region(region):
+    if uploaded:
+        return uploaded[region]
+    image = load_hex_file(hex_file, detector.device_info, hex_watcher.stamp(hex_file))
+    return image[region] if image else None
 
-def print_data_line(address, data):
-    prinp(('%04X:' % address), hexstr(data))
 
-
-def print_data(data):
-    for address in range(0, len(data), ICSP.COLUMN):
-        print_data_line(address, data[address : address + ICSP.COLUMN])
-
-
-def verify_data(memory, config, read_data):
-    prinp('Hex File')
-    data_hex = read_hex_file(hex_file, memory)
-    print_data(data_hex)
-    prinp('Device')
-    if config:
-        data_device = detector.icsp.read_configuration(11, 'config')[7:9]
-    else:
-        data_device = read_data(memory[1])
-    if data_hex == data_device:
-        prinp('Verify OK')
-        return None
-    else:
-        prinp('Verify NG')
+def verify_data(region, first=False, retries=0):
+    # first: stop on the first mismatch (production), or list all (debugging)
+    # retries: rewrite the failed rows of Program/Data Memory up to this times each
+    data_hex = read_hex_region(region)
+    if data_hex is None:
         return -1    # error
-
-def read_hex_file(name, memory):
-    memory_address = memory[0]
-    memory_size = memory[1]
-    memory_buffer = [memory[2]] * memory_size
-    extended_linear_address = '0000'
-    # Read File
-    file = open(name, 'r')
-    for line in file:
-        line = line.rstrip()
-        # Parse Record Structure
-        start_code = line[0]            # Start code
-        byte_count = line[1:3]          # Byte count
-        address = line[3:7]             # Address
-        record_type = line[7:9]         # Record type
-        data = line[9:-2]               # Data
-        checksum = line[-2:]            # Checksum
-        # if len(data) == 4: #debug
-        #    prinp(f'debug data:{data}')
-
-        # Check
-        if start_code != ':':
-            prinp('Invalid Start Code')
-            return
-        if (int(byte_count, 16) * 2) != len(data):
-            prinp('Invalid Data Length')
-            return
-        byte_data = [int(line[i : i + 2], 16) for i in range(1, len(line), 2)]
-        if sum(byte_data) & 0xFF:   # todo diff byte_data vs checksum
-            prinp('Invalid Checksum')
-            return
-        # Handle
-        if record_type == '00':         # Data
-            # prinp(f'{extended_linear_address}, {address}') # debug
-            absolute_address = int(extended_linear_address + address, 16) >> 1
-            offset_address = absolute_address - memory_address
-            if 0 <= offset_address < memory_size:
-                for i in range(0, len(data), 4):
-                    # if len(memory_buffer) == 2: #debug
-                    #    prinp(f'debug data:{data}')
-                    value = int(data[i + 2 : i + 4] + data[i : i + 2], 16)
-                    memory_buffer[offset_address + (i >> 2)] = value
-        elif record_type == '04':       # Extended Linear Address
-            extended_linear_address = line[9:13]
-        elif record_type == '02':       # Extended Segment address
-            # TODO: ignored temporary
-            continue
-        elif record_type == '01':       # End Of File
-            break
-        else:
-            prinp(f'Invalid Record Type:{record_type}')
-            return
-    file.close()
-    # if len(memory_buffer) == 2:     #debug
-    #    prinp(f'debug memory_buffer:{memory_buffer}')
-    return memory_buffer
+    icsp = detector.icsp
+    verify = {'P': icsp.verify_program_memory,
+              'C': icsp.verify_configuration,
+              'D': icsp.verify_data_memory}[region]
+    errors = verify(data_hex, first)
+    if retries and any(errors):
+        di = detector.device_info
+        if region == 'P':
+            errors = icsp.retry_program_memory(data_hex, errors, retries, di['R'], di['L'], first)
+        elif region == 'D':
+            errors = icsp.retry_data_memory(data_hex, errors, retries, first)
+    return check_verify(errors, first)
+
+def check_verify(errors, first):
+    # prints the verify result, returns -1 when failed
+    if detector.gang:
+        # a result for each target, go on while any target is OK
+        for ch, channel_errors in enumerate(errors):
+            print_verify(channel_errors, first, f'CH{ch} ')
+        return None if not all(errors) else -1
+    print_verify(errors, first)
+    return -1 if errors else None
+
+def print_verify(errors, first, label=''):
+    if not errors:
+        prinp(f'{label}Verify OK')
+    else:
+        prinp(f'{label}Verify NG')
+        prinp('  Address  Expected  Actual')
+        for address, expected, actual in errors:
+            prinp(f'  {address:04X}:    {expected:04X}      {actual:04X}')
+        rows = len(set(address // ICSP.COLUMN for address, _, _ in errors))
+        prinp(f'  {len(errors)} word(s) in {rows} row(s)' + (', stopped on the first' if first else ''))
 
 
 class LED_MONO:
@@ -443,22 +175,34 @@ class Detector:
                                  'P',
                                  'C',
                                  'D',
+                                 'H',
+                                 'L',
+                                 'R',
+                                 'T',
                                  'i2c_slave_addr'])
-    def __init__(self):
-        pass
-        if PIN_ICSP_MCLR and PIN_ICSP_CLK and PIN_ICSP_DAT:
-            self.icsp = ICSP(PIN_ICSP_MCLR, PIN_ICSP_CLK, PIN_ICSP_DAT)
+    def __init__(self, backend=None):
+        self.backend = backend or Board_Backend()
+        self.gang = bool(ICSP_GANG and PIN_ICSP_GANG_DAT)
+        if PIN_ICSP_MCLR and PIN_ICSP_CLK and (PIN_ICSP_DAT or self.gang):
+            if self.gang:
+                self.icsp = Gang_ICSP(PIN_ICSP_MCLR, PIN_ICSP_CLK, PIN_ICSP_GANG_DAT, self.backend)
+            else:
+                self.icsp = ICSP(PIN_ICSP_MCLR, PIN_ICSP_CLK, PIN_ICSP_DAT, ICSP_ENGINE, self.backend)
 
             # with NO_Printer():
             info = self.get_device_info()
 
             self.device_info.update(info)
+            if ICSP_TIMING == 'datasheet':
+                self.icsp.set_timing(info['T'])
+            elif ICSP_TIMING == 'datasheet-internal':
+                self.icsp.set_timing(dict(info['T'], EXTERNAL=False))   # rows by TPINT of the device
         else:
             print('Error: Can not get icsp interface. Check PIN_ICSP_MCLR, PIN_ICSP_CLK, PIN_ICSP_DAT if you use programing  to PIC uC.')
 
         if PIN_I2C_SCL and PIN_I2C_SDA:
-            self.tool_i2c = I2C_Tool(PIN_I2C_SCL, PIN_I2C_SDA)
-            slaves = self.tool_i2c.cmd_scan()
+            self.tool_i2c = I2C_Tool(PIN_I2C_SCL, PIN_I2C_SDA, self.backend)
+            slaves = self.tool_i2c.scan()
             self.device_info.update({'i2c_slave_addr': slaves})
         else:
             print('Error: Can not get i2c interface. Check PIN_I2C_SCL, PIN_I2C_SCL if you use I2C Tool.')
@@ -469,7 +213,7 @@ class Detector:
         self.icsp.set_normal_mode()
 
         device_id = conf[6] & 0x3FE0
-        icsp_setting = DEVICE_LIST.get(device_id)
+        icsp_setting = find_device(device_id) if device_id else None
 
         device_info = {'user_id_location': hexstr(conf[0:4]),
                        'device_id': hexstr([device_id]),
@@ -479,7 +223,11 @@ class Detector:
                        'device_name': icsp_setting['N'] if icsp_setting else None,
                        'P': icsp_setting['P'] if icsp_setting else None,
                        'C': icsp_setting['C'] if icsp_setting else None,
-                       'D': icsp_setting['D'] if icsp_setting else None}
+                       'D': icsp_setting['D'] if icsp_setting else None,
+                       'H': icsp_setting['H'] if icsp_setting else None,
+                       'L': icsp_setting['L'] if icsp_setting else None,
+                       'R': icsp_setting['R'] if icsp_setting else None,
+                       'T': icsp_setting['T'] if icsp_setting else None}
         return device_info
 
     def show_detail(self):
@@ -490,6 +238,7 @@ class Detector:
   Program Memory       : {di['P']}
   Data Memory          : {di['D']}
   Configuration Memory : {di['C']}
+  Latch / Row Erase    : {di['L']} / {di['R']} words
 
 # I2C Tool setting
   I2C Slave Address    : {[hex(x) for x in di['i2c_slave_addr']] or '*** Not Detected ***'}""")
@@ -536,15 +285,45 @@ class Detector:
 class I2C_Tool():
     tgt_addr = None
 
-    def __init__(self, scl, sda):
-        self.i2c = I2C(scl, sda)
+    def __init__(self, scl, sda, backend=None):
+        self.i2c = (backend or Board_Backend()).i2c(scl, sda)
+        self.slaves = None      # cached scan, None: scan again (by scan, reset or an I2C error)
+        self.error = None       # exception of the last failed transfer()
+
+    def scan(self):
+        # the cached slave addresses, the bus is scanned only when invalidated
+        if self.slaves is None:
+            while not self.i2c.try_lock():
+                pass
+
+            try:
+                self.slaves = self.i2c.scan()
+            finally:
+                self.i2c.unlock()
+        return self.slaves      # e.g. mcp23017 = [0x20] (010_0xxx)
+
+    def invalidate(self):
+        self.slaves = None
+
+    def probe(self, address):
+        # one address-only write instead of a scan, True on ACK
+        while not self.i2c.try_lock():
+            pass
+
+        try:
+            self.i2c.writeto(address, b'')
+        except (OSError, RuntimeError):
+            return False
+        finally:
+            self.i2c.unlock()
+        return True
 
     def handler(self, cmd, args):
-        found = [x for x in self.CMD_LIST if cmd in x[0]]
+        found = self.CMD_TABLE.get(cmd)
         if not found:
             print(f'Invalid Command: {cmd}')
         else:
-            return found[0][1](self, args)
+            return found[1](self, args)
 
     def help(self, args):
         if not args:
@@ -559,6 +338,7 @@ class I2C_Tool():
                 print(found[0][2])
 
     def cmd_reset(self, args=[]):
+        self.invalidate()
         try:
             detector.icsp.reset()
         except NameError:
@@ -578,22 +358,18 @@ class I2C_Tool():
         self.i2c.deinit()
 
     def cmd_scan(self, args=[]):
-        slaves = []
-        while not self.i2c.try_lock():
-            pass
-
-        try:
-            slaves = self.i2c.scan()
-        finally:
-            self.i2c.unlock()
-        return slaves           # e.g. mcp23017 = [0x20] (010_0xxx)
+        self.invalidate()
+        slaves = self.scan()
+        prinp('Slaves: ' + (' '.join([hex(x) for x in slaves]) or 'None'))
+        return slaves
 
     def cmd_addr(self, s_args):
         if not s_args:
             print(f'Target Device: {hex(self.tgt_addr)}')
         elif len(s_args) == 1:
-            if int(s_args[0], 16) in [x[2:] for x in self.cmd_scan()]:
-                self.tgt_addr = int(s_args[0], 16)
+            address = int(s_args[0], 16)
+            if address in (self.slaves or []) or self.probe(address):
+                self.tgt_addr = address
                 print(f'Target Device: {hex(self.tgt_addr)}')
             else:
                 print(f'Error: Invalid Slave Address: {s_args[0]}')
@@ -608,6 +384,9 @@ class I2C_Tool():
 
         try:
             self.i2c.writeto(self.tgt_addr, bytes(tx_data))
+        except (OSError, RuntimeError):
+            self.invalidate()
+            raise
         finally:
             self.i2c.unlock()
 
@@ -633,10 +412,13 @@ class I2C_Tool():
             self.i2c.readfrom_into(self.tgt_addr, rx_buf)
         except OSError:
             err = ' ...Error!'
+            self.invalidate()
         except RuntimeError as e:
             print('Error: I2C not respond, need "reset"')
+            self.invalidate()
         except TimeoutError as e:
             print('Error: I2C Timeout, need "reset"')
+            self.invalidate()
         else:
             ret = ' '.join([f'{x:02X}' for x in rx_buf]) + err
             prinp('       => ' + ret)
@@ -667,10 +449,13 @@ class I2C_Tool():
             self.i2c.writeto_then_readfrom(self.tgt_addr, bytes(tx_data), in_buffer=rx_buf)
         except OSError as e:
             err = ' ...Error!'
+            self.invalidate()
         except RuntimeError as e:
             print('Error: I2C not respond, need "reset"')
+            self.invalidate()
         except TimeoutError as e:
             print('Error: I2C Timeout, need "reset"')
+            self.invalidate()
         else:
             ret = ' '.join([f'{x:02X}' for x in rx_buf]) + err
             prinp('       => ' + ret)
@@ -683,86 +468,217 @@ class I2C_Tool():
         _ = list(filter(lambda x: x == path, listdir()))
         return _
 
+    def transfer(self, op):
+        # runs an I2C_Op of a test plan, returns the rx buffer, a text, or None on an I2C error
+        if op.cmd not in TRANSACTIONS:
+            with NO_Printer():
+                return self.handler(op.cmd, op.args)
+
+        while not self.i2c.try_lock():
+            pass
+
+        try:
+            if op.cmd == 'R':
+                self.i2c.readfrom_into(self.tgt_addr, op.rx)
+            elif op.cmd == 'WR':
+                self.i2c.writeto_then_readfrom(self.tgt_addr, op.tx, op.rx)
+            else:
+                self.i2c.writeto(self.tgt_addr, op.tx)
+                return 'NO-RESP'
+        except (OSError, RuntimeError) as e:    # NACK, timeout
+            self.error = e
+            self.invalidate()
+            return None
+        finally:
+            self.i2c.unlock()
+        return op.rx
+
     def cmd_test(self, s_args):
-        if len(s_args) != 1:
+        # test <file> [json|junit] [quiet] [all]
+        if not s_args:
             print('Error: File is not specified')
             return
 
+        report = I2C_REPORT
+        quiet = I2C_QUIET
+        run_all = I2C_TEST_RUN_ALL
+        for option in [x.upper() for x in s_args[1:]]:
+            if option in REPORTS:
+                report = option
+            elif option == 'QUIET':
+                quiet = True
+            elif option == 'ALL':
+                run_all = True
+            else:
+                print(f'Error: Invalid option: {option}')
+                return
+
         test_path = s_args[0]
 
         if not self.isfile(test_path):
             print(f'Error: File not found: "{test_path}"')
             return
 
-        with open(test_path) as f:
-            lines =[x.strip() for x in f.readlines()]
+        try:
+            plan, lines = load_test(test_path)
+        except Test_Error as e:
+            print(f'Error: {test_path}: {e}')
+            return
 
         RED   = '\033[91m'
         GREEN = '\033[92m'
         G = '\033[30m\033[42m'
         END   = '\033[0m'
-        print('-' * 60, end='')
-        func_cmd = ''
-        func_param = []
-        print_param = []
+        out = ['-' * 60]            # printed at the end
+        results = []
         test_num = 0
         cnt_ok = 0
         cnt_ng = 0
-        for ln, s in enumerate(lines, start=1):
-            if s == '' or s.startswith('#'):   # empty line or comment
-                continue
-            elif m := re.match('\=>(.*)', s):
-                print('=> ', end='')
-                ok = ' '.join(m.group(1).upper().split())
-                with NO_Printer():
-                    resp = self.handler(func_cmd, func_param)
-
-                if resp == ok:
-                    print(f'{resp:12}\t{G} PASS {END}\t{ln:8}', end='')
-                    cnt_ok += 1
+        transactions = 0
+        settle_stats = Settle_Stats()
+        t_start = time.monotonic_ns()
+        for op in plan:
+            if op.header:
+                test_num += 1
+                out.append(f'\n{test_num:3}: {op.header:20} ')
+            if op.cmd not in TRANSACTIONS and not quiet:
+                print(''.join(out), end='')     # before the command prints anything
+                out = []
+            if op.expect is None:
+                if not run_all:
+                    continue
+                if op.cmd == 'PRINT':
+                    out.append(' ' + ' '.join(op.args) + ' \n')   # as cmd_print(), in the report
                 else:
-                    print(f'{resp:12}\t{RED} FAIL {END}\t{ln:8} Should be "{ok}"', end='')
-                    cnt_ng += 1
-            elif m := re.match('\?(.*)>(.*)', s):
-                ps = m.group(1)
-                bs1 = '\b' * len(ps)
-                bs2 = ' ' * len(ps)
-                print('?> ' + ps, end='')
-                ok = ' '.join(m.group(2).upper().split())
-                cnt_ok_old = cnt_ok
-                TIMEOUT_SEC = 10
-                timeout_start = now = time.monotonic()
-                while now < timeout_start + TIMEOUT_SEC:
-                    with NO_Printer():
-                        resp = self.handler(func_cmd, func_param)
-
-                    if resp == ok:
-                        print(f'{bs1}{bs2}{bs1}{resp:12}\t{G} PASS {END}\t{ln:8}', end='')
-                        cnt_ok += 1
-                        break
-                    now = time.monotonic()
-
-                if cnt_ok == cnt_ok_old:
-                    print(f'{bs1}{bs2}{bs1}{resp:12}\t{RED} FAIL {END}\t{ln:8} Should be "{ok}"', end='')
-                    cnt_ng += 1
+                    self.transfer(op)
+                    if op.cmd in TRANSACTIONS:
+                        transactions += 1
+                continue
 
+            if op.poll is None:
+                t = time.monotonic_ns()
+                resp = self.transfer(op)
+                us = (time.monotonic_ns() - t) // 1000
+                polls = 1
+                ok = resp == op.expect
+                out.append('=> ')
+                settle = ''
             else:
-                ll = s.upper().split()
-                func_cmd = ll[0]
-                func_param = ll[1:]
-
-                if func_cmd in ['R', 'WR']:
-                    test_num += 1
-                    print(f'\n{test_num:3}: {s:20} ', end='')
+                out.append('?> ')
+                if not quiet:
+                    print(''.join(out) + op.poll, end='')   # shown while waiting
+                    out = []
+                resp, ok, sec, polls = wait_until(self.transfer, op)
+                if not quiet:
+                    bs = '\b' * len(op.poll)
+                    print(bs + ' ' * len(op.poll) + bs, end='')
+                us = int(sec * 1e6)
+                if ok:
+                    settle_stats.add(sec, polls)
+                settle = f' {sec * 1000:.1f} ms/{polls}'
+            if op.cmd in TRANSACTIONS:
+                transactions += polls
+            results.append(Test_Result(op, resp, ok, us, polls))
+
+            if ok:
+                out.append(f'{format_response(resp):12}\t{G} PASS {END}\t{op.line:8}{settle}')
+                cnt_ok += 1
+            else:
+                out.append(f'{format_response(resp):12}\t{RED} FAIL {END}\t{op.line:8}{settle} Should be "{format_response(op.expect)}"')
+                cnt_ng += 1
 
-        print('\n' + '-' * 60)
+        sec = (time.monotonic_ns() - t_start) / 1e9
+        if quiet:
+            out = []
+        else:
+            out.append('\n' + '-' * 60 + '\n')
         if cnt_ok == 0 and cnt_ng == 0:
-            print(f'{RED}NO TESTS (Lines: {len(lines)}){END}')
+            out.append(f'{RED}NO TESTS (Lines: {lines}){END}\n')
         elif cnt_ok == cnt_ok + cnt_ng:
-            print(f'{GREEN}ALL TESTS PASSED SUCCESSFULLY (Tests: {cnt_ok}, Lines: {len(lines)}){END}')
+            out.append(f'{GREEN}ALL TESTS PASSED SUCCESSFULLY (Tests: {cnt_ok}, Lines: {lines}){END}\n')
         else:
-            print(f'{RED}FAILED: {cnt_ng}/{cnt_ok + cnt_ng}, Lines: {len(lines)}{END}')
-        print()
+            out.append(f'{RED}FAILED: {cnt_ng}/{cnt_ok + cnt_ng}, Lines: {lines}{END}\n')
+        out.append(f'{transactions} transactions in {sec:.2f} s ({transactions / sec if sec else 0:.0f}/s)\n')
+        if settle_stats.count:
+            out.append(settle_stats.summary() + '\n')
+        print(''.join(out))
+
+        if report:
+            summary = {'tests': cnt_ok + cnt_ng, 'passed': cnt_ok, 'failed': cnt_ng,
+                       'transactions': transactions, 'sec': sec}
+            self.write_report(test_path, report, results, summary)
+
+    def cmd_bench(self, s_args):
+        # bench <count|seconds>s <w|r|wr> [data ...] [size]
+        if len(s_args) < 2 or s_args[1].upper() not in TRANSACTIONS:
+            print('Error: e.g. "bench 1000 wr 2 C2 4" or "bench 5s r 8"')
+            return
+
+        limit = s_args[0].lower()
+        try:
+            if limit.endswith('s'):
+                count, seconds = None, float(limit[:-1])
+            else:
+                count, seconds = int(limit), None
+        except ValueError:
+            print(f'Error: Invalid count or seconds: {s_args[0]}')
+            return
+        if not (count if seconds is None else seconds) > 0:
+            print(f'Error: The count or seconds should be positive: {s_args[0]}')
+            return
+
+        try:
+            op = compile_command(None, ' '.join(s_args[1:]))
+        except Test_Error as e:
+            print(f'Error: {e}')
+            return
+
+        size = len(op.tx) + (len(op.rx) if op.rx else 0)
+        histogram = Latency_Histogram()
+        errors = {}
+        n = 0
+        print(f'Bench {op.text} to {hex(self.tgt_addr)}, Ctrl-C to stop...')
+        t_start = time.monotonic_ns()
+        t_end = t_start + int(seconds * 1e9) if seconds is not None else None
+        try:
+            while (count is None or n < count) and (t_end is None or time.monotonic_ns() < t_end):
+                t = time.monotonic_ns()
+                resp = self.transfer(op)
+                us = (time.monotonic_ns() - t) // 1000
+                n += 1
+                if resp is None:
+                    kind = error_kind(self.error)
+                    errors[kind] = errors.get(kind, 0) + 1
+                else:
+                    histogram.add(us)
+        except KeyboardInterrupt:
+            pass
+        sec = (time.monotonic_ns() - t_start) / 1e9
+
+        ok = histogram.count
+        out = [f'{n} transactions in {sec:.2f} s: {n / sec if sec else 0:.0f}/s, '
+               f'{ok * size / sec if sec else 0:.0f} bytes/s, '
+               f'errors {n - ok}' + ''.join(f', {kind} {errors[kind]}' for kind in sorted(errors))]
+        out += histogram.lines()
+        print('\n'.join(out))
+
+    def write_report(self, test_path, report, results, summary):
+        # to a file next to the test file and/or the data channel, see I2C_REPORT_TO
+        render, ext = REPORTS[report]
+        text = render(test_path, results, summary)
+        if I2C_REPORT_TO in ('file', 'both'):
+            name = test_path.rsplit('.', 1)[0] + ext
+            try:
+                with open(name, 'w') as f:
+                    f.write(text)
+                print(f'Report: {name}')
+            except OSError:
+                print(f'Error: Can not write {name}, CIRCUITPY is read-only (see boot.py)')
+        if I2C_REPORT_TO in ('data', 'both'):
+            if upload:
+                upload.serial.write(text.encode())
+            else:
+                print('Error: No data channel for the report (see boot.py)')
 
     CMD_LIST = (
 (['HELP', 'H', '?'], help,
@@ -812,23 +728,17 @@ class I2C_Tool():
 
 (['TEST'], cmd_test,
 '''e.g. test i2c_1    : Start test for i2c command according to
-                      the test file "i2c_1".'''))
-
-class NO_Printer:
-    def __enter__(self):
-        global prinp
-        self.func_orig = prinp
-        prinp = self.nop
-
-    def __exit__(self, exc_type, exc_value, tracebak):
-        global prinp
-        prinp = self.func_orig
+                      the test file "i2c_1".
+     test i2c_1 json quiet : Write the report in JSON lines (or junit),
+                      print only the summary
+     test i2c_1 all : Run also the commands without an expectation'''),
 
-    def nop(*objs, sep='', end='\n'):
-        pass
+(['BENCH'], cmd_bench,
+'''e.g. bench 1000 wr 2 C2 4 : Write-then-read 1000 times, then show
+                      transactions/s, bytes/s, errors and latency
+     bench 5s r 8  : Read 8 bytes for 5 seconds'''))
 
-def prinp(*objs, sep='', end='\n'):
-    print(*objs, sep=sep, end=end)
+    CMD_TABLE = {name: x for x in CMD_LIST for name in x[0]}
 
 def print_help(di):
     print(   f'Auto Prog : {"Yes" if auto_prog else "No"}')
@@ -843,6 +753,9 @@ def print_help(di):
         prinp('  EP/ED     : Erase  Program/Data               Memory')
         prinp('  WP/WD/WC  : Write  Program/Data/Configuration Memory')
         prinp('  VP/VD/VC  : Verify Program/Data/Configuration Memory')
+        prinp('  DP        : Delta  Program Memory (rewrite changed rows only)')
+        prinp('  BC        : Blank  Check Program/Configuration/Data Memory')
+        prinp('  RH        : Read   all Memory into a .hex file (read_<device>.hex)')
         ## temporary disabled ##
         # prinp('RC        : Read Configuration Memory')
     else:
@@ -862,60 +775,240 @@ class LVP_Mode:
     def __exit__(self, exc_type, exc_value, traceback):
         detector.icsp.set_normal_mode()
 
+def delta_program(config=True):
+    # config: write and verify the configuration words again after a fallback to bulk erase,
+    #         False when the caller does WC and VC after it (Auto-Prog)
+    di = detector.device_info
+    result = detector.icsp.delta_program_memory(read_hex_region('P'), di['R'], read_hex_region('C'), di['L'])
+    if not result:
+        return
+    saved = result['full_sec'] - result['sec']      # the read back included
+    prinp(f'{result["mode"]}: {result["touched"]}/{result["rows"]} rows in {result["sec"]:.2f} s'
+          f' (full WP about {result["full_sec"]:.2f} s' + (f', saved {saved:.2f} s)' if saved > 0 else ')'))
+    if result['mode'] == 'bulk' and config:
+        prinp('Configuration words are erased by bulk erase, WC and VC')
+        detector.icsp.write_configulation(read_hex_region('C'))
+        verify_data('C')
+
+def write_verify_program(erase=True, retries=0):
+    # WP and VP in one pass, see ICSP.write_verify_program_memory()
+    di = detector.device_info
+    errors, stats = detector.icsp.write_verify_program_memory(read_hex_region('P'), erase, di['L'], INTERLEAVE_WINDOW,
+                                                              True, retries, di['R'])
+    rows = stats['rows'] or 1
+    prinp(f'{stats["rows"]} rows in {stats["sec"]:.2f} s: program {stats["program_sec"] * 1000 / rows:.2f} ms/row, '
+          f'verify {stats["verify_sec"] * 1000 / rows:.2f} ms/row, walk {stats["walk_sec"] * 1000 / rows:.2f} ms/row')
+    return check_verify(errors, True)
+
+def blank_check():
+    di = detector.device_info
+    found = detector.icsp.blank_check(di['P'], di['C'], di['D'])
+    if found:
+        prinp(f'Not Blank: {found[0]} {found[1]:04X}: {found[2]:04X}')
+    else:
+        prinp('Blank')
+    return not found
+
+def read_device_image():
+    di = detector.device_info
+    with LVP_Mode():
+        return detector.icsp.read_image(di['P'], di['C'], di['D'])
+
+def export_hex():
+    # reads the device into a .hex file on CIRCUITPY, which becomes the newest hex file
+    name = f'read_{detector.device_info["device_name"]}.hex'
+    records = write_hex_file(name, read_device_image())
+    if records is None:
+        prinp(f'Error: Can not write {name}, CIRCUITPY is read-only (see boot.py)')
+    else:
+        prinp(f'{name}: {records} records')
+
 def proc_auto_prog():
-    print('WP', end=', ')
-    led.ON_WRITE()
-    detector.icsp.write_program_memory(read_hex_file(hex_file, device['P']))     # WP
+    device = detector.device_info
+    erase = True
+    if AUTO_PROG_BLANK_CHECK and not AUTO_PROG_DELTA:
+        print('BC', end=', ')
+        led.ON_READ()
+        with NO_Printer():
+            erase = not blank_check()                                   # BC
+
+    if AUTO_PROG_INTERLEAVED and not AUTO_PROG_DELTA:
+        print('WP+VP', end=', ')
+        led.ON_WRITE()
+        if(write_verify_program(erase, RETRY_MAX)):                     # WP+VP
+           return 'Error: Program memory'
+    else:
+        if AUTO_PROG_DELTA:
+            print('DP', end=', ')
+            led.ON_WRITE()
+            delta_program(False)                                        # DP, WC below
+        else:
+            print('WP', end=', ')
+            led.ON_WRITE()
+            detector.icsp.write_program_memory(read_hex_region('P'), erase=erase, latch=device['L'])    # WP
 
-    print('VP', end=', ')
-    led.ON_VERIFY()
-    if(verify_data(device['P'], False, detector.icsp.read_program_memory)):      # VP
-       return 'Error: Program memory'
+        print('VP', end=', ')
+        led.ON_VERIFY()
+        if(verify_data('P', True, RETRY_MAX)):                          # VP
+           return 'Error: Program memory'
 
     if device['D'][1] > 0:      # check data memory size
         print('WD', end=', ')
         led.ON_WRITE()
-        detector.icsp.write_data_memory(read_hex_file(hex_file, device['D']))    # WD
+        detector.icsp.write_data_memory(read_hex_region('D'), erase=erase)      # WD
 
         print('VD', end=', ')
         led.ON_VERIFY()
-        if(verify_data(device['D'], False, detector.icsp.read_data_memory)):     # VD
+        if(verify_data('D', True, RETRY_MAX)):                          # VD
            return 'Error: Data memory'
 
     print('WC', end=', ')
     led.ON_WRITE()
-    detector.icsp.write_configulation(read_hex_file(hex_file, device['C']))      # WC
+    detector.icsp.write_configulation(read_hex_region('C'))             # WC
 
     print('VC', end=', ')
     led.ON_VERIFY()
-    if(verify_data(device['C'], True, None)):                           # VC
+    if(verify_data('C', True)):                                         # VC
        return 'Error: Config memory'
 
+    if detector.gang and any(detector.icsp.failed):
+        return 'Error: ' + ', '.join(f'CH{ch}' for ch, failed in enumerate(detector.icsp.failed) if failed)
+
     return None    # None: success
 
+class Production_Stats:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.passed = 0
+        self.failed = 0
+        self.cycle_total = 0.0      # seconds of programming and verifying
+
+    def add(self, ok, cycle):
+        if ok:
+            self.passed += 1
+        else:
+            self.failed += 1
+        self.cycle_total += cycle
+
+    def show(self):
+        units = self.passed + self.failed
+        elapsed = time.monotonic() - self.start
+        uph = units * 3600 / elapsed if elapsed else 0
+        cycle = self.cycle_total / units if units else 0
+        prinp(f'Units {units} (Pass {self.passed}, Fail {self.failed}), {uph:.0f} UPH, '
+              f'cycle {cycle:.2f} s avg, {elapsed / units if units else 0:.1f} s per unit')
+
+def target_present():
+    # Device ID of the detected device is on ICSPDAT (target 0 in gang mode)
+    with LVP_Mode():
+        device_id = detector.icsp.read_device_id() & 0x3FE0
+    return hexstr([device_id]) == detector.device_info['device_id']
+
+def wait_target(present):
+    # waits insertion (present=True) or removal (False) of a target,
+    # returns False when Auto-Prog switch is released
+    count = 0
+    while count < PRODUCTION_DEBOUNCE:
+        if SW.value:
+            return False
+        count = count + 1 if target_present() == present else 0
+        if count < PRODUCTION_DEBOUNCE:
+            time.sleep(PRODUCTION_POLL)
+    return True
+
+def proc_production():
+    # programs a target on every insertion until Auto-Prog switch is released
+    global hex_file
+    stats = Production_Stats()
+    print(f'Production {hex_file}, release Auto Prog switch to stop.')
+    while wait_target(True):
+        if not uploaded:
+            hex_file = get_latest_hex(sweep=True)[0] or hex_file   # parsed once, kept while the file is not changed
+        print(f'Programming {hex_file}... ', end='')
+        led.ON_WRITE()
+        t = time.monotonic()
+        with LVP_Mode():
+            result = proc_auto_prog()
+        stats.add(result is None, time.monotonic() - t)
+        if result:
+            print(f'Failed, {result}')
+            led.set_error(2)
+            led_error.ON()
+        else:
+            print('Done')
+            led.set_error(0)
+            led_error.OFF()
+        led.OFF()
+        stats.show()
+        print('Remove the target...')
+        if not wait_target(False):
+            break
+        print('Insert the next target...')
+    stats.show()
+
 def fmt_time(itime):
     dt = datetime.fromtimestamp(itime)
     return f'{dt.year}-{dt.month}-{dt.day} {dt.hour}:{dt.minute}:{dt.second}'
 
-def list_hex_file():
-    return filter(lambda x: len(x) > 5 and x[-4:].lower() == '.hex', listdir())
-
-def get_latest_hex():
-    hexs = list(list_hex_file())
-    if hexs:
-        tstamps = [stat(x)[8] for x in hexs]    # mtime
-        max_idx = tstamps.index(max(tstamps))
-        return (hexs[max_idx], fmt_time(tstamps[max_idx]))
-    else:
-        return (None, None)
+def get_latest_hex(sweep=False):
+    # the newest hex file, parsed and validated by the watcher as soon as it appears
+    # sweep: stat all the files, an older file may have been overwritten in place
+    device = detector.device_info if detector.device_info['P'] else None
+    hex_path, mtime = hex_watcher.poll(device, sweep)
+    return (hex_path, fmt_time(mtime)) if hex_path else (None, None)
 
+def refresh_hex_file():
+    # before programming or verifying, the file may have changed while waiting a command
+    global hex_file
+    if not uploaded:
+        hex_file = get_latest_hex(sweep=True)[0] or hex_file
 
 def check_hex_file():
-    hex_path = None
-    while not hex_path:
+    global uploaded
+    while True:
         hex_path, tstamp = get_latest_hex()
-        time.sleep(0.2)
-    return (hex_path, tstamp)
+        if uploaded and (hex_path, tstamp) != uploaded_over:
+            uploaded = None             # a hex file dropped after the upload takes over
+        if uploaded:
+            return (UPLOAD_NAME, None)
+        if hex_path:
+            return (hex_path, tstamp)
+        if not serve_upload():
+            time.sleep(0.2)
+
+def serve_upload():
+    # serves the upload channel, returns True when an image is uploaded
+    global uploaded, uploaded_over, hex_file
+    request = upload.poll(detector.device_info) if upload else None
+    if request is None:
+        return False
+    command, image = request
+    if command == 'R':
+        led.ON_READ()
+        upload.send_image(detector.device_info, read_device_image())
+        led.OFF()
+        prinp('Image read out.')
+        return False
+    uploaded = image
+    uploaded_over = get_latest_hex()
+    hex_file = UPLOAD_NAME
+    prinp(f'Image uploaded.')
+    if command == 'P':
+        print(f'Programming {hex_file}... ', end='')
+        t = time.monotonic()
+        with LVP_Mode():
+            result = proc_auto_prog()
+        print('Failed' if result else 'Done')
+        upload.reply(f'FAIL {result}' if result else f'DONE {time.monotonic() - t:.3f}')
+    return True
+
+def read_command():
+    # console input, serving the upload channel while waiting for it
+    while upload and not supervisor.runtime.serial_bytes_available:
+        if serve_upload():
+            print('> ', end='')
+        time.sleep(0.01)
+    return input()
 
 def halt():
     while True:
@@ -928,6 +1021,9 @@ if board.board_id == 'Seeeduino XIAO RP2040':
     PIN_ICSP_MCLR = board.D6
     PIN_ICSP_CLK = board.D8
     PIN_ICSP_DAT = board.D7
+    PIN_ICSP_GANG_DAT = None    # no spare pins for gang programming
+    ICSP_ENGINE = 'pio'         # 'pio', 'fast' or 'gpio'
+    ICSP_TIMING = 'internal'    # 'internal' (5 ms, safe), 'datasheet' (externally timed rows) or 'datasheet-internal'
     PIN_SW_AUTO = board.D3
     led_error = LED_MONO(board.D2)
     led = LED_NEOPIXEL()
@@ -939,6 +1035,9 @@ elif board.board_id == 'raspberry_pi_pico':
     PIN_ICSP_MCLR = board.GP18
     PIN_ICSP_CLK = board.GP17
     PIN_ICSP_DAT = board.GP16
+    PIN_ICSP_GANG_DAT = [board.GP16, board.GP19, board.GP20, board.GP21]   # ICSPDAT of target 0-3, see ICSP_GANG
+    ICSP_ENGINE = 'pio'         # 'pio', 'fast' or 'gpio'
+    ICSP_TIMING = 'internal'    # 'internal' (5 ms, safe), 'datasheet' (externally timed rows) or 'datasheet-internal'
     PIN_SW_AUTO = board.GP14
     led_error = LED_MONO(board.GP15)
     led = LED_MONO(board.LED)
@@ -950,9 +1049,18 @@ else:
     prinp(f'Error: Unsuppored Board ID: {board.board_id}')
     halt()
 
+ICSP_GANG = False       # True: program the targets on PIN_ICSP_GANG_DAT at once (MCLR/ICSPCLK shared)
+
 with NO_Printer():
     detector = Detector()
 
+hex_watcher = Hex_Watcher()
+
+UPLOAD_NAME = '<upload>'
+upload = Upload_Channel(usb_cdc.data) if usb_cdc and usb_cdc.data else None
+uploaded = None             # image by the upload channel, used instead of the hex file
+uploaded_over = None        # the newest hex file at the upload
+
 # with NO_Printer():
 # info = self.get_device_info()
 
@@ -965,7 +1073,20 @@ led.set_error(0)
 led.OFF()
 led_error.OFF()
 
-RETRY_MAX = 5
+RETRY_MAX = 5               # Auto-Prog rewrites a row failed on verify up to this times, 0: no retry
+AUTO_PROG_DELTA = False     # True: Auto-Prog rewrites changed rows only (DP) instead of WP
+AUTO_PROG_INTERLEAVED = False   # True: Auto-Prog reads back every INTERLEAVE_WINDOW words as programmed (WP+VP),
+                                # fails earlier but is slower than WP then VP
+INTERLEAVE_WINDOW = 256     # words programmed before the read back
+AUTO_PROG_BLANK_CHECK = False   # True: Auto-Prog skips the bulk erase for a blank device (BC is slower than the erase)
+AUTO_PROG_CONTINUOUS = False    # True: Auto-Prog programs a target on every insertion (production), False: once
+I2C_REPORT = None           # 'JSON' or 'JUNIT': I2C Tool test writes the report, also by 'test <file> json'
+I2C_REPORT_TO = 'file'      # 'file' (next to the test file), 'data' (usb_cdc.data) or 'both'
+I2C_QUIET = False           # True: I2C Tool test prints only the summary
+I2C_TEST_RUN_ALL = False    # True: I2C Tool test runs also the commands without an expectation, by 'test <file> all'
+I2C_PROBE = False           # True: I2C Tool checks the target address on every prompt (an address-only write)
+PRODUCTION_POLL = 0.2       # seconds between the Device ID polls
+PRODUCTION_DEBOUNCE = 3     # same result in a row for insertion/removal
 
 print()
 print('# RP2PIC - PIC16F1xxx LV-ICSP Programmer')
@@ -984,6 +1105,12 @@ while True:                 # command loop (top)
             continue                    # prints error infinitely til the proper connections
 
         print('Auto Prog detected.')
+        refresh_hex_file()
+        if AUTO_PROG_CONTINUOUS:
+            proc_production()
+            led.OFF()
+            continue                    # switch released, to command mode
+
         print(f'Programming {hex_file}... ', end='')
         with LVP_Mode():
             result = proc_auto_prog()
@@ -1001,7 +1128,7 @@ while True:                 # command loop (top)
 
     # command mode
     print('> ', end='')
-    text = input().strip().upper()
+    text = read_command().strip().upper()
     if text in ['?', 'H', 'HELP']:
         print_help(detector.device_info)
     elif text == 'RESET':
@@ -1009,7 +1136,8 @@ while True:                 # command loop (top)
         detector.icsp.reset()
         led.set_error(0)
         led.OFF
-    elif text in ['RP', 'RD', 'EP', 'ED', 'WP', 'WD', 'WC', 'VP', 'VD', 'VC', 'TF']:
+    elif text in ['RP', 'RD', 'EP', 'ED', 'WP', 'WD', 'WC', 'VP', 'VD', 'VC', 'DP', 'BC', 'RH', 'TF']:
+        refresh_hex_file()
         if detector.diagnose_icsp() < 0:
             detector.show_detail()
             with NO_Printer():
@@ -1037,6 +1165,9 @@ while True:                 # command loop (top)
             led.ON_READ()
             with LVP_Mode():
                 detector.icsp.read_data_memory(detector.device_info['D'][1])
+        elif text == 'RH':
+            led.ON_READ()
+            export_hex()
         elif text == 'EP':
             led.ON_ERASE()
             with LVP_Mode():
@@ -1048,7 +1179,7 @@ while True:                 # command loop (top)
         elif text == 'WP':
             led.ON_WRITE()
             with LVP_Mode():
-                detector.icsp.write_program_memory(read_hex_file(hex_file, detector.device_info['P']))
+                detector.icsp.write_program_memory(read_hex_region('P'), latch=detector.device_info['L'])
             # TODO do not overwrite configuration word
             # なぜかWPでconfiguration wordを書くとおかしくなる(WPのあとでWCで書くと問題ない)
             #  .hex Data
@@ -1057,51 +1188,61 @@ while True:                 # command loop (top)
             #    0000: 3FFF 3FFF <--!!
             #
             # TODO: 最悪 :02 0000 04 0001 F9 から次の:02 0000 04 0001以外 まで無視するとか)
+        elif text == 'BC':
+            led.ON_READ()
+            with LVP_Mode():
+                blank_check()
+        elif text == 'DP':
+            led.ON_WRITE()
+            with LVP_Mode():
+                delta_program()
         elif text == 'WD':
             led.ON_WRITE()
             with LVP_Mode():
-                detector.icsp.write_data_memory(read_hex_file(hex_file, detector.device_info['D']))
+                detector.icsp.write_data_memory(read_hex_region('D'))
         elif text == 'WC':
             led.ON_WRITE()
             with LVP_Mode():
-                detector.icsp.write_configulation(read_hex_file(hex_file, detector.device_info['C']))
+                detector.icsp.write_configulation(read_hex_region('C'))
         elif text == 'VP':
             led.ON_VERIFY()
             with LVP_Mode():
-                verify_data(detector.device_info['P'], False, detector.icsp.read_program_memory)
+                verify_data('P')
         elif text == 'VD':
             led.ON_VERIFY()
             with LVP_Mode():
-                verify_data(detector.device_info['D'], False, detector.icsp.read_data_memory)
+                verify_data('D')
         elif text == 'VC':
             led.ON_VERIFY()
             with LVP_Mode():
-                verify_data(detector.device_info['C'], True, None)
+                verify_data('C')
         elif text == 'TF':
-            data = read_hex_file(hex_file, detector.device_info['P'])
+            data = read_hex_region('P')
             if not data: continue
             prinp('Program Memory');        print_data(data)
 
-            data = read_hex_file(hex_file, detector.device_info['C'])
+            data = read_hex_region('C')
             if not data: continue
             prinp('Configuration Memory');  print_data(data)
 
-            data = read_hex_file(hex_file, detector.device_info['D'])
+            data = read_hex_region('D')
             if not data: continue
             prinp('Data Memory');           print_data(data)
 
     elif text in ['I2C', 'IIC', 'II']:
         tool = detector.tool_i2c
         while True:                     # command loop (I2C)
-            slaves = tool.cmd_scan()
+            if I2C_PROBE and tool.slaves and tool.tgt_addr in tool.slaves and not tool.probe(tool.tgt_addr):
+                tool.invalidate()               # the target is gone, scan again
+            slaves = tool.scan()                # cached until scan, reset or an I2C error
             if not slaves:
                 print('No slave device')
                 break
 
             elif len(slaves) == 1:
                 tool.tgt_addr = slaves[0]       # auto setting target device address
-            else:
-                print(f'Choose target device: {" ".join(slaves)}')
+            elif tool.tgt_addr not in slaves:
+                print(f'Choose target device: {" ".join([hex(x) for x in slaves])}')
                 print('e.g. "addr 2b" to choose 0x2B as a target device address')
 
             print(f'I2C {hex(tool.tgt_addr)}> ', end='')
@@ -1111,7 +1252,7 @@ while True:                 # command loop (top)
 
             cmd = line[0].upper()
             args = line[1:]
-            invalid_args = [] if cmd in ['TEST', 'PRINT'] else [x for x in args if len(x) > 2]
+            invalid_args = [] if cmd in ['TEST', 'PRINT', 'BENCH'] else [x for x in args if len(x) > 2]
 
             if invalid_args:
                 print(f'Invalid Data: {" ".join(invalid_args)}')
@@ -0,0 +1,43 @@
+# ----------------------------------------------------------------------------
+# Device Database
+#
+# Devices are described in DEVICE_DB (devices.txt on CIRCUITPY), one device
+# per line starting with the Device ID. The file is scanned by the leading
+# Device ID and only the line of the detected device is parsed, so adding a
+# PIC is a line in devices.txt.
+
+from icsp import TIMING_PIC16F1XXX
+
+DEVICE_DB = 'devices.txt'
+
+
+def parse_device(line):
+    # 'ID Name Flash EEPROM HEF Config Latch Row TPINT TERAB TENTS' -> device info
+    f = line.split()
+    hef = None if f[4] == '-' else [int(x, 16) for x in f[4].split('+')]
+    timing = dict(TIMING_PIC16F1XXX)
+    timing.update({'TPINT': float(f[8]) * 1e-3,
+                   'TERAB': float(f[9]) * 1e-3,
+                   'TENTS': float(f[10]) * 1e-3})
+    return {'N': f[1],                                  # Device Name
+            'P': [0x0000, int(f[2], 16), 0x3FFF],       # Address, Size, Value
+            'C': [0x8007, int(f[5]), 0x3FFF],           # Address, Size, Value
+            'D': [0xF000, int(f[3], 16), 0x00FF],       # Address, Size, Value
+            'H': hef,                                   # High-Endurance Flash: Address, Size
+            'L': int(f[6]),                             # Write Latches (words)
+            'R': int(f[7]),                             # Row Erase Size (words)
+            'T': timing}                                # Timing Profile, see ICSP.TIMING
+
+
+def find_device(device_id, name=DEVICE_DB):
+    key = '%04X' % device_id
+    try:
+        with open(name, 'r') as f:
+            for line in f:
+                if line.startswith(key):
+                    return parse_device(line)
+    except OSError as e:
+        print(f'Error: Can not read the device database {name}, {e}')
+    except (IndexError, ValueError):
+        print(f'Error: Broken entry for Device ID {key} in {name}')
+    return None
@@ -0,0 +1,178 @@
+# ----------------------------------------------------------------------------
+# Gang Programming
+#
+# Several targets share MCLR and ICSPCLK, each target has its own ICSPDAT.
+# The same frames are shifted out to all the targets at once, and on a read
+# frame every ICSPDAT is sampled on the same clock, so one pass programs and
+# verifies all the targets with a result for each of them.
+#
+#   icsp = Gang_ICSP(MCLR, ICSPCLK, [ICSPDAT0, ICSPDAT1, ...])
+#   icsp.write_program_memory(image)            # to all the targets
+#   icsp.verify_program_memory(image)           # [errors of target 0, errors of target 1, ...]
+#   icsp.retry_program_memory(image, errors)    # rewrites the failed rows on all the targets
+#
+# Reads other than verify (RP/RD, detection) return the words of target 0.
+
+from array import array
+from icsp import ICSP, FastGPIO_Engine
+
+
+class Gang_Engine(FastGPIO_Engine):
+    # FastGPIO_Engine with a list of ICSPDAT
+    def __init__(self, ICSPCLK, ICSPDATS, sleep):
+        self.ICSPCLK = ICSPCLK
+        self.ICSPDATS = ICSPDATS
+        self.sleep = sleep
+        for dat in ICSPDATS:
+            dat.value = False
+        self.level = 0
+        self.words = [0] * len(ICSPDATS)    # words of all the targets by the last read frame
+
+    def deinit(self):
+        self.ICSPCLK.deinit()
+        for dat in self.ICSPDATS:
+            dat.deinit()
+
+    def _clock_out(self, bits):
+        clk = self.ICSPCLK
+        dats = self.ICSPDATS
+        level = self.level
+        for bit in bits:
+            clk.value = True
+            if bit != level:
+                level = bit
+                for dat in dats:
+                    dat.value = bit
+            clk.value = False
+        self.level = level
+
+    def _clock_in(self):
+        # 16 clocks with all ICSPDAT as input, returns the word of target 0
+        clk = self.ICSPCLK
+        dats = self.ICSPDATS
+        words = self.words
+        for dat in dats:
+            dat.switch_to_input()
+        clk.value = True                # start bit
+        clk.value = False
+        for ch in range(len(dats)):
+            words[ch] = 0
+        for i in range(14):
+            clk.value = True
+            for ch, dat in enumerate(dats):
+                if dat.value:
+                    words[ch] |= 1 << i
+            clk.value = False
+        clk.value = True                # stop bit
+        clk.value = False
+        for dat in dats:
+            dat.switch_to_output(value=self.level)
+        return words[0]
+
+    def read_words_all(self, n, intos, command=0x04):
+        # intos: a buffer for each target
+        send_command = self.send_command
+        clock_in = self._clock_in
+        words = self.words
+        increment = self.CMD_INCREMENT_ADDRESS
+        for i in range(n):
+            send_command(command)
+            clock_in()
+            for ch, into in enumerate(intos):
+                into[i] = words[ch]
+            send_command(increment)
+        return intos
+
+
+class Gang_ICSP(ICSP):
+    def __init__(self, MCLR, ICSPCLK, ICSPDATS, backend=None):
+        self.channels = len(ICSPDATS)
+        self.failed = bytearray(self.channels)      # by verify, cleared by set_lvp_mode()
+        self.failed_before = self.failed            # by the verify of the other memories
+        super().__init__(MCLR, ICSPCLK, ICSPDATS, 'gang', backend)
+
+    def create_engine(self, engine, ICSPCLK, ICSPDATS, backend):
+        dats = [backend.output(dat) for dat in ICSPDATS]
+        return Gang_Engine(backend.output(ICSPCLK), dats, backend.sleep), engine
+
+    def set_lvp_mode(self):
+        self.failed = bytearray(self.channels)
+        self.failed_before = self.failed
+        super().set_lvp_mode()
+
+    # The first verify of a memory keeps the results so far, the retries of the
+    # memory (verify_memory() again, from row 0 or later) replace only its own.
+    def verify_program_memory(self, data, first=True):
+        self.failed_before = bytearray(self.failed)
+        return super().verify_program_memory(data, first)
+
+    def verify_configuration(self, data, first=True):
+        self.failed_before = bytearray(self.failed)
+        return super().verify_configuration(data, first)
+
+    def verify_data_memory(self, data, first=True):
+        self.failed_before = bytearray(self.failed)
+        return super().verify_data_memory(data, first)
+
+    def verify_memory(self, data, command, first=True, start=0, end=None):
+        # returns [[(address, expected, actual), ...] for each target]
+        errors = [[] for ch in range(self.channels)]
+        image = data.data
+        size = len(image) if end is None else end
+        actual = [array('H', [0] * self.COLUMN) for ch in range(self.channels)]
+        for base in range(start, size, self.COLUMN):
+            n = min(self.COLUMN, size - base)
+            self.engine.read_words_all(n, actual, command)
+            for ch in range(self.channels):
+                if first and errors[ch]:
+                    continue
+                words = actual[ch]
+                for i in range(n):
+                    if words[i] != image[base + i]:
+                        errors[ch].append((data.address + base + i, image[base + i], words[i]))
+                        if first:
+                            break
+            if first and all(errors):
+                break
+        for ch in range(self.channels):
+            self.failed[ch] = 1 if self.failed_before[ch] or errors[ch] else 0
+        return errors
+
+    def error_rows(self, errors, address, row):
+        # the rows are rewritten on all the targets, the same words again on the good ones
+        return sorted(set((a - address) // row for channel_errors in errors for a, _, _ in channel_errors))
+
+    def blank_check_memory(self, memory, command):
+        # blank when all the targets are blank
+        address, size, blank = memory
+        actual = [array('H', [0] * self.COLUMN) for ch in range(self.channels)]
+        for base in range(0, size, self.COLUMN):
+            n = min(self.COLUMN, size - base)
+            self.engine.read_words_all(n, actual, command)
+            for i in range(n):
+                for words in actual:
+                    if words[i] != blank:
+                        return (address + base + i, words[i])
+        return None
+
+    def write_verify_program_memory(self, data, erase=True, latch=16, window=256, first=True, retries=0, row=16):
+        # a result for each target over the whole memory, by the two passes
+        t_start = self.monotonic()
+        self.write_program_memory(data, erase=erase, latch=latch)
+        t = self.monotonic()
+        errors = self.verify_program_memory(data, first)
+        if retries and any(errors):
+            errors = self.retry_program_memory(data, errors, retries, row, latch, first)
+        t_end = self.monotonic()
+        rows = sum(data.used_rows(latch)) if data else 0
+        return errors, {'rows': rows, 'program_sec': t - t_start, 'verify_sec': t_end - t, 'walk_sec': 0.0,
+                        'sec': t_end - t_start}
+
+    def delta_program_memory(self, data, row=16, config=None, latch=16):
+        # the targets may differ from each other, always bulk
+        if not data:
+            return None
+        t_start = self.monotonic()
+        self.write_program_memory(data, latch=latch)
+        sec = self.monotonic() - t_start
+        return {'rows': (len(data) + row - 1) // row, 'touched': 0, 'mode': 'bulk', 'sec': sec, 'full_sec': sec}
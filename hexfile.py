@@ -0,0 +1,337 @@
+# ----------------------------------------------------------------------------
+# Memory Image and Intel HEX Loader
+#
+# A .hex file is parsed in one pass into every memory region of the device:
+#   {'P': MemoryImage, 'C': MemoryImage, 'D': MemoryImage}
+# The image is kept until the file changes (name, mtime, size) or the device
+# changes, so WP/WD/WC/VP/VD/VC/TF and Auto-Prog share a single parse.
+# Hex_Watcher finds the newest .hex file and parses it as soon as it appears.
+#
+# A parsed image is also stored next to the .hex file as a binary image
+# (name.bin), which is loaded by readinto() on the later runs, also after
+# a power cycle, while the .hex file and the device are the same:
+#   header  : BIN_HEADER, magic, version, number of regions, device ID,
+#             CRC32 and size of the .hex file (hex_key()), CRC32 of the words
+#   regions : BIN_REGION for each region, name, address, size, blank
+#   words   : words of each region, 16-bit little-endian (14-bit values)
+# The .hex file is told by its contents, not by its mtime: a timestamp on
+# CIRCUITPY (FAT, local time, 2 s) never matches the one on the PC.
+
+from array import array
+from binascii import hexlify, unhexlify, crc32
+from os import stat, listdir
+from struct import pack, pack_into, unpack, unpack_from, calcsize
+from util import prinp
+
+REGIONS = ('P', 'C', 'D')
+
+BIN_MAGIC = b'RP2P'
+BIN_VERSION = 2
+HEX_KEY_CHUNK = 512         # bytes read at once by hex_key()
+BIN_HEADER = '<4sBBHIII'
+BIN_REGION = '<cxHHH'
+
+
+class MemoryImage:
+    # Words of a memory region in array('H'), 2 bytes per word
+    #   address : base address of the region (word address)
+    #   size    : number of words
+    #   blank   : value of an erased word
+    def __init__(self, address, size, blank):
+        self.address = address
+        self.size = size
+        self.blank = blank
+        data = array('H', [blank] * min(size, 64))
+        while len(data) < size:
+            data.extend(data[:size - len(data)])
+        self.data = data
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __eq__(self, other):
+        # compares the buffers, not word by word
+        if isinstance(other, MemoryImage):
+            other = other.data
+        return self.data == other
+
+    def used_rows(self, latch):
+        # flags of the rows (latch words each) which have any non-blank word
+        data = self.data
+        blank_row = array('H', [self.blank] * latch)
+        rows = bytearray((self.size + latch - 1) // latch)
+        for row, address in enumerate(range(0, self.size, latch)):
+            chunk = data[address : address + latch]
+            rows[row] = chunk != blank_row[:len(chunk)]
+        return rows
+
+_cache_key = None
+_cache_image = None
+
+
+def load_hex_file(name, device, stamp=None):
+    # stamp: (mtime, size) of the file if known, e.g. by Hex_Watcher
+    global _cache_key, _cache_image
+    if stamp is None:
+        st = stat(name)
+        stamp = (st[8], st[6])
+    key = (name,) + tuple(stamp) + (tuple(tuple(device[x]) for x in REGIONS),)
+    if key != _cache_key:
+        _cache_key = _cache_image = None    # release the old image before parsing
+        bin_name = bin_file_name(name)
+        hex_stamp = hex_key(name)
+        image = read_bin_file(bin_name, device, hex_stamp)
+        if image is None:
+            image = read_hex_file(name, device)
+            if image:
+                write_bin_file(bin_name, device, hex_stamp, image)
+        if image:
+            _cache_key, _cache_image = key, image
+        return image
+    return _cache_image
+
+
+def clear_hex_cache():
+    global _cache_key, _cache_image
+    _cache_key = _cache_image = None
+
+
+class Hex_Watcher:
+    # Newest .hex file on the drive by (mtime, size) of each file kept over the polls.
+    # A poll stats only the names new to the listing and the newest file; every
+    # SWEEP polls all the files are stated for the ones overwritten in place.
+    # poll(sweep=True) stats all the files at once, before programming or verifying.
+    SWEEP = 25
+
+    def __init__(self):
+        self.files = {}         # name: (mtime, size)
+        self.polls = 0
+        self.latest = None      # name of the newest file
+        self.parsed = None      # (name, mtime, size) parsed by poll()
+
+    def _stat(self, name):
+        try:
+            st = stat(name)
+            self.files[name] = (st[8], st[6])
+        except OSError:
+            self.files.pop(name, None)
+
+    def poll(self, device=None, sweep=False):
+        # returns (name, mtime) of the newest file or (None, None),
+        # parses a new/changed newest file when device is given
+        names = [x for x in listdir() if len(x) > 5 and x[-4:].lower() == '.hex']
+        sweep = sweep or self.polls % self.SWEEP == 0
+        self.polls += 1
+        for name in list(self.files):
+            if name not in names:
+                del self.files[name]
+        for name in names:
+            if sweep or name == self.latest or name not in self.files:
+                self._stat(name)
+        if not self.files:
+            self.latest = None
+            return (None, None)
+        latest = None
+        for name in names:
+            if name in self.files and (latest is None or self.files[name][0] > self.files[latest][0]):
+                latest = name
+        self.latest = latest
+        stamp = self.files[latest]
+        if device and self.parsed != (latest,) + stamp:
+            self.parsed = (latest,) + stamp
+            load_hex_file(latest, device, stamp)
+        return (latest, stamp[0])
+
+    def stamp(self, name):
+        return self.files.get(name)
+
+
+def hex_key(name):
+    # (CRC32, size) of the contents of the .hex file, the key of its binary image
+    crc = 0
+    size = 0
+    buf = bytearray(HEX_KEY_CHUNK)
+    with open(name, 'rb') as file:
+        while True:
+            n = file.readinto(buf)
+            if not n:
+                break
+            crc = crc32(memoryview(buf)[:n], crc)
+            size += n
+    return (crc, size)
+
+
+def bin_file_name(name):
+    return name[:-4] + '.bin' if name[-4:].lower() == '.hex' else name + '.bin'
+
+
+def device_id_of(device):
+    # device: device info by Detector ('device_id': '2CE0') or {'device_id': 0x2CE0}
+    device_id = device.get('device_id') or 0
+    return int(device_id, 16) if isinstance(device_id, str) else device_id
+
+
+def write_bin_image(file, device, key, image):
+    # key: hex_key() of the .hex file, (0, 0) if none
+    regions = [image[x] for x in REGIONS]
+    crc = 0
+    for region in regions:
+        crc = crc32(region.data, crc)
+    file.write(pack(BIN_HEADER, BIN_MAGIC, BIN_VERSION, len(regions), device_id_of(device),
+                    key[0], key[1], crc))
+    for x, region in zip(REGIONS, regions):
+        file.write(pack(BIN_REGION, x.encode(), region.address, region.size, region.blank))
+    for region in regions:
+        file.write(region.data)
+
+
+def write_bin_file(name, device, key, image):
+    # returns False if the drive is read-only
+    try:
+        with open(name, 'wb') as file:
+            write_bin_image(file, device, key, image)
+    except OSError:
+        return False        # e.g. CIRCUITPY is mounted read-only, see boot.py
+    return True
+
+
+def bin_image_size(image):
+    return calcsize(BIN_HEADER) + calcsize(BIN_REGION) * len(REGIONS) + 2 * sum(len(image[x]) for x in REGIONS)
+
+
+def read_bin_file(name, device, key):
+    # returns None unless the binary image is for this .hex file and device
+    try:
+        file = open(name, 'rb')
+    except OSError:
+        return None
+    with file:
+        return read_bin_image(file, device, key)
+
+
+def read_bin_image(file, device, key=None):
+    # file: read(n) and readinto(array) filling it up, key: hex_key(), None for any .hex file
+    header = file.read(calcsize(BIN_HEADER))
+    if len(header) != calcsize(BIN_HEADER):
+        return None
+    magic, version, count, device_id, hex_crc, hex_size, crc = unpack(BIN_HEADER, header)
+    if (magic, version, count) != (BIN_MAGIC, BIN_VERSION, len(REGIONS)) or device_id != device_id_of(device):
+        return None
+    if key is not None and (hex_crc, hex_size) != tuple(key):
+        return None
+    images = []
+    for x in REGIONS:
+        entry = file.read(calcsize(BIN_REGION))
+        if len(entry) != calcsize(BIN_REGION):
+            return None
+        region, address, size, blank = unpack(BIN_REGION, entry)
+        if region != x.encode() or [address, size, blank] != list(device[x]):
+            return None
+        images.append(MemoryImage(address, size, blank))
+    check = 0
+    for image in images:
+        if image.size and file.readinto(image.data) != 2 * image.size:
+            return None
+        check = crc32(image.data, check)
+    if check != crc:
+        return None
+    return dict(zip(REGIONS, images))
+
+
+def hex_record(address, record_type, data):
+    record = bytes([len(data), (address >> 8) & 0xFF, address & 0xFF, record_type]) + bytes(data)
+    return ':' + hexlify(record).decode().upper() + '%02X\n' % (-sum(record) & 0xFF)
+
+
+def write_hex_file(name, image, record_words=8):
+    # writes the regions of image as Intel HEX, runs of blank words are left out
+    # returns the number of data records, or None if the file can not be written
+    records = 0
+    try:
+        with open(name, 'w') as file:
+            extended_linear_address = 0
+            file.write(hex_record(0, 0x04, b'\x00\x00'))
+            for x in REGIONS:
+                region = image[x]
+                data = region.data
+                offset = 0
+                while offset < region.size:
+                    if data[offset] == region.blank:
+                        offset += 1
+                        continue
+                    # a record from a non-blank word up to the next blank word
+                    end = offset + 1
+                    limit = min(region.size, offset + record_words)
+                    while end < limit and data[end] != region.blank:
+                        end += 1
+                    byte_address = (region.address + offset) * 2
+                    if byte_address >> 16 != extended_linear_address:
+                        extended_linear_address = byte_address >> 16
+                        file.write(hex_record(0, 0x04, pack('>H', extended_linear_address)))
+                    file.write(hex_record(byte_address & 0xFFFF, 0x00, pack('<%dH' % (end - offset), *data[offset:end])))
+                    records += 1
+                    offset = end
+            file.write(hex_record(0, 0x01, b''))
+    except OSError:
+        return None         # e.g. CIRCUITPY is mounted read-only, see boot.py
+    return records
+
+
+def read_hex_file(name, device):
+    images = [MemoryImage(*device[x]) for x in REGIONS]
+    extended_linear_address = 0
+    # Read File
+    with open(name, 'r') as file:
+        for line in file:
+            line = line.rstrip()
+            if not line:
+                continue
+            # Check
+            if line[0] != ':':              # Start code
+                prinp('Invalid Start Code')
+                return
+            try:
+                record = unhexlify(line[1:])
+            except ValueError:
+                prinp('Invalid Hex Digit')
+                return
+            # Record: Byte count, Address(2), Record type, Data(Byte count), Checksum
+            byte_count = record[0]
+            if len(record) != byte_count + 5:
+                prinp('Invalid Data Length')
+                return
+            if sum(record) & 0xFF:
+                prinp('Invalid Checksum')
+                return
+            # Handle
+            record_type = record[3]
+            if record_type == 0x00:         # Data
+                absolute_address = ((extended_linear_address << 16) | (record[1] << 8) | record[2]) >> 1
+                for image in images:
+                    offset_address = absolute_address - image.address
+                    if 0 <= offset_address < image.size:
+                        count = min(byte_count >> 1, image.size - offset_address)
+                        # little-endian words, from the record bytes into the image buffer
+                        fmt = '<%dH' % count
+                        pack_into(fmt, image.data, offset_address * 2, *unpack_from(fmt, record, 4))
+                        break
+            elif record_type == 0x04:       # Extended Linear Address
+                extended_linear_address = (record[4] << 8) | record[5]
+            elif record_type == 0x02:       # Extended Segment address
+                # TODO: ignored temporary
+                continue
+            elif record_type == 0x01:       # End Of File
+                break
+            else:
+                prinp(f'Invalid Record Type:{record_type:02X}')
+                return
+    return dict(zip(REGIONS, images))
@@ -0,0 +1,333 @@
+# ----------------------------------------------------------------------------
+# I2C Test Plan
+#
+# A test file of I2C Tool (`test <file>`) is compiled once into a list of
+# I2C_Op, each with its tx bytes, a reusable rx buffer and the expected bytes,
+# so running a test does no parsing, no allocation and no hex formatting but
+# for the printed result. The plan is kept while the file is not modified.
+#
+#   wr ff 3         : a command, run by the expectations below it; a command
+#                     with no expectation is skipped, or run once by `test <file> all`
+#   => 01 01 08     : runs the command above, its response must be these bytes
+#   ?text> 01 01 08 : runs the command above until its response is these bytes
+#                     (`text` is shown while waiting, but in quiet), see wait_until()
+#   @timeout 2      : seconds for the following '?>' to match
+#   @interval 0.005 : seconds between the polls of the following '?>', 0: back to back
+#   @backoff 2 0.1  : the interval is multiplied by 2 after each poll, up to 0.1 seconds
+#
+# The directives can also follow a '?>' for that line only, e.g.
+#   ?ready> 05 @timeout 0.5 @interval 0
+#
+# An expectation other than hex bytes (e.g. `=> NO-RESP` of `w`) is compared
+# with the text returned by the command.
+
+import json
+import time
+from os import stat
+
+POLL_TIMEOUT = 10           # seconds for a '?>' expectation to match
+POLL_INTERVAL = 0.002       # seconds between the polls
+POLL_BACKOFF = 1            # factor of the interval after each poll
+POLL_MAX_INTERVAL = 0.1     # seconds, limit of the backoff
+
+DIRECTIVES = ('TIMEOUT', 'INTERVAL', 'BACKOFF')
+
+TRANSACTIONS = ('R', 'WR', 'W', 'S')
+
+
+class Test_Error(Exception):
+    pass
+
+
+class I2C_Op:
+    # cmd/args : the command line, args are run by I2C_Tool.handler() unless cmd is a transaction
+    # tx/rx    : bytes to write, buffer to read into (shared by the expectations of a command)
+    # expect   : bytes or text, None: no check, run once only by `test <file> all`
+    # poll     : text shown while polling for a '?>' expectation, None: '=>'
+    # wait     : (timeout, interval, backoff, max interval) of a '?>' expectation
+    # header   : text of the command line for the first op of a R/WR command, or None
+    def __init__(self, line, text, cmd, args, tx=b'', rx=None):
+        self.line = line
+        self.text = text
+        self.cmd = cmd
+        self.args = args
+        self.tx = tx
+        self.rx = rx
+        self.expect = None
+        self.poll = None
+        self.wait = None
+        self.header = None
+
+    def expected(self, line, expect, poll=None, wait=None):
+        # a copy for an expectation line
+        op = I2C_Op(line, self.text, self.cmd, self.args, self.tx, self.rx)
+        op.expect = expect
+        op.poll = poll
+        op.wait = wait
+        return op
+
+
+def where(line):
+    return f'line {line}: ' if line else ''
+
+
+def parse_hex(tokens, line):
+    try:
+        return bytes([int(x, 16) for x in tokens])
+    except ValueError:
+        raise Test_Error(f'{where(line)}invalid data: {" ".join(tokens)}')
+
+
+def parse_size(args, line):
+    if not args:
+        return 1
+    if not args[-1].isdigit():
+        raise Test_Error(f'{where(line)}the byte length to read should be a decimal integer: {args[-1]}')
+    return max(int(args[-1]), 1)
+
+
+def parse_expect(text):
+    tokens = text.upper().split()
+    try:
+        return bytes([int(x, 16) for x in tokens])
+    except ValueError:
+        return ' '.join(tokens)
+
+
+def parse_directives(text, wait, line):
+    # '@name value ...' into a copy of wait (timeout, interval, backoff, max interval)
+    timeout, interval, backoff, max_interval = wait
+    for directive in text.split('@')[1:]:
+        tokens = directive.upper().split()
+        if not tokens or tokens[0] not in DIRECTIVES or len(tokens) < 2:
+            raise Test_Error(f'line {line}: invalid directive: @{directive.strip()}')
+        try:
+            values = [float(x) for x in tokens[1:]]
+        except ValueError:
+            raise Test_Error(f'line {line}: invalid directive: @{directive.strip()}')
+        if tokens[0] == 'TIMEOUT':
+            timeout = values[0]
+        elif tokens[0] == 'INTERVAL':
+            interval = values[0]
+        else:
+            backoff = values[0]
+            if len(values) > 1:
+                max_interval = values[1]
+    return (timeout, interval, backoff, max_interval)
+
+
+def compile_command(line, text):
+    # line: of the test file, None for a command line
+    ll = text.upper().split()
+    cmd, args = ll[0], ll[1:]
+    if cmd == 'R':
+        op = I2C_Op(line, text, cmd, args, rx=bytearray(parse_size(args, line)))
+    elif cmd == 'WR':
+        op = I2C_Op(line, text, cmd, args, parse_hex(args[:-1], line), bytearray(parse_size(args, line)))
+    elif cmd in ('W', 'S'):
+        op = I2C_Op(line, text, cmd, args, parse_hex(args, line))
+    else:
+        op = I2C_Op(line, text, cmd, args)
+    if cmd in ('R', 'WR'):
+        op.header = text
+    return op
+
+
+def compile_test(lines):
+    # returns ([I2C_Op, ...], number of the lines), raises Test_Error
+    plan = []
+    command = None          # the last command line
+    checked = True          # the last command has an expectation
+    wait = (POLL_TIMEOUT, POLL_INTERVAL, POLL_BACKOFF, POLL_MAX_INTERVAL)   # by the directives so far
+    for line, s in enumerate(lines, start=1):
+        s = s.strip()
+        if s == '' or s.startswith('#'):   # empty line or comment
+            continue
+        if s.startswith('@'):
+            wait = parse_directives(s, wait, line)
+            continue
+        if s.startswith('=>') or (s.startswith('?') and '>' in s):
+            if command is None:
+                raise Test_Error(f'line {line}: no command for the expectation')
+            if s.startswith('=>'):
+                op = command.expected(line, parse_expect(s[2:]))
+            else:
+                prompt, _, expect = s[1:].partition('@')[0].rpartition('>')
+                op = command.expected(line, parse_expect(expect), prompt,
+                                      parse_directives(s[len(prompt) + 2:], wait, line))
+            if checked is False:
+                op.header = command.header      # printed once for the command
+            checked = True
+            plan.append(op)
+        else:
+            if command is not None and not checked:
+                plan.append(command)
+            command = compile_command(line, s)
+            checked = False
+    if command is not None and not checked:
+        plan.append(command)
+    return plan, len(lines)
+
+
+_cache_key = None
+_cache_plan = None
+
+
+def load_test(path):
+    # compile_test() of the file, compiled again only when it is modified
+    global _cache_key, _cache_plan
+    st = stat(path)
+    key = (path, st[8], st[6])
+    if key != _cache_key:
+        _cache_key = _cache_plan = None
+        with open(path) as f:
+            _cache_plan = compile_test(f.readlines())
+        _cache_key = key
+    return _cache_plan
+
+
+def wait_until(transfer, op, monotonic_ns=time.monotonic_ns, sleep=time.sleep):
+    # runs op by transfer(op) until the response is op.expect or op.wait times out
+    # returns (response, ok, seconds to the last response, polls)
+    timeout, interval, backoff, max_interval = op.wait
+    start = monotonic_ns()
+    deadline = start + int(timeout * 1e9)
+    polls = 0
+    while True:
+        resp = transfer(op)
+        polls += 1
+        now = monotonic_ns()
+        if resp == op.expect:
+            return resp, True, (now - start) / 1e9, polls
+        if now >= deadline:
+            return resp, False, (now - start) / 1e9, polls
+        if interval:
+            sleep(min(interval, (deadline - now) / 1e9))
+            interval = min(interval * backoff, max_interval)
+
+
+class Settle_Stats:
+    # latencies of the '?>' expectations which matched
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.polls = 0
+
+    def add(self, seconds, polls):
+        self.count += 1
+        self.total += seconds
+        self.polls += polls
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def summary(self):
+        if not self.count:
+            return None
+        return (f'Settle: {self.count} waits, min/avg/max {self.min * 1000:.1f}/{self.total * 1000 / self.count:.1f}/'
+                f'{self.max * 1000:.1f} ms, {self.polls / self.count:.1f} polls avg')
+
+
+def format_response(resp):
+    if resp is None:
+        return 'ERROR'
+    if isinstance(resp, str):
+        return resp
+    return ' '.join([f'{x:02X}' for x in resp])
+
+
+# Reports
+
+class Test_Result:
+    # an expectation as run: actual is a copy of the response (bytes, text or None on an I2C error)
+    def __init__(self, op, actual, ok, us, polls):
+        self.line = op.line
+        self.command = op.text
+        self.expect = op.expect
+        self.actual = bytes(actual) if actual is not None and not isinstance(actual, str) else actual
+        self.ok = ok
+        self.us = us
+        self.polls = polls
+
+
+def json_report(name, results, summary):
+    # JSON lines, one for each result and the summary at the end
+    lines = [json.dumps({'file': name, 'line': r.line, 'command': r.command,
+                         'expect': format_response(r.expect), 'actual': format_response(r.actual),
+                         'status': 'pass' if r.ok else 'fail', 'us': r.us, 'polls': r.polls})
+             for r in results]
+    lines.append(json.dumps(dict(summary, file=name)))
+    return '\n'.join(lines) + '\n'
+
+
+def xml_escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+def junit_report(name, results, summary):
+    # JUnit XML, a testcase for each result
+    suite = xml_escape(name)
+    out = ['<?xml version="1.0" encoding="UTF-8"?>',
+           f'<testsuite name="{suite}" tests="{summary["tests"]}" failures="{summary["failed"]}" '
+           f'time="{summary["sec"]:.6f}">']
+    for r in results:
+        case = f'  <testcase classname="{suite}" name="line {r.line}: {xml_escape(r.command)}" time="{r.us / 1e6:.6f}"'
+        if r.ok:
+            out.append(case + '/>')
+        else:
+            message = f'expected {format_response(r.expect)}, actual {format_response(r.actual)} ({r.polls} polls)'
+            out.append(case + '>')
+            out.append(f'    <failure message="{xml_escape(message)}"/>')
+            out.append('  </testcase>')
+    out.append('</testsuite>')
+    return '\n'.join(out) + '\n'
+
+
+REPORTS = {'JSON': (json_report, '.jsonl'), 'JUNIT': (junit_report, '.xml')}
+
+
+# Bench
+
+class Latency_Histogram:
+    # transactions by their latency in microseconds, BOUNDS are the upper ends of the bins
+    BOUNDS = (50, 100, 200, 500, 1000, 2000, 5000, 10000, 100000)
+    WIDTH = 40                  # characters of the longest bar
+
+    def __init__(self):
+        self.bins = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, us):
+        i = 0
+        while i < len(self.BOUNDS) and us >= self.BOUNDS[i]:
+            i += 1
+        self.bins[i] += 1
+        self.count += 1
+        self.total += us
+        self.min = us if self.min is None else min(self.min, us)
+        self.max = us if self.max is None else max(self.max, us)
+
+    def lines(self):
+        if not self.count:
+            return []
+        out = [f'Latency: min/avg/max {self.min}/{self.total // self.count}/{self.max} us']
+        top = max(self.bins)
+        last = max(i for i, n in enumerate(self.bins) if n)
+        for i in range(min(i for i, n in enumerate(self.bins) if n), last + 1):
+            label = f'< {self.BOUNDS[i]}' if i < len(self.BOUNDS) else f'>= {self.BOUNDS[-1]}'
+            bar = '#' * ((self.bins[i] * self.WIDTH + top - 1) // top)
+            out.append(f'  {label:>9} us {self.bins[i]:8} {bar}')
+        return out
+
+
+def error_kind(e):
+    # 'nack', 'timeout' or 'bus' of an exception by busio.I2C
+    if isinstance(e, TimeoutError):
+        return 'timeout'
+    if isinstance(e, OSError):
+        return 'nack'
+    return 'bus'
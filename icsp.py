@@ -0,0 +1,854 @@
+# ----------------------------------------------------------------------------
+# LV-ICSP Bit Engines
+#
+# An engine clocks the LV-ICSP frames out on ICSPCLK/ICSPDAT (LSb first).
+# The ICSP class below builds the LV-ICSP commands on top of it.
+#
+#   GPIO_Engine     : bit-banging by digitalio, works on any board
+#   FastGPIO_Engine : GPIO_Engine by precomputed bit tables (fallback of PIO)
+#   PIO_Engine      : RP2040 PIO state machine, clocks whole words by hardware
+#
+# The engines have the same interface:
+#   send_bit(length, value)  : clock out `length` bits of `value`
+#   send_command(value)      : 6-bit command + TDLY
+#   send_data(value)         : 16-bit data frame (start bit, 14 bits, stop bit)
+#   recv_data()              : 16-bit read frame, returns the 14-bit word
+#   load_words(seq, command) : Load Data of the words, Increment Address between them
+#   read_words(n, into, command) : Read Data + Increment Address of n words into `into`
+
+import time
+from array import array
+from hexfile import MemoryImage
+from util import COLUMN, prinp, print_data_line
+
+class Engine:
+    # Bulk transfers on top of send_command/send_data/recv_data
+    CMD_INCREMENT_ADDRESS = 0x06
+
+    def load_words(self, seq, command=0x02):
+        # no Increment Address after the last word, the latches are programmed there
+        last = len(seq) - 1
+        for i, value in enumerate(seq):
+            self.send_command(command)
+            self.send_data(value)
+            if i != last:
+                self.send_command(self.CMD_INCREMENT_ADDRESS)
+
+    def read_words(self, n, into=None, command=0x04):
+        if into is None:
+            into = array('H', [0] * n)
+        for i in range(n):
+            self.send_command(command)
+            into[i] = self.recv_data()
+            self.send_command(self.CMD_INCREMENT_ADDRESS)
+        return into
+
+
+class GPIO_Engine(Engine):
+    WAIT_TCLK = 200e-9  # 200 ns        ;; TODO time.sleep() under usec have no accurate waiting, find another way
+    WAIT_TDLY = 1e-6  # 1 us
+
+    def __init__(self, ICSPCLK, ICSPDAT, sleep=time.sleep):
+        self.ICSPCLK = ICSPCLK      # digitalio.DigitalInOut (Output)
+        self.ICSPDAT = ICSPDAT      # digitalio.DigitalInOut (Output)
+        self.sleep = sleep
+
+    def deinit(self):
+        self.ICSPCLK.deinit()
+        self.ICSPDAT.deinit()
+
+    def send_bit(self, length, value):
+        for i in range(length):
+            # TCKH: Min 100 ns
+            self.ICSPCLK.value = True
+            self.ICSPDAT.value = value & 1
+            # TDS: Min 100 ns
+            self.sleep(self.WAIT_TCLK)
+            # TCKL: Min 100 ns
+            self.ICSPCLK.value = False
+            # TDH: Min 100 ns
+            self.sleep(self.WAIT_TCLK)
+            value = value >> 1
+
+    def send_command(self, value):
+        self.send_bit(6, value)
+        # TDLY: Min 1 us
+        self.sleep(self.WAIT_TDLY)
+
+    def send_data(self, value):
+        self.send_bit(1, 0)
+        self.send_bit(14, value)
+        self.send_bit(1, 0)
+
+    def recv_data(self):
+        value = 0
+        self.send_bit(1, 0)
+        self.ICSPDAT.switch_to_input()
+        for i in range(14):
+            # TCKH: Min 100 ns
+            self.ICSPCLK.value = True
+            # TCO: Max 80 ns
+            self.sleep(self.WAIT_TCLK)
+            value |= self.ICSPDAT.value << i
+            # TCKL: Min 100 ns
+            self.ICSPCLK.value = False
+            self.sleep(self.WAIT_TCLK)
+        self.ICSPDAT.switch_to_output()
+        self.send_bit(1, 0)
+        return value
+
+
+class FastGPIO_Engine(GPIO_Engine):
+    # GPIO_Engine without the per-bit shifting and sleep():
+    #  - the bits of the commands and of the data bytes are precomputed
+    #  - the pins are held in locals, ICSPDAT is written only when the bit changes
+    #  - a read frame is clocked with ICSPDAT kept as input from the start bit
+    #    to the stop bit, the direction changes only at the command boundaries
+    # A pin write by CircuitPython takes microseconds, longer than
+    # TCKH/TCKL/TDS/TDH (Min 100 ns), so the clocks are not padded.
+    COMMAND_BITS = tuple(tuple((c >> i) & 1 for i in range(6)) for c in range(0x40))
+    BYTE_BITS = tuple(tuple((b >> i) & 1 for i in range(8)) for b in range(0x100))
+
+    def __init__(self, ICSPCLK, ICSPDAT, sleep=time.sleep):
+        super().__init__(ICSPCLK, ICSPDAT, sleep)
+        self.ICSPDAT.value = False
+        self.level = 0              # last level written to ICSPDAT
+
+    def _clock_out(self, bits):
+        clk = self.ICSPCLK
+        dat = self.ICSPDAT
+        level = self.level
+        for bit in bits:
+            clk.value = True
+            if bit != level:
+                dat.value = level = bit
+            clk.value = False
+        self.level = level
+
+    def _clock_in(self):
+        # 16 clocks with ICSPDAT as input, returns the 14-bit word
+        clk = self.ICSPCLK
+        dat = self.ICSPDAT
+        dat.switch_to_input()
+        clk.value = True                # start bit
+        clk.value = False
+        value = 0
+        for i in range(14):
+            clk.value = True
+            if dat.value:
+                value |= 1 << i
+            clk.value = False
+        clk.value = True                # stop bit
+        clk.value = False
+        dat.switch_to_output(value=self.level)
+        return value
+
+    def send_bit(self, length, value):
+        self._clock_out([(value >> i) & 1 for i in range(length)])
+
+    def send_command(self, value):
+        self._clock_out(self.COMMAND_BITS[value])
+        # TDLY: Min 1 us
+        self.sleep(self.WAIT_TDLY)
+
+    def send_data(self, value):
+        value = (value & 0x3FFF) << 1
+        self._clock_out(self.BYTE_BITS[value & 0xFF])
+        self._clock_out(self.BYTE_BITS[value >> 8])
+
+    def recv_data(self):
+        return self._clock_in()
+
+    def load_words(self, seq, command=0x02):
+        send_command = self.send_command
+        clock_out = self._clock_out
+        byte_bits = self.BYTE_BITS
+        last = len(seq) - 1
+        for i, value in enumerate(seq):
+            send_command(command)
+            value = (value & 0x3FFF) << 1
+            clock_out(byte_bits[value & 0xFF])
+            clock_out(byte_bits[value >> 8])
+            if i != last:
+                send_command(self.CMD_INCREMENT_ADDRESS)
+
+    def read_words(self, n, into=None, command=0x04):
+        if into is None:
+            into = array('H', [0] * n)
+        send_command = self.send_command
+        clock_in = self._clock_in
+        increment = self.CMD_INCREMENT_ADDRESS
+        for i in range(n):
+            send_command(command)
+            into[i] = clock_in()
+            send_command(increment)
+        return into
+
+
+class PIO_Engine(Engine):
+    # 4 MHz: 250 ns per PIO cycle, which meets TCKH/TCKL/TDS/TDH (Min 100 ns)
+    FREQUENCY = 4_000_000
+
+    # Every frame starts with a header word pulled from TX FIFO (shift right):
+    #   bit 0-4  : number of clocks - 1
+    #   bit 5    : 0 = write frame, 1 = read frame
+    #   bit 6-31 : bits to write, LSb first (write frame only)
+    # A read frame samples ICSPDAT on every clock, then pushes ISR to RX FIFO.
+    #
+    # .program icsp
+    # .side_set 1 opt                       ; side-set: ICSPCLK
+    # start:
+    #     pull block
+    #     out x, 5                          ; x = clocks - 1
+    #     out y, 1                          ; y = read frame
+    #     jmp !y write_bit
+    #     set pindirs, 0                    ; ICSPDAT: Input
+    # read_bit:
+    #     nop          side 1 [1]           ; TCKH: Min 100 ns, TCO: Max 80 ns
+    #     in pins, 1
+    #     jmp x-- read_bit side 0           ; TCKL: Min 100 ns
+    #     push block
+    #     set pindirs, 1                    ; ICSPDAT: Output
+    #     jmp start
+    # write_bit:
+    #     out pins, 1  side 1               ; TCKH, TDS: Min 100 ns
+    #     jmp x-- write_bit side 0          ; TCKL, TDH: Min 100 ns
+    #     nop [7]                           ; TDLY: Min 1 us
+    PROGRAM = array('H', [
+        0x80A0,     #  0: pull block
+        0x6025,     #  1: out x, 5
+        0x6041,     #  2: out y, 1
+        0x006B,     #  3: jmp !y write_bit
+        0xE080,     #  4: set pindirs, 0
+        0xB942,     #  5: nop side 1 [1]
+        0x4001,     #  6: in pins, 1
+        0x1045,     #  7: jmp x-- read_bit side 0
+        0x8020,     #  8: push block
+        0xE081,     #  9: set pindirs, 1
+        0x0000,     # 10: jmp start
+        0x7801,     # 11: out pins, 1 side 1
+        0x104B,     # 12: jmp x-- write_bit side 0
+        0xA742,     # 13: nop [7]
+    ])
+
+    READ_FRAME = (16 - 1) | (1 << 5)
+
+    def __init__(self, ICSPCLK, ICSPDAT, StateMachine=None):
+        if StateMachine is None:
+            from rp2pio import StateMachine     # ImportError: not a RP2040 board
+        self.sm = StateMachine(self.PROGRAM, self.FREQUENCY,
+                               first_out_pin=ICSPDAT,
+                               initial_out_pin_state=0,
+                               initial_out_pin_direction=1,
+                               first_in_pin=ICSPDAT,
+                               first_set_pin=ICSPDAT,
+                               initial_set_pin_state=0,
+                               initial_set_pin_direction=1,
+                               first_sideset_pin=ICSPCLK,
+                               initial_sideset_pin_state=0,
+                               initial_sideset_pin_direction=1,
+                               sideset_enable=True,
+                               out_shift_right=True,
+                               in_shift_right=True)
+        self.tx = array('L', [0])
+        self.rx = array('L', [0])
+
+    def deinit(self):
+        self.sm.deinit()
+
+    def send_bit(self, length, value):
+        # write() waits for TX stall, so the frame is on the wire when it returns
+        self.tx[0] = (length - 1) | ((value & ((1 << length) - 1)) << 6)
+        self.sm.write(self.tx)
+
+    def send_command(self, value):
+        # TDLY: Min 1 us, by the tail of the write frame
+        self.send_bit(6, value)
+
+    def send_data(self, value):
+        self.send_bit(16, (value & 0x3FFF) << 1)
+
+    def recv_data(self):
+        self.tx[0] = self.READ_FRAME
+        self.sm.write(self.tx)
+        self.sm.readinto(self.rx)
+        # 16 bits shifted in from the MSb: start bit, 14 bits, stop bit
+        return (self.rx[0] >> 17) & 0x3FFF
+
+    def load_words(self, seq, command=0x02):
+        # all frames of the words by one write(), no reads in between
+        n = len(seq)
+        if n == 0:
+            return
+        tx = array('L', [0] * (3 * n - 1))
+        command = (6 - 1) | (command << 6)
+        increment = (6 - 1) | (self.CMD_INCREMENT_ADDRESS << 6)
+        j = 0
+        for value in seq:
+            if j:
+                tx[j] = increment
+                j += 1
+            tx[j] = command
+            tx[j + 1] = (16 - 1) | ((value & 0x3FFF) << 7)
+            j += 2
+        self.sm.write(tx)
+
+# -----------------------------------------------------------------------------
+# Low-Voltage In-Circuit Serial Programming (LV-ICSP) Class
+
+# PIC16(L)F1xxx datasheet timing: externally timed programming for Program
+# Memory, and the datasheet waits instead of the worst case. See ICSP.TIMING.
+# TPEXT/TDIS are Min values. Board_Backend.sleep() busy-waits the sub-ms part
+# on time.monotonic_ns() and never ends early, so they only keep 50 us over
+# the Min for the resolution of monotonic_ns() (about 30 us on the RP2040):
+# a row takes 1.4 ms instead of TPINT 2.5 ms.
+TIMING_PIC16F1XXX = {
+    'EXTERNAL': True,
+    'TPINT': 2.5e-3,        # TPINT: Max 2.5 ms (Program Memory)
+    'TPINT_C': 5e-3,        # TPINT: Max 5 ms   (Configuration Words)
+    'TPINT_D': 5e-3,        # TPINT: Max 5 ms   (Data Memory)
+    'TPEXT': 1.05e-3,       # TPEXT: Min 1.0 ms, Max 2.1 ms
+    'TDIS': 350e-6,         # TDIS:  Min 300 us
+    'TERAB': 5e-3,          # TERAB: Max 5 ms
+    'TERAR': 2.5e-3,        # TERAR: Max 2.5 ms
+    'TENTS': 100e-9,        # TENTS: Min 100 ns
+}
+
+class ICSP:
+    WAIT_TENT = 1e-3  # 1 ms
+
+    # Timing Profile (default): internally timed programming, 5 ms for everything
+    TIMING = {
+        'EXTERNAL': False,
+        'TPINT': 5e-3,
+        'TPINT_C': 5e-3,
+        'TPINT_D': 5e-3,
+        'TPEXT': 1.05e-3,
+        'TDIS': 350e-6,
+        'TERAB': 5e-3,
+        'TERAR': 5e-3,
+        'TENTS': 1e-3,
+    }
+
+    COLUMN = COLUMN
+
+    # Commands of the bulk transfers, see Engine.load_words()/read_words()
+    CMD_LOAD_P = 0x02       # Load Data for Program Memory
+    CMD_LOAD_D = 0x03       # Load Data for Data Memory
+    CMD_READ_P = 0x04       # Read Data from Program Memory
+    CMD_READ_D = 0x05       # Read Data from Data Memory
+
+    def __init__(self, MCLR, ICSPCLK, ICSPDAT, engine='gpio', backend=None):
+        if backend is None:
+            from backend import Board_Backend
+            backend = Board_Backend()
+        self.sleep = backend.sleep
+        self.monotonic = backend.monotonic
+        self.MCLR = backend.output(MCLR)
+        self.engine, self.engine_name = self.create_engine(engine, ICSPCLK, ICSPDAT, backend)
+        self.set_timing()
+
+        # Communication Routine
+        self.send_bit = self.engine.send_bit
+        self.send_command = self.engine.send_command
+        self.send_data = self.engine.send_data
+        self.recv_data = self.engine.recv_data
+        self.load_words = self.engine.load_words
+        self.read_words = self.engine.read_words
+
+    def create_engine(self, engine, ICSPCLK, ICSPDAT, backend):
+        # returns (engine, name)
+        if engine == 'pio':
+            try:
+                return PIO_Engine(ICSPCLK, ICSPDAT, backend.StateMachine), engine
+            except ImportError:
+                print('Caution: PIO is not available on this board, ICSP falls back to GPIO')
+                engine = 'fast'
+        if engine == 'fast':
+            return FastGPIO_Engine(backend.output(ICSPCLK), backend.output(ICSPDAT), backend.sleep), engine
+        return GPIO_Engine(backend.output(ICSPCLK), backend.output(ICSPDAT), backend.sleep), 'gpio'
+
+    def set_timing(self, timing=None):
+        # timing: e.g. TIMING_PIC16F1XXX, None: the safe default
+        self.timing = dict(self.TIMING)
+        if timing:
+            self.timing.update(timing)
+
+    def reset(self):
+        self.MCLR.value = False
+        self.sleep(0.5)
+        self.MCLR.value = True
+        self.sleep(0.5)
+
+    def set_lvp_mode(self):
+        # TENTS: Min 100 ns
+        self.MCLR.value = True
+        self.sleep(self.timing['TENTS'])
+        # TENTH: Min 250 us
+        self.MCLR.value = False
+        self.sleep(self.WAIT_TENT)
+        # Key Sequence: 0x4D434850 (MCHP in ASCII)
+        self.send_bit(8, 0x50)
+        self.send_bit(8, 0x48)
+        self.send_bit(8, 0x43)
+        self.send_bit(8, 0x4D)
+        # Total 33 Clocks
+        self.send_bit(1, 0)
+        self.sleep(self.WAIT_TENT)
+
+    def set_normal_mode(self):
+        self.MCLR.value = True
+
+    # Command Routine
+
+    def run_load_configuration(self):
+        self.send_command(0x00)
+        self.send_data(0x00)
+
+    def run_load_data_for_program_memory(self, value):
+        self.send_command(0x02)
+        self.send_data(value)
+
+    def run_load_data_for_data_memory(self, value):
+        self.send_command(0x03)
+        self.send_data(value)
+
+    def run_read_data_from_program_memory(self):
+        self.send_command(0x04)
+        return self.recv_data()
+
+    def run_read_data_from_data_memory(self):
+        self.send_command(0x05)
+        return self.recv_data()
+
+    def run_increment_address(self):
+        self.send_command(0x06)
+
+    def run_reset_address(self):
+        self.send_command(0x16)
+
+    def run_begin_internally_timed_programming(self, wait=None):
+        self.send_command(0x08)
+        # TPINT
+        self.sleep(self.timing['TPINT'] if wait is None else wait)
+
+    def run_begin_externally_timed_programming(self):
+        self.send_command(0x18)
+        # TPEXT
+        self.sleep(self.timing['TPEXT'])
+
+    def run_end_externally_timed_programming(self):
+        self.send_command(0x0A)
+        # TDIS
+        self.sleep(self.timing['TDIS'])
+
+    def run_bulk_erase_program_memory(self):
+        self.send_command(0x09)
+        # TERAB
+        self.sleep(self.timing['TERAB'])
+
+    def run_row_erase_program_memory(self):
+        self.send_command(0x11)
+        # TERAR
+        self.sleep(self.timing['TERAR'])
+
+    def run_bulk_erase_data_memory(self):
+        self.send_command(0x0B)
+        # TERAB
+        self.sleep(self.timing['TERAB'])
+
+    # Programming of the latches, by the timing profile
+
+    def run_program_row(self):
+        if self.timing['EXTERNAL']:
+            self.run_begin_externally_timed_programming()
+            self.run_end_externally_timed_programming()
+        else:
+            self.run_begin_internally_timed_programming()
+
+    def run_program_configuration(self):
+        # externally timed writes are not supported for Configuration Words
+        self.run_begin_internally_timed_programming(self.timing['TPINT_C'])
+
+    def run_program_data(self):
+        self.run_begin_internally_timed_programming(self.timing['TPINT_D'])
+
+    # Read Routine
+
+    def read_memory(self, image, command, show=True):
+        data = image.data
+        size = len(data)
+        view = memoryview(data)
+        for base_address in range(0, size, self.COLUMN):
+            next_address = min(base_address + self.COLUMN, size)
+            self.read_words(next_address - base_address, view[base_address:next_address], command)
+            if show is False:
+                continue
+            column_data = data[base_address:next_address] if show != 'config' else data[7:9]    # TODO so dirty
+            print_data_line(base_address, column_data)
+        return image
+
+    def read_program_memory(self, size):
+        self.run_reset_address()
+        return self.read_memory(MemoryImage(0x0000, size, 0x3FFF), self.CMD_READ_P)
+
+    def read_configuration(self, size, show=True):
+        self.run_load_configuration()
+        return self.read_memory(MemoryImage(0x8000, size, 0x3FFF), self.CMD_READ_P, show)
+
+    def read_image(self, P, C, D):
+        # P, C, D: [Address, Size, Value], reads all the regions without printing
+        # returns {'P': MemoryImage, 'C': MemoryImage, 'D': MemoryImage}
+        self.run_reset_address()
+        program = self.read_memory(MemoryImage(*P), self.CMD_READ_P, False)
+        self.run_load_configuration()
+        for i in range(C[0] - 0x8000):
+            self.run_increment_address()
+        config = self.read_memory(MemoryImage(*C), self.CMD_READ_P, False)
+        self.run_reset_address()
+        data = self.read_memory(MemoryImage(*D), self.CMD_READ_D, False)
+        return {'P': program, 'C': config, 'D': data}
+
+    def read_device_id(self):
+        # Device ID word (0x8006) only, cheap enough to poll for a target
+        self.run_load_configuration()
+        for i in range(6):
+            self.run_increment_address()
+        return self.run_read_data_from_program_memory()
+
+    def read_data_memory(self, size):
+        self.run_reset_address()
+        return self.read_memory(MemoryImage(0xF000, size, 0x00FF), self.CMD_READ_D)
+
+    # Verify Routine
+
+    def verify_memory(self, data, command, first=True, start=0, end=None):
+        # compares each column as it is read, first: stop on the first mismatch
+        # start/end: offsets in data to verify, the device address must be at start
+        # returns [(address, expected, actual), ...]
+        errors = []
+        image = data.data
+        size = len(image) if end is None else end
+        actual = array('H', [0] * self.COLUMN)
+        for base in range(start, size, self.COLUMN):
+            n = min(self.COLUMN, size - base)
+            self.read_words(n, actual, command)
+            for i in range(n):
+                if actual[i] != image[base + i]:
+                    errors.append((data.address + base + i, image[base + i], actual[i]))
+                    if first:
+                        return errors
+        return errors
+
+    def verify_program_memory(self, data, first=True):
+        self.run_reset_address()
+        return self.verify_memory(data, self.CMD_READ_P, first)
+
+    def verify_configuration(self, data, first=True):
+        self.run_load_configuration()
+        for i in range(data.address - 0x8000):
+            self.run_increment_address()
+        return self.verify_memory(data, self.CMD_READ_P, first)
+
+    def verify_data_memory(self, data, first=True):
+        self.run_reset_address()
+        return self.verify_memory(data, self.CMD_READ_D, first)
+
+    # Retry Routine
+
+    def error_rows(self, errors, address, row):
+        # row numbers of the verify errors, sorted
+        return sorted(set((a - address) // row for a, _, _ in errors))
+
+    def retry_memory(self, data, errors, retries, row, latch, commands, run_program, erase, first=True, end=None):
+        # Rewrites the rows with verify errors and verifies again from the first of
+        # them (the rows before have passed) to end, until no error is left or a row
+        # has been retried `retries` times. Returns the errors left.
+        # commands: (Load Data, Read Data) of the memory
+        command, read_command = commands
+        image = data.data
+        size = len(image)
+        counts = {}
+        while True:
+            rows = self.error_rows(errors, data.address, row)
+            if not rows:
+                return errors
+            for n in rows:
+                counts[n] = counts.get(n, 0) + 1
+                if counts[n] > retries:
+                    return errors
+            self.run_reset_address()
+            address = 0
+            for n in rows:
+                row_address = n * row
+                while address < row_address:
+                    self.run_increment_address()
+                    address += 1
+                prinp(f'Retry {counts[n]}/{retries}: {data.address + row_address:04X}')
+                if erase:
+                    self.run_row_erase_program_memory()
+                row_end = min(row_address + row, size)
+                for latch_address in range(row_address, row_end, latch):
+                    self.load_words(image[latch_address:min(latch_address + latch, row_end)], command)
+                    run_program()
+                    self.run_increment_address()
+                address = row_end
+            start = rows[0] * row
+            self.run_reset_address()
+            for i in range(start):
+                self.run_increment_address()
+            errors = self.verify_memory(data, read_command, first, start, end)
+
+    def retry_program_memory(self, data, errors, retries=5, row=16, latch=16, first=True, end=None):
+        # errors: by verify_program_memory(), the rows are erased by Row Erase
+        return self.retry_memory(data, errors, retries, row, latch, (self.CMD_LOAD_P, self.CMD_READ_P),
+                                 self.run_program_row, True, first, end)
+
+    def retry_data_memory(self, data, errors, retries=5, first=True):
+        # errors: by verify_data_memory(), a word is erased as it is programmed
+        return self.retry_memory(data, errors, retries, 1, 1, (self.CMD_LOAD_D, self.CMD_READ_D), self.run_program_data, False, first)
+
+    # Blank Check Routine
+
+    def blank_check_memory(self, memory, command):
+        # memory: [Address, Size, Value], read in columns by read_words() (bursts),
+        # returns (address, value) of the first non-blank word
+        address, size, blank = memory
+        actual = array('H', [0] * self.COLUMN)
+        for base in range(0, size, self.COLUMN):
+            n = min(self.COLUMN, size - base)
+            self.read_words(n, actual, command)
+            for i in range(n):
+                if actual[i] != blank:
+                    return (address + base + i, actual[i])
+        return None
+
+    def blank_check(self, P, C, D):
+        # returns None if blank, or (region, address, value) of the first non-blank word
+        self.run_reset_address()
+        found = self.blank_check_memory(P, self.CMD_READ_P)
+        if found:
+            return ('P',) + found
+        self.run_load_configuration()
+        for i in range(C[0] - 0x8000):
+            self.run_increment_address()
+        found = self.blank_check_memory(C, self.CMD_READ_P)
+        if found:
+            return ('C',) + found
+        self.run_reset_address()
+        found = self.blank_check_memory(D, self.CMD_READ_D)
+        if found:
+            return ('D',) + found
+        return None
+
+    # Erase Routine
+
+    def erase_program_memory(self):
+        self.run_load_configuration()
+        self.run_bulk_erase_program_memory()
+
+    def erase_data_memory(self):
+        self.run_bulk_erase_data_memory()
+
+    # Write Routine
+
+    def write_memory(self, data, latch, command, run_program, rows=None):
+        # rows: flags by used_rows(), blank rows are skipped (sparse programming)
+        size = len(data)
+        end = size
+        if rows is not None:
+            used = len(rows)
+            while used and not rows[used - 1]:
+                used -= 1
+            end = min(size, used * latch)      # nothing to do after the last used row
+        skipped = 0
+        written = False
+        for row_address in range(0, end, latch):
+            next_address = min(row_address + latch, size)
+            if rows is not None and not rows[row_address // latch]:
+                # blank after erase, just go over the row
+                for address in range(row_address, next_address):
+                    self.run_increment_address()
+                skipped += 1
+            else:
+                self.load_words(data[row_address:next_address], command)
+                run_program()
+                self.run_increment_address()
+                written = True
+            if ((next_address % self.COLUMN) == 0) or (next_address == size):
+                prinp('*' if written else '.', end='')
+                written = False
+        prinp()
+        return skipped + (size - end + latch - 1) // latch
+
+    def write_program_memory(self, data, sparse=True, erase=True, latch=16):
+        if data:
+            if erase:
+                self.erase_program_memory()
+            self.run_reset_address()
+            rows = data.used_rows(latch) if sparse else None
+            skipped = self.write_memory(data.data, latch, self.CMD_LOAD_P, self.run_program_row, rows)
+            if sparse:
+                prinp(f'Skipped {skipped}/{len(rows)} blank rows')
+
+    def write_verify_program_memory(self, data, erase=True, latch=16, window=256, first=True, retries=0, row=16):
+        # Programs and verifies in one pass: each window (words) is read back right
+        # after it is programmed. There is no command to move the address back, so
+        # the window is reached again by Reset Address and Increment Address; the
+        # read leaves the address at the next window. The walk makes it slower than
+        # write_program_memory() then verify_program_memory(), it only fails earlier.
+        # first: stop at the first failed window (after the retries of its rows).
+        # Returns (errors, {'rows', 'program_sec', 'verify_sec', 'walk_sec', 'sec'})
+        stats = {'rows': 0, 'program_sec': 0.0, 'verify_sec': 0.0, 'walk_sec': 0.0, 'sec': 0.0}
+        if not data:
+            return [], stats
+        t_start = self.monotonic()
+        image = data.data
+        size = len(image)
+        step = max(row, latch)
+        window = max(window // step, 1) * step
+        rows = data.used_rows(latch)
+        if erase:
+            self.erase_program_memory()
+        self.run_reset_address()
+        errors = []
+        written = False
+        for base in range(0, size, window):
+            end = min(base + window, size)
+            t = self.monotonic()
+            for row_address in range(base, end, latch):
+                next_address = min(row_address + latch, end)
+                if rows[row_address // latch]:
+                    self.load_words(image[row_address:next_address], self.CMD_LOAD_P)
+                    self.run_program_row()
+                    self.run_increment_address()
+                    stats['rows'] += 1
+                    written = True
+                else:
+                    for address in range(row_address, next_address):
+                        self.run_increment_address()
+                if ((next_address % self.COLUMN) == 0) or (next_address == size):
+                    prinp('*' if written else '.', end='')
+                    written = False
+            t_walk = self.monotonic()
+            stats['program_sec'] += t_walk - t
+            self.run_reset_address()
+            for address in range(base):
+                self.run_increment_address()
+            t = self.monotonic()
+            stats['walk_sec'] += t - t_walk
+            window_errors = self.verify_memory(data, self.CMD_READ_P, first, base, end)
+            if retries and window_errors:
+                window_errors = self.retry_program_memory(data, window_errors, retries, row, latch, first, end)
+            stats['verify_sec'] += self.monotonic() - t
+            errors += window_errors
+            if first and errors:
+                break
+        prinp()
+        stats['sec'] = self.monotonic() - t_start
+        return errors, stats
+
+    def write_configulation(self, data):
+        if data:
+            self.run_load_configuration()
+            for i in range(7):
+                self.run_increment_address()
+            self.write_memory(data[0:2], 1, self.CMD_LOAD_P, self.run_program_configuration)
+
+    def write_data_memory(self, data, sparse=True, erase=True):
+        if data:
+            if erase:
+                self.erase_data_memory()
+            self.run_reset_address()
+            rows = data.used_rows(1) if sparse else None
+            skipped = self.write_memory(data.data, 1, self.CMD_LOAD_D, self.run_program_data, rows)
+            if sparse:
+                prinp(f'Skipped {skipped}/{len(rows)} blank words')
+
+    def delta_program_memory(self, data, row=16, config=None, latch=16):
+        # Rewrites only the rows differ from the device, by Row Erase.
+        # Falls back to bulk erase (write_program_memory) when most rows differ,
+        # or when the configuration words can not be programmed without it.
+        if not data:
+            return None
+        t_start = self.monotonic()
+        image = data.data
+        size = len(image)
+        rows = (size + row - 1) // row
+
+        # Read back and diff
+        diff = bytearray(rows)
+        used = bytearray(rows)      # device row is not blank, needs erase
+        actual = array('H', [0] * row)
+        self.run_reset_address()
+        for n in range(rows):
+            row_address = n * row
+            count = min(row, size - row_address)
+            self.read_words(count, actual, self.CMD_READ_P)
+            for i in range(count):
+                value = actual[i]
+                if value != image[row_address + i]:
+                    diff[n] = 1
+                if value != 0x3FFF:
+                    used[n] = 1
+        touched = sum(diff)
+
+        bulk = touched * 2 > rows
+        if config and not bulk:
+            device_config = self.read_configuration(7 + len(config), False)[7:]
+            # flash can only clear bits without erase
+            bulk = any((d & c) != c for d, c in zip(device_config, config))
+
+        result = {'rows': rows, 'touched': touched}
+        if bulk:
+            t_write = self.monotonic()
+            self.write_program_memory(data, latch=latch)
+            result['mode'] = 'bulk'
+            result['sec'] = self.monotonic() - t_start
+            result['full_sec'] = self.monotonic() - t_write
+            return result
+
+        # Row Erase and program the changed rows
+        t_latch = 0
+        n_latch = 0
+        self.run_reset_address()
+        address = 0
+        for n in range(rows):
+            if not diff[n]:
+                continue
+            row_address = n * row
+            while address < row_address:
+                self.run_increment_address()
+                address += 1
+            if used[n]:
+                self.run_row_erase_program_memory()
+            row_end = min(row_address + row, size)
+            for latch_address in range(row_address, row_end, latch):
+                latch_end = min(latch_address + latch, row_end)
+                t = self.monotonic()
+                blank = True
+                for a in range(latch_address, latch_end):
+                    if image[a] != 0x3FFF:
+                        blank = False
+                        break
+                if blank:
+                    for a in range(latch_address, latch_end):
+                        self.run_increment_address()
+                else:
+                    self.load_words(image[latch_address:latch_end], self.CMD_LOAD_P)
+                    self.run_program_row()
+                    self.run_increment_address()
+                if not blank:
+                    t_latch += self.monotonic() - t
+                    n_latch += 1
+            address = row_end
+            prinp('*', end='')
+        prinp()
+
+        # estimate of bulk erase and programming all used latches
+        latch_time = t_latch / n_latch if n_latch else self.timing['TPINT']
+        used_latches = sum(data.used_rows(latch))
+        result['mode'] = 'delta'
+        result['sec'] = self.monotonic() - t_start
+        result['full_sec'] = self.timing['TERAB'] + used_latches * latch_time
+        return result
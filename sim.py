@@ -0,0 +1,582 @@
+# ----------------------------------------------------------------------------
+# Host-side stand-ins for running RP2PIC without a board
+#
+#   SimPin          : digitalio.DigitalInOut look-alike, one wire per instance
+#   SimStateMachine : rp2pio.StateMachine look-alike, runs the PIO program
+#   SimPIC16F1xxx   : LV-ICSP target listening on MCLR/ICSPCLK/ICSPDAT
+#   SimI2C          : busio.I2C look-alike with SimI2CSlave(s) on the bus
+#   Sim_Backend     : backend (see backend.py) which wires them together
+#
+# They run on CPython as well as on CircuitPython, e.g.
+#
+#   backend = Sim_Backend()
+#   target = SimPIC16F1xxx(0x2CE0)
+#   backend.connect(target, 'MCLR', 'ICSPCLK', 'ICSPDAT')
+#   icsp = ICSP('MCLR', 'ICSPCLK', 'ICSPDAT', 'pio', backend)
+#   ...
+#   target.clocks, backend.monotonic()      # clocks and simulated seconds
+
+class SimPin:
+    def __init__(self, name='', value=False, trace=False):
+        self.name = name
+        self._value = bool(value)
+        self.input = False
+        self.drive = None           # function returns the level driven by the target
+        self.listeners = []         # called as func(pin, value) on every change
+        self.trace = [] if trace else None  # waveform as [(cycle, value), ...]
+        self.clock = 0              # set by SimStateMachine to timestamp the trace
+        self.writes = 0             # count of writes by the CPU
+
+    def _set(self, value):
+        value = bool(value)
+        if value == self._value:
+            return
+        self._value = value
+        if self.trace is not None:
+            self.trace.append((self.clock, value))
+        for func in self.listeners:
+            func(self, value)
+
+    @property
+    def value(self):
+        if self.input and self.drive:
+            level = self.drive()
+            if level is not None:
+                return bool(level)
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self.writes += 1
+        self._set(value)
+
+    def switch_to_output(self, value=None, drive_mode=None):
+        self.input = False
+        if value is not None:
+            self._set(value)
+
+    def switch_to_input(self, pull=None):
+        self.input = True
+
+    def deinit(self):
+        self.listeners = []
+
+
+class SimStateMachine:
+    """Runs a PIO program on SimPin(s), one instruction per cycle.
+
+    Only what RP2PIC needs is modelled: single-pin OUT/IN/SET, side-set with
+    optional enable, non-autopull/autopush FIFO and blocking PULL/PUSH.
+    """
+
+    def __init__(self, program, frequency, *,
+                 first_out_pin=None, initial_out_pin_state=0, initial_out_pin_direction=1,
+                 first_in_pin=None,
+                 first_set_pin=None, initial_set_pin_state=0, initial_set_pin_direction=1,
+                 first_sideset_pin=None, sideset_pin_count=1,
+                 initial_sideset_pin_state=0, initial_sideset_pin_direction=1,
+                 sideset_enable=False, out_shift_right=True, in_shift_right=True,
+                 wrap_target=0, wrap=-1, **kwargs):
+        self.program = list(program)
+        self.frequency = frequency
+        self.out_pin = first_out_pin
+        self.in_pin = first_in_pin
+        self.set_pin = first_set_pin
+        self.sideset_pin = first_sideset_pin
+        self.sideset_bits = sideset_pin_count + (1 if sideset_enable else 0)
+        self.sideset_enable = sideset_enable
+        self.out_shift_right = out_shift_right
+        self.in_shift_right = in_shift_right
+        self.wrap_target = wrap_target
+        self.wrap = wrap if wrap >= 0 else len(self.program) - 1
+        self.pc = 0
+        self.x = self.y = 0
+        self.osr = self.isr = 0
+        self.osr_count = 32         # bits shifted out of OSR, 32: empty
+        self.isr_count = 0
+        self.tx_fifo = []
+        self.rx_fifo = []
+        self.cycles = 0
+        if self.out_pin:
+            self.out_pin.switch_to_output(initial_out_pin_state)
+        if self.sideset_pin:
+            self.sideset_pin.switch_to_output(initial_sideset_pin_state)
+
+    def deinit(self):
+        pass
+
+    def write(self, buffer):
+        self.tx_fifo.extend(buffer)
+        self.run()
+
+    def readinto(self, buffer):
+        for i in range(len(buffer)):
+            buffer[i] = self.rx_fifo.pop(0)
+
+    def clear_rxfifo(self):
+        self.rx_fifo = []
+
+    @property
+    def in_waiting(self):
+        return len(self.rx_fifo)
+
+    def run(self):
+        # run until the program stalls on PULL with an empty TX FIFO
+        while self.step():
+            pass
+
+    def _tick(self, cycles=1):
+        self.cycles += cycles
+        for pin in (self.out_pin, self.sideset_pin, self.in_pin):
+            if pin:
+                pin.clock = self.cycles
+
+    def _shift_out(self, count):
+        mask = (1 << count) - 1 if count < 32 else 0xFFFFFFFF
+        if self.out_shift_right:
+            value = self.osr & mask
+            self.osr >>= count
+        else:
+            value = (self.osr >> (32 - count)) & mask
+            self.osr = (self.osr << count) & 0xFFFFFFFF
+        self.osr_count = min(self.osr_count + count, 32)
+        return value
+
+    def _shift_in(self, value, count):
+        mask = (1 << count) - 1 if count < 32 else 0xFFFFFFFF
+        value &= mask
+        if self.in_shift_right:
+            self.isr = ((self.isr >> count) | (value << (32 - count))) & 0xFFFFFFFF
+        else:
+            self.isr = ((self.isr << count) | value) & 0xFFFFFFFF
+        self.isr_count = min(self.isr_count + count, 32)
+
+    def step(self):
+        inst = self.program[self.pc]
+        opcode = inst >> 13
+        field = (inst >> 8) & 0x1F
+        delay_bits = 5 - self.sideset_bits
+        delay = field & ((1 << delay_bits) - 1)
+        sideset = field >> delay_bits
+        if self.sideset_enable:
+            if sideset >> (self.sideset_bits - 1):
+                self.sideset_pin._set(sideset & 1)
+        elif self.sideset_bits:
+            self.sideset_pin._set(sideset & 1)
+        arg1 = (inst >> 5) & 0x7
+        arg2 = inst & 0x1F
+        count = arg2 or 32
+        next_pc = self.pc + 1 if self.pc != self.wrap else self.wrap_target
+
+        if opcode == 0b000:             # JMP
+            cond = arg1
+            jump = (cond == 0b000 or
+                    (cond == 0b001 and self.x == 0) or
+                    (cond == 0b010 and self.x != 0) or
+                    (cond == 0b011 and self.y == 0) or
+                    (cond == 0b100 and self.y != 0) or
+                    (cond == 0b101 and self.x != self.y) or
+                    (cond == 0b111 and self.osr_count < 32))
+            if cond == 0b010:
+                self.x = (self.x - 1) & 0xFFFFFFFF
+            elif cond == 0b100:
+                self.y = (self.y - 1) & 0xFFFFFFFF
+            if jump:
+                next_pc = arg2
+        elif opcode == 0b010:           # IN
+            source = {0b000: lambda: self.in_pin.value,
+                      0b001: lambda: self.x,
+                      0b010: lambda: self.y,
+                      0b011: lambda: 0}[arg1]()
+            self._shift_in(int(source), count)
+        elif opcode == 0b011:           # OUT
+            value = self._shift_out(count)
+            if arg1 == 0b000:
+                self.out_pin._set(value & 1)
+            elif arg1 == 0b001:
+                self.x = value
+            elif arg1 == 0b010:
+                self.y = value
+            elif arg1 == 0b100:
+                self._set_dir(self.out_pin, value & 1)
+            elif arg1 == 0b101:
+                next_pc = value
+        elif opcode == 0b100:           # PUSH / PULL
+            block = inst & 0x20
+            if inst & 0x80:             # PULL
+                if not self.tx_fifo:
+                    if block:
+                        return False    # stall, wait for CPU
+                    self.osr = self.x
+                else:
+                    self.osr = self.tx_fifo.pop(0) & 0xFFFFFFFF
+                self.osr_count = 0
+            else:                       # PUSH
+                self.rx_fifo.append(self.isr)
+                self.isr = 0
+                self.isr_count = 0
+        elif opcode == 0b101:           # MOV (x, y only)
+            regs = {0b001: 'x', 0b010: 'y'}
+            if arg1 in regs and (arg2 & 0x7) in regs:
+                value = getattr(self, regs[arg2 & 0x7])
+                if (arg2 >> 3) == 0b01:
+                    value ^= 0xFFFFFFFF
+                setattr(self, regs[arg1], value)
+        elif opcode == 0b111:           # SET
+            if arg1 == 0b000:
+                self.set_pin._set(arg2 & 1)
+            elif arg1 == 0b001:
+                self.x = arg2
+            elif arg1 == 0b010:
+                self.y = arg2
+            elif arg1 == 0b100:
+                self._set_dir(self.set_pin, arg2 & 1)
+        else:
+            raise NotImplementedError(f'PIO opcode {opcode:03b} at {self.pc}')
+
+        self.pc = next_pc
+        self._tick(1 + delay)
+        return True
+
+    @staticmethod
+    def _set_dir(pin, output):
+        if output:
+            pin.switch_to_output()
+        else:
+            pin.switch_to_input()
+
+
+class SimPIC16F1xxx:
+    """PIC16F1xxx in LV-ICSP mode, decodes the frames clocked on the pins.
+
+    Program memory is flash (programming can only clear bits), data memory
+    is EEPROM (erase-before-write). Counters for throughput measurement:
+      clocks     : ICSPCLK falling edges while MCLR is low
+      commands   : {command: count}
+      programmed : count of Begin Programming (rows/words)
+      violations : clocks received while the target was still busy,
+                   or an externally timed pulse out of TPEXT
+    """
+    KEY = 0x4D434850                # MCHP
+
+    T_PINT_P = 2.5e-3               # TPINT: Program memory
+    T_PINT_C = 5e-3                 # TPINT: Configuration memory
+    T_PINT_D = 5e-3                 # TPINT: Data memory
+    T_ERAB = 5e-3                   # TERAB: Bulk erase
+    T_ERAR = 2.5e-3                 # TERAR: Row erase
+    T_PEXT = (1.0e-3, 2.1e-3)       # TPEXT: Externally timed programming pulse (Min, Max)
+    T_DIS = 300e-6                  # TDIS:  Delay after End Externally Timed Programming
+
+    def __init__(self, device_id=0x2CE0, revision=0x03, program_size=0x0800, data_size=0x0100, latch=16,
+                 row=None, calibration=(0x2F87, 0x3FFF)):
+        self.program_size = program_size
+        self.data_size = data_size
+        self.latch_size = latch
+        self.row_size = row or latch
+        self.program = [0x3FFF] * program_size
+        self.config = [0x3FFF] * 0x20                   # 0x8000 - 0x801F
+        self.config[6] = (device_id & 0x3FE0) | (revision & 0x1F)
+        self.config[9:11] = list(calibration)
+        self.data = [0xFF] * data_size
+        self.latch = [0x3FFF] * latch
+        self.data_latch = 0xFF
+        self.last_load = None
+        self.pc = 0
+        self.state = 'run'
+        self.shift = 0
+        self.count = 0
+        self.frame = 0
+        self.command = None
+        self.clock = None               # function returns seconds, see Sim_Backend.connect()
+        self.busy_until = 0
+        self.pulse_start = None
+        self.clocks = 0
+        self.commands = {}
+        self.programmed = 0
+        self.violations = 0
+        self.pins = None
+
+    def attach(self, MCLR, ICSPCLK, ICSPDAT):
+        self.pins = (MCLR, ICSPCLK, ICSPDAT)
+        MCLR.listeners.append(self.on_mclr)
+        ICSPCLK.listeners.append(self.on_clk)
+        ICSPDAT.drive = self.drive
+
+    # Pin Events
+
+    def on_mclr(self, pin, value):
+        if value:
+            self.state = 'run'
+        else:
+            self.state = 'key'
+            self.shift = self.count = 0
+
+    def drive(self):
+        if self.state == 'read':
+            return (self.frame >> self.count) & 1
+        return None
+
+    def on_clk(self, pin, value):
+        if value or self.state == 'run':
+            return
+        # falling edge: the host data is latched
+        self.clocks += 1
+        if self.busy_until:
+            if self.clock() < self.busy_until:
+                self.violations += 1
+            else:
+                self.busy_until = 0
+        bit = 1 if self.pins[2]._value else 0
+        state = self.state
+        if state == 'key':
+            self.shift |= bit << self.count
+            self.count += 1
+            if self.count == 32:
+                self.state = 'key_end' if self.shift == self.KEY else 'locked'
+        elif state == 'key_end':
+            self.state = 'cmd'                  # 33rd clock
+            self.shift = self.count = 0
+        elif state == 'cmd':
+            self.shift |= bit << self.count
+            self.count += 1
+            if self.count == 6:
+                self.command = self.shift
+                self.shift = self.count = 0
+                self.execute(self.command)
+        elif state == 'load':
+            self.shift |= bit << self.count
+            self.count += 1
+            if self.count == 16:
+                self.load(self.command, (self.shift >> 1) & 0x3FFF)
+                self.state = 'cmd'
+                self.shift = self.count = 0
+        elif state == 'read':
+            self.count += 1
+            if self.count == 16:
+                self.state = 'cmd'
+                self.shift = self.count = 0
+
+    # Memory
+
+    def read_word(self, address):
+        if address & 0x8000:
+            return self.config[address & 0x1F]
+        return self.program[address % self.program_size]
+
+    def program_word(self, address, value):
+        if address & 0x8000:
+            index = address & 0x1F
+            if index < 4 or index in (7, 8):            # User ID, Configuration Words
+                self.config[index] &= value
+        else:
+            self.program[address % self.program_size] &= value
+
+    def wait(self, seconds):
+        if self.clock:
+            self.busy_until = self.clock() + seconds
+
+    # Commands
+
+    def execute(self, command):
+        self.commands[command] = self.commands.get(command, 0) + 1
+        if command in (0x00, 0x02, 0x03):               # Load Configuration/Data
+            self.state = 'load'
+        elif command in (0x04, 0x05):                   # Read Data
+            if command == 0x04:
+                value = self.read_word(self.pc)
+            else:
+                value = self.data[self.pc % self.data_size] if self.data_size else 0
+            self.frame = value << 1
+            self.state = 'read'
+        elif command == 0x06:                           # Increment Address
+            self.pc = (self.pc & 0x8000) | ((self.pc + 1) & 0x7FFF)
+        elif command == 0x16:                           # Reset Address
+            self.pc = 0
+        elif command == 0x08:                           # Begin Internally Timed Programming
+            self.begin_programming()
+        elif command == 0x18:                           # Begin Externally Timed Programming
+            self.begin_external_programming()
+        elif command == 0x0A:                           # End Externally Timed Programming
+            self.end_external_programming()
+        elif command == 0x09:                           # Bulk Erase Program Memory
+            self.program = [0x3FFF] * self.program_size
+            if self.pc & 0x8000:
+                for index in (0, 1, 2, 3, 7, 8):
+                    self.config[index] = 0x3FFF
+            self.wait(self.T_ERAB)
+        elif command == 0x11:                           # Row Erase Program Memory
+            if not self.pc & 0x8000:
+                row = (self.pc % self.program_size) // self.row_size * self.row_size
+                self.program[row : row + self.row_size] = [0x3FFF] * self.row_size
+            self.wait(self.T_ERAR)
+        elif command == 0x0B:                           # Bulk Erase Data Memory
+            self.data = [0xFF] * self.data_size
+            self.wait(self.T_ERAB)
+
+    def load(self, command, value):
+        if command == 0x00:                             # Load Configuration
+            self.pc = 0x8000
+            self.latch[0] = value
+            self.last_load = 'P'
+        elif command == 0x02:                           # Load Data for Program Memory
+            self.latch[self.pc % self.latch_size] = value
+            self.last_load = 'P'
+        elif command == 0x03:                           # Load Data for Data Memory
+            self.data_latch = value & 0xFF
+            self.last_load = 'D'
+
+    def begin_programming(self):
+        self.programmed += 1
+        if self.last_load == 'D':
+            if self.data_size:
+                self.data[self.pc % self.data_size] = self.data_latch
+            self.wait(self.T_PINT_D)
+        elif self.pc & 0x8000:
+            self.program_word(self.pc, self.latch[self.pc % self.latch_size])
+            self.wait(self.T_PINT_C)
+        else:
+            row = self.pc - (self.pc % self.latch_size)
+            for i, value in enumerate(self.latch):
+                self.program_word(row + i, value)
+            self.wait(self.T_PINT_P)
+        self.latch = [0x3FFF] * self.latch_size
+
+    def begin_external_programming(self):
+        # supported for Program Memory only; no effect on Configuration Words and Data Memory
+        self.programmed += 1
+        if self.last_load == 'P' and not self.pc & 0x8000:
+            row = self.pc - (self.pc % self.latch_size)
+            for i, value in enumerate(self.latch):
+                self.program_word(row + i, value)
+        self.latch = [0x3FFF] * self.latch_size
+        self.pulse_start = self.clock() if self.clock else None
+
+    def end_external_programming(self):
+        if self.pulse_start is not None:
+            pulse = self.clock() - self.pulse_start
+            if not self.T_PEXT[0] <= pulse <= self.T_PEXT[1]:
+                self.violations += 1
+        self.pulse_start = None
+        self.wait(self.T_DIS)
+
+
+class SimI2C:
+    """busio.I2C look-alike, a NACK raises OSError as busio does"""
+
+    def __init__(self, frequency=100000):
+        self.frequency = frequency
+        self.slaves = {}                # {address: SimI2CSlave}
+        self.locked = False
+        self.bits = 0                   # clocks on SCL, for simulated time
+
+    def deinit(self):
+        pass
+
+    def try_lock(self):
+        if self.locked:
+            return False
+        self.locked = True
+        return True
+
+    def unlock(self):
+        self.locked = False
+
+    def _slave(self, address, size):
+        self.bits += 9 * (1 + size)
+        if address not in self.slaves:
+            raise OSError(19)           # ENODEV: no ACK for the address
+        return self.slaves[address]
+
+    def scan(self):
+        self.bits += 9 * (0x78 - 0x08)
+        return sorted(self.slaves)
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        data = bytes(buffer[start:end])
+        slave = self._slave(address, len(data))
+        if data:                        # an address-only write (probe) does not reach the slave
+            slave.on_write(data)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        data = self._slave(address, end - start).on_read(end - start)
+        buffer[start:end] = data
+
+    def writeto_then_readfrom(self, address, out_buffer, in_buffer, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        data = bytes(out_buffer[out_start:out_end])
+        self._slave(address, len(data)).on_write(data)
+        self.readfrom_into(address, in_buffer, start=in_start, end=in_end)
+
+
+class SimI2CSlave:
+    """Answers a read by the response for the bytes written last.
+
+    responses: {bytes written: bytes or func(bytes written) -> bytes}
+    """
+
+    def __init__(self, responses=None):
+        self.responses = responses or {}
+        self.last = b''
+        self.writes = 0
+        self.reads = 0
+
+    def on_write(self, data):
+        self.writes += 1
+        self.last = data
+
+    def on_read(self, size):
+        self.reads += 1
+        resp = self.responses.get(self.last, b'')
+        if callable(resp):
+            resp = resp(self.last)
+        return (bytes(resp) + b'\xFF' * size)[:size]
+
+
+class Sim_Backend:
+    """Backend on the host, see backend.py.
+
+    Pins are created by name (or any hashable) on first use. Time is
+    simulated: monotonic() counts sleep(), PIO cycles, I2C clocks and
+    `pin_time` seconds per GPIO write by the CPU.
+    """
+
+    def __init__(self, pin_time=0.0):
+        self.pin_time = pin_time
+        self.pins = {}
+        self.machines = []
+        self.bus = SimI2C()
+        self.slept = 0.0
+
+    def pin(self, pin):
+        if pin not in self.pins:
+            self.pins[pin] = SimPin(str(pin))
+        return self.pins[pin]
+
+    def output(self, pin):
+        dio = self.pin(pin)
+        dio.switch_to_output()
+        return dio
+
+    def StateMachine(self, program, frequency, **kwargs):
+        for key in ('first_out_pin', 'first_in_pin', 'first_set_pin', 'first_sideset_pin'):
+            if kwargs.get(key) is not None:
+                kwargs[key] = self.pin(kwargs[key])
+        sm = SimStateMachine(program, frequency, **kwargs)
+        self.machines.append(sm)
+        return sm
+
+    def i2c(self, scl, sda):
+        return self.bus
+
+    def sleep(self, seconds):
+        self.slept += seconds
+
+    def monotonic(self):
+        writes = sum(p.writes for p in self.pins.values())
+        cycles = sum(sm.cycles / sm.frequency for sm in self.machines)
+        return self.slept + writes * self.pin_time + cycles + self.bus.bits / self.bus.frequency
+
+    def connect(self, target, MCLR, ICSPCLK, ICSPDAT):
+        target.attach(self.pin(MCLR), self.pin(ICSPCLK), self.pin(ICSPDAT))
+        target.clock = self.monotonic
@@ -0,0 +1,9 @@
+# The modules of RP2PIC are at the top of the repository, as on CIRCUITPY.
+#   $ pytest tests
+# (not `python3 -m pytest`, code.py at the top would hide the code module of
+# the standard library, so the path is appended here)
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
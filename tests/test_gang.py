@@ -0,0 +1,143 @@
+# Gang programming on simulated targets, gang.py
+
+import pytest
+
+from gang import Gang_ICSP
+from hexfile import MemoryImage
+from sim import Sim_Backend, SimPIC16F1xxx
+from util import NO_Printer
+
+CHANNELS = 2
+
+
+class FlakyTarget(SimPIC16F1xxx):
+    # a word which fails to program `fails` times, then programs fine
+    def __init__(self, address, fails=1):
+        super().__init__(0x2CE0)
+        self.bad_address = address
+        self.fails = fails
+
+    def program_word(self, address, value):
+        if address == self.bad_address and self.fails:
+            self.fails -= 1
+            return
+        super().program_word(address, value)
+
+
+def make_image():
+    image = MemoryImage(0x0000, 0x0800, 0x3FFF)
+    for i in range(0x60):
+        image[i] = (i * 0x123) & 0x3FFF
+    return image
+
+
+def gang(targets):
+    backend = Sim_Backend()
+    dats = [f'ICSPDAT{ch}' for ch in range(len(targets))]
+    for target, dat in zip(targets, dats):
+        backend.connect(target, 'MCLR', 'ICSPCLK', dat)
+    return Gang_ICSP('MCLR', 'ICSPCLK', dats, backend)
+
+
+# Programming and verify
+
+@pytest.mark.parametrize('channels', [1, 2, 4])
+def test_write_verify_all(channels):
+    image = make_image()
+    targets = [SimPIC16F1xxx(0x2CE0) for ch in range(channels)]
+    icsp = gang(targets)
+    with NO_Printer():
+        icsp.set_lvp_mode()
+        assert icsp.read_device_id() == targets[0].config[6]
+        assert icsp.engine.words == [x.config[6] for x in targets]      # the Device ID of every target
+        icsp.write_program_memory(image)
+        assert icsp.verify_program_memory(image) == [[]] * channels
+    for target in targets:
+        assert target.program == list(image)
+        assert target.violations == 0
+
+
+def test_verify_per_target():
+    image = make_image()
+    targets = [SimPIC16F1xxx(0x2CE0), SimPIC16F1xxx(0x2CE0)]
+    icsp = gang(targets)
+    with NO_Printer():
+        icsp.set_lvp_mode()
+        icsp.write_program_memory(image)
+    targets[1].program[0x10] = 0x0000
+    with NO_Printer():
+        assert icsp.verify_program_memory(image, first=False) == [[], [(0x10, image[0x10], 0x0000)]]
+    assert list(icsp.failed) == [0, 1]
+
+
+def test_verify_data_per_target():
+    data = MemoryImage(0xF000, 0x100, 0xFF)
+    data[5] = 0x5A
+    targets = [SimPIC16F1xxx(0x2CE0), SimPIC16F1xxx(0x2CE0)]
+    icsp = gang(targets)
+    with NO_Printer():
+        icsp.set_lvp_mode()
+        icsp.write_data_memory(data)
+    targets[0].data[5] = 0xA5
+    with NO_Printer():
+        assert icsp.verify_data_memory(data) == [[(0xF005, 0x5A, 0xA5)], []]
+
+
+# Retry
+
+@pytest.mark.parametrize('address', [0x05, 0x25])      # a retry from row 0 and from a later row
+def test_retry_clears_failed(address):
+    image = make_image()
+    targets = [SimPIC16F1xxx(0x2CE0), FlakyTarget(address)]
+    icsp = gang(targets)
+    with NO_Printer():
+        icsp.set_lvp_mode()
+        icsp.write_program_memory(image)
+        errors = icsp.verify_program_memory(image)
+        assert [bool(e) for e in errors] == [False, True]
+        assert list(icsp.failed) == [0, 1]
+        errors = icsp.retry_program_memory(image, errors, retries=2)
+    assert errors == [[], []]
+    assert list(icsp.failed) == [0, 0]
+    assert targets[1].program[:0x60] == list(image[:0x60])
+
+
+def test_retry_keeps_failed():
+    image = make_image()
+    icsp = gang([SimPIC16F1xxx(0x2CE0), FlakyTarget(0x05, fails=10)])
+    with NO_Printer():
+        icsp.set_lvp_mode()
+        icsp.write_program_memory(image)
+        errors = icsp.retry_program_memory(image, icsp.verify_program_memory(image), retries=2)
+    assert [bool(e) for e in errors] == [False, True]
+    assert list(icsp.failed) == [0, 1]
+
+
+def test_failed_over_regions():
+    # a target failed on program memory stays failed after a later verify passes
+    image = make_image()
+    icsp = gang([FlakyTarget(0x05), SimPIC16F1xxx(0x2CE0)])
+    config = MemoryImage(0x8007, 2, 0x3FFF)
+    config[0] = 0x39E4
+    with NO_Printer():
+        icsp.set_lvp_mode()
+        icsp.write_program_memory(image)
+        icsp.verify_program_memory(image)
+        icsp.write_configulation(config)
+        assert icsp.verify_configuration(config) == [[], []]
+    assert list(icsp.failed) == [1, 0]
+    with NO_Printer():
+        icsp.set_lvp_mode()
+    assert list(icsp.failed) == [0, 0]
+
+
+def test_blank_check_any_target():
+    targets = [SimPIC16F1xxx(0x2CE0), SimPIC16F1xxx(0x2CE0)]
+    icsp = gang(targets)
+    with NO_Printer():
+        icsp.set_lvp_mode()
+    P, C, D = (0x0000, 0x0800, 0x3FFF), (0x8007, 2, 0x3FFF), (0xF000, 0x0100, 0xFF)
+    assert icsp.blank_check(P, C, D) is None
+    targets[1].program[0x0040] = 0x0123
+    icsp.run_reset_address()
+    assert icsp.blank_check(P, C, D) == ('P', 0x0040, 0x0123)
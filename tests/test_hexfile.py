@@ -0,0 +1,167 @@
+# Intel HEX and binary image formats of hexfile.py
+
+import io
+
+import pytest
+
+from hexfile import (REGIONS, MemoryImage, bin_file_name, clear_hex_cache, hex_key, load_hex_file,
+                     read_bin_file, read_bin_image, read_hex_file, write_bin_file, write_bin_image,
+                     write_hex_file)
+
+DEVICE = {'device_id': '2CE0', 'P': (0x0000, 0x800, 0x3FFF), 'C': (0x8007, 2, 0x3FFF), 'D': (0xF000, 0x80, 0xFF)}
+
+
+def record(address, record_type, data):
+    data = bytes([len(data), address >> 8, address & 0xFF, record_type]) + bytes(data)
+    return ':' + data.hex().upper() + '%02X\n' % (-sum(data) & 0xFF)
+
+
+def make_image():
+    image = {x: MemoryImage(*DEVICE[x]) for x in REGIONS}
+    for i in range(0x100):
+        image['P'][i] = (i * 37) & 0x3FFF
+    image['P'][0x7FF] = 0x2800          # the last word, after a run of blank words
+    image['C'][0] = 0x39E4
+    image['D'][0] = 0x00
+    image['D'][5] = 0x5A
+    return image
+
+
+# MemoryImage
+
+@pytest.mark.parametrize('size', [1, 64, 0x7FF, 0x800])
+def test_memory_image_blank(size):
+    image = MemoryImage(0x0000, size, 0x3FFF)
+    assert len(image) == len(image.data) == size
+    assert image.data.typecode == 'H' and image.data.itemsize == 2
+    assert list(image) == [0x3FFF] * size
+
+
+def test_memory_image_words():
+    image = MemoryImage(0xF000, 0x80, 0xFF)
+    image[5] = 0x5A
+    assert (image[5], image[4]) == (0x5A, 0xFF)
+    assert list(image[4:7]) == [0xFF, 0x5A, 0xFF]
+    assert list(image) == [0xFF] * 5 + [0x5A] + [0xFF] * 0x7A
+    assert image != MemoryImage(0xF000, 0x80, 0xFF)
+
+
+def test_used_rows():
+    image = MemoryImage(0x0000, 0x28, 0x3FFF)
+    image[0x01] = 0x0000
+    image[0x27] = 0x2800
+    assert list(image.used_rows(16)) == [1, 0, 1]         # the last row is short
+    assert sum(image.used_rows(1)) == 2
+
+
+def test_read_hex_file(tmp_path):
+    name = str(tmp_path / 'blink.hex')
+    with open(name, 'w') as f:
+        f.write(record(0x0000, 0x04, b'\x00\x00') +
+                record(0x0000, 0x00, b'\x80\x31\x02\x28') +       # 0000: 3180 2802
+                record(0x0FFE, 0x00, b'\x00\x28') +               # 07FF: 2800
+                record(0x0000, 0x04, b'\x00\x01') +
+                record(0x000E, 0x00, b'\xE4\x39') +               # 8007: 39E4
+                record(0xE00A, 0x00, b'\x5A\x00') +               # F005: 5A
+                record(0x0000, 0x01, b''))
+    image = read_hex_file(name, DEVICE)
+    assert list(image['P'][:3]) == [0x3180, 0x2802, 0x3FFF]
+    assert image['P'][0x7FF] == 0x2800
+    assert list(image['C']) == [0x39E4, 0x3FFF]
+    assert (image['D'][5], image['D'][4]) == (0x5A, 0xFF)
+
+
+@pytest.mark.parametrize('line', [
+    ':0400000000010203F5',          # checksum
+    ':04000000000102zzF4',          # hex digit
+    '04000000000102030AF4',         # start code
+    ':0500000000010203F4',          # data length
+    ':00000007F9',                  # record type
+])
+def test_read_hex_file_invalid(tmp_path, line):
+    name = str(tmp_path / 'bad.hex')
+    with open(name, 'w') as f:
+        f.write(line + '\n')
+    assert read_hex_file(name, DEVICE) is None
+
+
+def test_write_read_hex_file(tmp_path):
+    name = str(tmp_path / 'blink.hex')
+    image = make_image()
+    assert write_hex_file(name, image, record_words=8) == 0x100 // 8 + 4     # P, last P word, C, D 0 and 5
+    assert read_hex_file(name, DEVICE) == image
+
+
+def test_write_hex_file_blank(tmp_path):
+    name = str(tmp_path / 'blank.hex')
+    image = {x: MemoryImage(*DEVICE[x]) for x in REGIONS}
+    assert write_hex_file(name, image) == 0
+    assert read_hex_file(name, DEVICE) == image
+
+def write_records(name, image):
+    # image as one data record per word
+    with open(name, 'w') as f:
+        f.write(record(0x0000, 0x04, b'\x00\x00'))
+        extended = 0
+        for x in REGIONS:
+            region = image[x]
+            for i, word in enumerate(region):
+                if word == region.blank:
+                    continue
+                byte_address = (region.address + i) * 2
+                if byte_address >> 16 != extended:
+                    extended = byte_address >> 16
+                    f.write(record(0x0000, 0x04, bytes([extended >> 8, extended & 0xFF])))
+                f.write(record(byte_address & 0xFFFF, 0x00, bytes([word & 0xFF, word >> 8])))
+        f.write(record(0x0000, 0x01, b''))
+
+
+def test_write_read_bin_image():
+    image = make_image()
+    buffer = io.BytesIO()
+    write_bin_image(buffer, DEVICE, (0x1234, 56), image)
+    buffer.seek(0)
+    assert read_bin_image(buffer, DEVICE) == image
+    buffer.seek(0)
+    assert read_bin_image(buffer, DEVICE, (0x1234, 56)) == image
+
+
+@pytest.mark.parametrize('device, key', [
+    (dict(DEVICE, device_id='3000'), (0x1234, 56)),     # other device
+    (DEVICE, (0x1234, 57)),                             # other .hex file
+])
+def test_read_bin_image_mismatch(device, key):
+    buffer = io.BytesIO()
+    write_bin_image(buffer, DEVICE, (0x1234, 56), make_image())
+    buffer.seek(0)
+    assert read_bin_image(buffer, device, key) is None
+
+
+def test_read_bin_image_corrupt():
+    buffer = io.BytesIO()
+    write_bin_image(buffer, DEVICE, (0, 0), make_image())
+    data = bytearray(buffer.getvalue())
+    data[-1] ^= 0x01
+    assert read_bin_image(io.BytesIO(bytes(data)), DEVICE) is None
+    assert read_bin_image(io.BytesIO(bytes(data[:-2])), DEVICE) is None
+
+
+def test_load_hex_file_writes_bin(tmp_path):
+    name = str(tmp_path / 'blink.hex')
+    image = make_image()
+    write_records(name, image)
+    clear_hex_cache()
+    assert load_hex_file(name, DEVICE, (1, 2)) == image
+    # the binary image is keyed on the contents of the .hex file, not on its stamp
+    assert read_bin_file(bin_file_name(name), DEVICE, hex_key(name)) == image
+    with open(name, 'a') as f:
+        f.write('\n')
+    assert read_bin_file(bin_file_name(name), DEVICE, hex_key(name)) is None
+
+
+def test_write_read_bin_file(tmp_path):
+    name = str(tmp_path / 'blink.hex')
+    image = make_image()
+    write_records(name, image)
+    assert write_bin_file(bin_file_name(name), DEVICE, hex_key(name), image)
+    assert read_bin_file(bin_file_name(name), DEVICE, hex_key(name)) == image
@@ -0,0 +1,175 @@
+# Test plan, polling, reports and bench of i2ctest.py
+
+import json
+from xml.dom import minidom
+
+import pytest
+
+import i2ctest              # Test_Error and Test_Result by the module, not collected as tests
+from i2ctest import (POLL_BACKOFF, POLL_INTERVAL, POLL_MAX_INTERVAL, POLL_TIMEOUT, I2C_Op, Latency_Histogram,
+                     compile_test, json_report, junit_report, parse_directives, wait_until)
+
+WAIT = (POLL_TIMEOUT, POLL_INTERVAL, POLL_BACKOFF, POLL_MAX_INTERVAL)
+
+
+# compile_test()
+
+def test_compile_expectations():
+    plan, lines = compile_test(['# comment', '', 'wr ff 3', '=> 01 01 08', '=> 01 01 01', 'w 10 05', '=> no-resp'])
+    assert lines == 7
+    assert [(op.line, op.cmd, op.expect) for op in plan] == [
+        (4, 'WR', b'\x01\x01\x08'), (5, 'WR', b'\x01\x01\x01'), (7, 'W', 'NO-RESP')]
+    assert plan[0].tx == b'\xff' and len(plan[0].rx) == 3
+    assert plan[0].rx is plan[1].rx                 # one buffer for the expectations of a command
+    assert [op.header for op in plan] == ['wr ff 3', None, None]
+
+
+def test_compile_unchecked_commands():
+    plan, _ = compile_test(['w 10 05', 'print hello', 'r 2', '=> 05 FF', 'sleep 1'])
+    assert [(op.cmd, op.expect) for op in plan] == [('W', None), ('PRINT', None), ('R', b'\x05\xff'),
+                                                    ('SLEEP', None)]
+    assert plan[1].args == ['HELLO']
+
+
+def test_compile_poll_and_directives():
+    plan, _ = compile_test(['@interval 0.001', '@backoff 2 0.004', 'wr 20 1',
+                            '?ready> 05', '?quick> 07 @timeout 0.05 @interval 0', '=> 07'])
+    ready, quick, done = plan
+    assert (ready.poll, ready.expect, ready.wait) == ('ready', b'\x05', (POLL_TIMEOUT, 0.001, 2, 0.004))
+    assert (quick.poll, quick.expect, quick.wait) == ('quick', b'\x07', (0.05, 0, 2, 0.004))
+    assert (done.poll, done.wait) == (None, None)
+
+
+@pytest.mark.parametrize('lines, message', [
+    (['=> 01'], 'line 1: no command'),
+    (['w 10 zz'], 'line 1: invalid data'),
+    (['r x'], 'line 1: the byte length'),
+    (['@timeout'], 'line 1: invalid directive'),
+    (['wr 20 1', '?a> 05 @delay 1'], 'line 2: invalid directive'),
+])
+def test_compile_errors(lines, message):
+    with pytest.raises(i2ctest.Test_Error, match=message):
+        compile_test(lines)
+
+
+# parse_directives()
+
+def test_parse_directives():
+    assert parse_directives('@timeout 2 @interval 0', WAIT, 1) == (2, 0, POLL_BACKOFF, POLL_MAX_INTERVAL)
+    assert parse_directives('@BACKOFF 1.5', WAIT, 1) == (POLL_TIMEOUT, POLL_INTERVAL, 1.5, POLL_MAX_INTERVAL)
+    assert parse_directives('@backoff 2 0.5', WAIT, 1)[2:] == (2, 0.5)
+    assert parse_directives('', WAIT, 1) == WAIT
+
+
+@pytest.mark.parametrize('text', ['@timeout', '@timeout x', '@unknown 1', '@'])
+def test_parse_directives_invalid(text):
+    with pytest.raises(i2ctest.Test_Error, match='line 3: invalid directive'):
+        parse_directives(text, WAIT, 3)
+
+
+# wait_until()
+
+class Clock:
+    # monotonic_ns() and sleep() in simulated time, each transfer takes 1 ms
+    def __init__(self):
+        self.ns = 0
+        self.sleeps = []
+
+    def monotonic_ns(self):
+        return self.ns
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.ns += int(seconds * 1e9)
+
+    def transfer_from(self, responses):
+        responses = iter(responses)
+
+        def transfer(op):
+            self.ns += 1000000
+            return next(responses)
+        return transfer
+
+
+def poll_op(wait):
+    return I2C_Op(1, 'r 1', 'R', ['1'], rx=bytearray(1)).expected(2, b'\x05', 'ready', wait)
+
+
+def test_wait_until_match():
+    clock = Clock()
+    transfer = clock.transfer_from([b'\x00', b'\x00', b'\x05'])
+    resp, ok, sec, polls = wait_until(transfer, poll_op((1, 0.002, 2, 0.003)), clock.monotonic_ns, clock.sleep)
+    assert (resp, ok, polls) == (b'\x05', True, 3)
+    assert clock.sleeps == [0.002, 0.003]           # backoff up to the max interval
+    assert sec == pytest.approx(0.008)
+
+
+def test_wait_until_timeout():
+    clock = Clock()
+    transfer = clock.transfer_from([b'\x00'] * 100)
+    resp, ok, sec, polls = wait_until(transfer, poll_op((0.010, 0.004, 1, 0.1)), clock.monotonic_ns, clock.sleep)
+    assert (resp, ok) == (b'\x00', False)
+    assert polls == 3
+    assert clock.sleeps == [0.004, 0.004]
+    assert sec == pytest.approx(0.011)
+
+
+def test_wait_until_back_to_back():
+    clock = Clock()
+    transfer = clock.transfer_from([None, b'\x00', b'\x05'])
+    resp, ok, sec, polls = wait_until(transfer, poll_op((1, 0, 1, 0.1)), clock.monotonic_ns, clock.sleep)
+    assert (resp, ok, polls) == (b'\x05', True, 3)
+    assert clock.sleeps == []
+
+
+# Reports
+
+def results():
+    plan, _ = compile_test(['wr ff 3', '=> 01 01 08', 'adr <&"x">', '=> "a" & <b>'])
+    return [i2ctest.Test_Result(plan[0], bytearray(b'\x01\x01\x08'), True, 412, 1),
+            i2ctest.Test_Result(plan[1], None, False, 1500, 4)]
+
+
+SUMMARY = {'tests': 2, 'passed': 1, 'failed': 1, 'transactions': 5, 'sec': 0.01}
+
+
+def test_json_report():
+    lines = json_report('i2c_"1"', results(), SUMMARY).splitlines()
+    records = [json.loads(x) for x in lines]
+    assert records[0] == {'file': 'i2c_"1"', 'line': 2, 'command': 'wr ff 3', 'expect': '01 01 08',
+                          'actual': '01 01 08', 'status': 'pass', 'us': 412, 'polls': 1}
+    assert records[1]['command'] == 'adr <&"x">'
+    assert (records[1]['expect'], records[1]['actual'], records[1]['status']) == ('"A" & <B>', 'ERROR', 'fail')
+    assert records[2] == dict(SUMMARY, file='i2c_"1"')
+
+
+def test_junit_report_escaping():
+    xml = junit_report('i2c <&> "1"', results(), SUMMARY)
+    suite = minidom.parseString(xml).documentElement
+    assert suite.getAttribute('name') == 'i2c <&> "1"'
+    assert (suite.getAttribute('tests'), suite.getAttribute('failures')) == ('2', '1')
+    cases = suite.getElementsByTagName('testcase')
+    assert [x.getAttribute('name') for x in cases] == ['line 2: wr ff 3', 'line 4: adr <&"x">']
+    assert not cases[0].getElementsByTagName('failure')
+    failure = cases[1].getElementsByTagName('failure')[0]
+    assert failure.getAttribute('message') == 'expected "A" & <B>, actual ERROR (4 polls)'
+
+
+# Latency_Histogram
+
+def test_latency_histogram_bins():
+    histogram = Latency_Histogram()
+    for us in (10, 49, 50, 99, 100, 999, 100000, 250000):
+        histogram.add(us)
+    assert histogram.bins == [2, 2, 1, 0, 1, 0, 0, 0, 0, 2]
+    assert (histogram.count, histogram.min, histogram.max) == (8, 10, 250000)
+    lines = histogram.lines()
+    assert lines[0] == f'Latency: min/avg/max 10/{sum((10, 49, 50, 99, 100, 999, 100000, 250000)) // 8}/250000 us'
+    assert len(lines) == 1 + len(histogram.bins)     # from the first to the last bin in use
+    assert lines[1].split()[:4] == ['<', '50', 'us', '2']
+    assert lines[-1].split()[:4] == ['>=', '100000', 'us', '2']
+    assert lines[1].endswith('#' * Latency_Histogram.WIDTH)
+
+
+def test_latency_histogram_empty():
+    assert Latency_Histogram().lines() == []
@@ -0,0 +1,351 @@
+# ICSP on a simulated PIC16F1xxx, icsp.py
+
+import pytest
+
+from hexfile import MemoryImage
+from icsp import ICSP, TIMING_PIC16F1XXX
+from sim import Sim_Backend, SimPIC16F1xxx
+from util import NO_Printer
+
+P = (0x0000, 0x0800, 0x3FFF)
+C = (0x8007, 2, 0x3FFF)
+D = (0xF000, 0x0100, 0xFF)
+
+
+def connect(engine='fast', timing=None, target=None):
+    # returns (icsp in LVP mode, target, backend)
+    backend = Sim_Backend()
+    target = target or SimPIC16F1xxx(0x2CE0)
+    backend.connect(target, 'MCLR', 'ICSPCLK', 'ICSPDAT')
+    icsp = ICSP('MCLR', 'ICSPCLK', 'ICSPDAT', engine, backend)
+    icsp.set_timing(timing)
+    with NO_Printer():
+        icsp.set_lvp_mode()
+    return icsp, target, backend
+
+
+class FlakyTarget(SimPIC16F1xxx):
+    # a word which fails to program `fails` times, then programs fine
+    def __init__(self, address, fails=1):
+        super().__init__(0x2CE0)
+        self.bad_address = address
+        self.fails = fails
+
+    def program_word(self, address, value):
+        if address == self.bad_address and self.fails:
+            self.fails -= 1
+            return
+        super().program_word(address, value)
+
+
+def make_image(words=0x100, size=0x0800):
+    image = MemoryImage(0x0000, size, 0x3FFF)
+    for i in range(words):
+        image[i] = (i * 0x0123 + 0x0456) & 0x3FFF
+    return image
+
+
+# Read
+
+def test_read_image():
+    icsp, target, _ = connect()
+    target.program[0x0000:0x0003] = [0x3180, 0x2802, 0x0000]
+    target.config[7] = 0x39E4
+    target.data[5] = 0x5A
+    with NO_Printer():
+        image = icsp.read_image(P, C, D)
+    assert image['P'].data.typecode == 'H'
+    assert list(image['P'][:4]) == [0x3180, 0x2802, 0x0000, 0x3FFF]
+    assert list(image['C']) == [0x39E4, 0x3FFF]
+    assert (image['D'][5], image['D'][4]) == (0x5A, 0xFF)
+
+
+# Sparse programming
+
+def sparse_image():
+    image = make_image(0x20)
+    image[0x0405] = 0x2800
+    return image
+
+
+@pytest.mark.parametrize('sparse', [True, False])
+def test_write_program_sparse(sparse):
+    icsp, target, _ = connect()
+    image = sparse_image()
+    with NO_Printer():
+        icsp.write_program_memory(image, sparse)
+        assert icsp.verify_program_memory(image) == []
+    assert target.programmed == (3 if sparse else 0x0800 // 16)      # the used rows only
+    assert target.violations == 0
+
+
+def test_write_data_sparse():
+    icsp, target, _ = connect()
+    image = MemoryImage(*D)
+    image[0x05] = 0x5A
+    image[0x80] = 0x00
+    with NO_Printer():
+        icsp.write_data_memory(image)
+        assert icsp.verify_data_memory(image) == []
+    assert target.programmed == 2
+
+
+# Verify
+
+def test_verify_program_mismatches():
+    image = make_image()
+    icsp, target, _ = programmed(image)
+    target.program[0x0003] = 0x0000
+    target.program[0x0404] = 0x1234
+    with NO_Printer():
+        assert icsp.verify_program_memory(image, first=False) == [(0x0003, image[0x0003], 0x0000),
+                                                                 (0x0404, 0x3FFF, 0x1234)]
+
+
+def test_verify_program_first():
+    image = make_image()
+    icsp, target, _ = programmed(image)
+    clocks = target.clocks
+    with NO_Printer():
+        assert icsp.verify_program_memory(image) == []
+    passed_clocks = target.clocks - clocks
+    target.program[0x0003] = 0x0000
+    clocks = target.clocks
+    with NO_Printer():
+        assert icsp.verify_program_memory(image) == [(0x0003, image[0x0003], 0x0000)]
+    assert target.clocks - clocks < passed_clocks // 50            # stopped in the first column
+
+
+def test_verify_config_and_data():
+    config = MemoryImage(*C)
+    config[0] = 0x39E4
+    data = MemoryImage(*D)
+    data[5] = 0x5A
+    icsp, target, _ = programmed(make_image(), config)
+    with NO_Printer():
+        icsp.write_data_memory(data)
+        assert icsp.verify_configuration(config) == []
+        assert icsp.verify_data_memory(data) == []
+    target.config[8] = 0x0000
+    target.data[5] = 0xA5
+    with NO_Printer():
+        assert icsp.verify_configuration(config) == [(0x8008, 0x3FFF, 0x0000)]
+        assert icsp.verify_data_memory(data) == [(0xF005, 0x5A, 0xA5)]
+
+
+# Delta programming
+
+def programmed(image, config=None):
+    icsp, target, backend = connect()
+    with NO_Printer():
+        icsp.write_program_memory(image)
+        icsp.write_configulation(config)
+    target.commands.clear()
+    target.programmed = 0
+    return icsp, target, backend
+
+
+def test_delta_program():
+    image = make_image()
+    icsp, target, _ = programmed(image)
+    image[0x0012] ^= 0x0100                                     # a programmed row
+    image[0x0300] = 0x0000                                      # a blank row
+    with NO_Printer():
+        result = icsp.delta_program_memory(image)
+    assert (result['mode'], result['touched'], result['rows']) == ('delta', 2, 0x0800 // 16)
+    assert result['sec'] < result['full_sec']
+    assert target.commands.get(0x11) == 1                       # Row Erase of the programmed row only
+    assert target.commands.get(0x09) is None
+    assert target.program == list(image)
+    assert target.violations == 0
+
+
+def test_delta_program_unchanged():
+    image = make_image()
+    icsp, target, _ = programmed(image)
+    with NO_Printer():
+        result = icsp.delta_program_memory(image)
+    assert (result['mode'], result['touched']) == ('delta', 0)
+    assert target.programmed == 0
+
+
+def test_delta_program_bulk():
+    image = make_image(0x0100)
+    icsp, target, _ = programmed(image)
+    image = make_image(0x0800)                                  # most rows differ
+    image[0x0000] = 0x0000
+    with NO_Printer():
+        result = icsp.delta_program_memory(image)
+    assert result['mode'] == 'bulk'
+    assert target.commands.get(0x09) == 1
+    assert target.program == list(image)
+
+
+@pytest.mark.parametrize('new, mode', [
+    (0x39E4, 'delta'),                                          # the same
+    (0x39E0, 'delta'),                                          # bits cleared, programmed without erase
+    (0x39E5, 'bulk'),                                           # a bit set, needs the bulk erase
+])
+def test_delta_program_config(new, mode):
+    image = make_image()
+    config = MemoryImage(*C)
+    config[0] = 0x39E4
+    icsp, target, _ = programmed(image, config)
+    config[0] = new
+    image[0x0012] ^= 0x0100
+    with NO_Printer():
+        result = icsp.delta_program_memory(image, config=config)
+    assert result['mode'] == mode
+    assert target.program == list(image)
+
+
+# Timing profiles
+
+@pytest.mark.parametrize('timing, row_sec', [
+    (None, 5e-3),                                               # 'internal'
+    (TIMING_PIC16F1XXX, 1.05e-3 + 350e-6),                      # 'datasheet'
+    (dict(TIMING_PIC16F1XXX, EXTERNAL=False), 2.5e-3),          # 'datasheet-internal'
+])
+def test_program_row_timing(timing, row_sec):
+    icsp, target, backend = connect('pio', timing)
+    image = make_image()
+    t = backend.monotonic()
+    with NO_Printer():
+        icsp.write_program_memory(image, erase=False)
+    rows = sum(image.used_rows(16))
+    sec = backend.monotonic() - t
+    assert target.program == list(image)
+    assert target.violations == 0
+    assert rows * row_sec < sec < rows * (row_sec + 1e-3)      # the waits and the frames of a row
+
+
+def test_external_timing_margin():
+    # TPEXT and TDIS are close to their Min, well under the TPINT they replace
+    assert 1.0e-3 < TIMING_PIC16F1XXX['TPEXT'] <= 1.1e-3
+    assert 300e-6 < TIMING_PIC16F1XXX['TDIS'] <= 400e-6
+    assert TIMING_PIC16F1XXX['TPEXT'] + TIMING_PIC16F1XXX['TDIS'] < TIMING_PIC16F1XXX['TPINT']
+
+
+# Blank Check
+
+@pytest.mark.parametrize('engine', ['fast', 'pio'])
+def test_blank_check_blank(engine):
+    icsp, target, _ = connect(engine)
+    assert icsp.blank_check(P, C, D) is None
+    assert target.violations == 0
+
+
+@pytest.mark.parametrize('region, address, value', [
+    ('P', 0x0123, 0x1234),
+    ('P', 0x07FF, 0x3FFE),
+    ('C', 0x8008, 0x1FFF),
+    ('D', 0xF005, 0x5A),
+])
+def test_blank_check_found(region, address, value):
+    icsp, target, _ = connect()
+    if region == 'P':
+        target.program[address] = value
+    elif region == 'C':
+        target.config[address & 0x1F] = value
+    else:
+        target.data[address & 0xFF] = value
+    assert icsp.blank_check(P, C, D) == (region, address, value)
+
+
+def test_blank_check_stops_early():
+    icsp, target, _ = connect()
+    icsp.blank_check(P, C, D)
+    blank_clocks = target.clocks
+    target.program[0x0003] = 0x0000
+    icsp.run_reset_address()
+    clocks = target.clocks
+    assert icsp.blank_check(P, C, D) == ('P', 0x0003, 0x0000)
+    assert target.clocks - clocks < blank_clocks // 50     # one column read
+
+
+# Retry
+
+def test_retry_program():
+    image = make_image()
+    icsp, target, _ = connect(target=FlakyTarget(0x0025))
+    with NO_Printer():
+        icsp.write_program_memory(image)
+        errors = icsp.verify_program_memory(image)
+        assert errors == [(0x0025, image[0x0025], 0x3FFF)]
+        assert icsp.error_rows(errors, 0x0000, 16) == [2]
+        target.commands.clear()
+        assert icsp.retry_program_memory(image, errors) == []
+    assert target.commands.get(0x11) == 1                       # Row Erase of the failed row
+    assert target.program == list(image)
+    assert target.violations == 0
+
+
+def test_retry_program_gives_up():
+    image = make_image()
+    icsp, target, _ = connect(target=FlakyTarget(0x0025, fails=10))
+    with NO_Printer():
+        icsp.write_program_memory(image)
+        errors = icsp.retry_program_memory(image, icsp.verify_program_memory(image), retries=3)
+    assert errors == [(0x0025, image[0x0025], 0x3FFF)]
+    assert target.fails == 10 - 1 - 3
+
+
+def test_retry_data():
+    data = MemoryImage(*D)
+    data[5] = 0x5A
+    icsp, target, _ = connect()
+    with NO_Printer():
+        icsp.write_data_memory(data)
+    target.data[5] = 0xFF
+    with NO_Printer():
+        errors = icsp.verify_data_memory(data)
+        assert errors == [(0xF005, 0x5A, 0xFF)]
+        assert icsp.retry_data_memory(data, errors) == []
+    assert target.data[5] == 0x5A
+
+
+# Interleaved program and verify
+
+@pytest.mark.parametrize('window', [16, 256, 0x0800])
+def test_write_verify_program(window):
+    icsp, target, _ = connect()
+    image = make_image(0x300)
+    with NO_Printer():
+        errors, stats = icsp.write_verify_program_memory(image, window=window)
+    assert errors == []
+    assert target.program == list(image)
+    assert stats['rows'] == 0x300 // 16
+    assert target.violations == 0
+
+
+def test_write_verify_program_stops_at_window():
+    icsp, target, _ = connect(target=FlakyTarget(0x0123, fails=10))
+    image = make_image(0x300)
+    with NO_Printer():
+        errors, stats = icsp.write_verify_program_memory(image, window=256)
+    assert errors == [(0x0123, image[0x0123], 0x3FFF)]
+    assert stats['rows'] == 0x200 // 16                         # the window after the failed one is not programmed
+    assert target.program[0x0200] == 0x3FFF
+
+
+def test_write_verify_program_retry():
+    icsp, target, _ = connect(target=FlakyTarget(0x0123))
+    image = make_image(0x300)
+    with NO_Printer():
+        errors, _ = icsp.write_verify_program_memory(image, window=256, retries=2)
+    assert errors == []
+    assert target.program == list(image)
+
+
+def test_write_verify_program_walk():
+    # no speed-up: the walk back to each window adds clocks to the two passes
+    image = make_image(0x800)
+    icsp, target, _ = connect()
+    with NO_Printer():
+        icsp.write_program_memory(image)
+        icsp.verify_program_memory(image)
+    two = target.clocks
+    icsp, target, _ = connect()
+    with NO_Printer():
+        icsp.write_verify_program_memory(image, window=256)
+    assert target.clocks > two
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Gang programming on simulated targets (host-side)
+#
+#   $ python3 tools/bench_gang.py --targets 4 --pin-time 10e-6
+#   $ python3 tools/bench_gang.py --targets 4 --bad 2      # target 2 has a stuck word
+#
+# Programs and verifies `--targets` simulated PIC16F1503 sharing MCLR/ICSPCLK,
+# each on its own ICSPDAT, and compares the simulated time with programming
+# them one by one.
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gang import Gang_ICSP
+from icsp import ICSP
+from sim import Sim_Backend, SimPIC16F1xxx
+from util import NO_Printer
+from bench_icsp import make_image
+
+
+class StuckTarget(SimPIC16F1xxx):
+    # a word which can not be programmed, for the per-target result
+    def program_word(self, address, value):
+        if address != 0x0010:
+            super().program_word(address, value)
+
+
+def program(icsp, image):
+    with NO_Printer():
+        icsp.set_lvp_mode()
+        icsp.write_program_memory(image)
+        errors = icsp.verify_program_memory(image)
+        icsp.set_normal_mode()
+    return errors
+
+
+def run_gang(image, targets, bad, pin_time):
+    backend = Sim_Backend(pin_time)
+    dats = [f'ICSPDAT{ch}' for ch in range(targets)]
+    sims = []
+    for ch, dat in enumerate(dats):
+        target = (StuckTarget if ch == bad else SimPIC16F1xxx)(0x2CE0, program_size=len(image))
+        backend.connect(target, 'MCLR', 'ICSPCLK', dat)
+        sims.append(target)
+    icsp = Gang_ICSP('MCLR', 'ICSPCLK', dats, backend)
+    errors = program(icsp, image)
+    return backend.monotonic(), errors, sum(t.violations for t in sims)
+
+
+def run_single(image, engine, pin_time):
+    backend = Sim_Backend(pin_time)
+    target = SimPIC16F1xxx(0x2CE0, program_size=len(image))
+    backend.connect(target, 'MCLR', 'ICSPCLK', 'ICSPDAT')
+    errors = program(ICSP('MCLR', 'ICSPCLK', 'ICSPDAT', engine, backend), image)
+    return backend.monotonic(), errors, target.violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gang programming on simulated targets')
+    parser.add_argument('--targets', type=int, default=4)
+    parser.add_argument('--words', type=int, default=512, help='words of the image (non-blank)')
+    parser.add_argument('--size', type=int, default=0x0800, help='program memory size in words')
+    parser.add_argument('--pin-time', type=float, default=0.0,
+                        help='seconds per GPIO write by the CPU (e.g. 10e-6 for CircuitPython)')
+    parser.add_argument('--bad', type=int, default=None, help='target with a stuck word')
+    args = parser.parse_args()
+
+    image = make_image(args.words, args.size)
+    single_sec, errors, violations = run_single(image, 'fast', args.pin_time)
+    gang_sec, gang_errors, gang_violations = run_gang(image, args.targets, args.bad, args.pin_time)
+
+    for ch, e in enumerate(gang_errors):
+        print(f'target {ch}: ' + ('OK' if not e else f'NG {e[0][0]:04X}: {e[0][1]:04X} {e[0][2]:04X}'))
+    sequential = single_sec * args.targets
+    print(f'single {single_sec:.3f} s x {args.targets} = {sequential:.3f} s, '
+          f'gang {gang_sec:.3f} s, speedup {sequential / gang_sec:.2f}x ({sequential / gang_sec / args.targets:.0%} of linear)')
+
+    expected = [ch == args.bad for ch in range(args.targets)]
+    ok = not errors and not violations and not gang_violations and [bool(e) for e in gang_errors] == expected
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
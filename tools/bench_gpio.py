@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Pure-Python ICSP path on simulated pins (host-side)
+#
+#   $ python3 tools/bench_gpio.py --words 512
+#
+# Programs and reads back `--words` words by the GPIO engines and reports the
+# wall-clock words/s of the Python code itself (the programming waits are
+# simulated, so they are not included) and the pin writes per word. Both
+# numbers scale with the interpreter overhead per bit on the board.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from icsp import ICSP
+from sim import Sim_Backend, SimPIC16F1xxx
+from util import NO_Printer
+from bench_icsp import make_image
+
+
+def run(engine, image):
+    backend = Sim_Backend()
+    target = SimPIC16F1xxx(0x2CE0, program_size=len(image))
+    backend.connect(target, 'MCLR', 'ICSPCLK', 'ICSPDAT')
+    icsp = ICSP('MCLR', 'ICSPCLK', 'ICSPDAT', engine, backend)
+    pins = [backend.pin(name) for name in ('ICSPCLK', 'ICSPDAT')]
+
+    with NO_Printer():
+        icsp.set_lvp_mode()
+        w0 = sum(p.writes for p in pins)
+        t0 = time.perf_counter()
+        icsp.write_program_memory(image, sparse=False)
+        t1 = time.perf_counter()
+        data = icsp.read_program_memory(len(image))
+        t2 = time.perf_counter()
+        icsp.set_normal_mode()
+    writes = sum(p.writes for p in pins) - w0
+
+    return {'engine': icsp.engine_name,
+            'ok': data == image and not target.violations,
+            'write_sec': t1 - t0, 'read_sec': t2 - t1,
+            'writes': writes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pure-Python ICSP path on simulated pins')
+    parser.add_argument('--words', type=int, default=512, help='program memory size in words')
+    args = parser.parse_args()
+
+    image = make_image(args.words, args.words)
+    results = [run(engine, image) for engine in ('gpio', 'fast')]
+    print(f'{"engine":6} {"result":6} {"write w/s":>10} {"read w/s":>10} {"pin/word":>9} {"speedup":>8}')
+    base = results[0]['write_sec'] + results[0]['read_sec']
+    for r in results:
+        sec = r['write_sec'] + r['read_sec']
+        print(f'{r["engine"]:6} {"OK" if r["ok"] else "NG":6} '
+              f'{len(image) / r["write_sec"]:10.0f} {len(image) / r["read_sec"]:10.0f} '
+              f'{r["writes"] / len(image):9.1f} {base / sec:7.2f}x')
+    return 0 if all(r['ok'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Intel HEX parse time (host-side)
+#
+#   $ python3 tools/bench_hex.py --words 4096 --repeat 5
+#
+# Generates an image of `--words` program words plus configuration and data
+# memory, then compares hexfile.read_hex_file() against the former parser
+# which decoded every byte by int(line[i:i+2], 16), and the binary image
+# (hexfile.read_bin_file()) which is loaded instead of the .hex after the
+# first load.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hexfile import REGIONS, read_hex_file, read_bin_file, write_bin_file
+
+
+def read_hex_file_int(name, device):
+    # former parser, per-character int() slicing
+    regions = [(device[x][0], device[x][1], [device[x][2]] * device[x][1]) for x in REGIONS]
+    extended_linear_address = '0000'
+    with open(name, 'r') as file:
+        for line in file:
+            line = line.rstrip()
+            address = line[3:7]
+            record_type = line[7:9]
+            data = line[9:-2]
+            if line[0] != ':' or (int(line[1:3], 16) * 2) != len(data):
+                return
+            byte_data = [int(line[i : i + 2], 16) for i in range(1, len(line), 2)]
+            if sum(byte_data) & 0xFF:
+                return
+            if record_type == '00':
+                absolute_address = int(extended_linear_address + address, 16) >> 1
+                for memory_address, memory_size, memory_buffer in regions:
+                    offset_address = absolute_address - memory_address
+                    if 0 <= offset_address < memory_size:
+                        for i in range(0, len(data), 4):
+                            value = int(data[i + 2 : i + 4] + data[i : i + 2], 16)
+                            memory_buffer[offset_address + (i >> 2)] = value
+                        break
+            elif record_type == '04':
+                extended_linear_address = line[9:13]
+            elif record_type == '01':
+                break
+    return {x: region[2] for x, region in zip(REGIONS, regions)}
+
+
+def record(address, record_type, data):
+    raw = bytes([len(data), address >> 8, address & 0xFF, record_type]) + bytes(data)
+    return ':' + raw.hex().upper() + '%02X' % (-sum(raw) & 0xFF)
+
+
+def make_hex(path, words, data_size):
+    random.seed(words)
+    lines = [record(0x0000, 0x04, [0x00, 0x00])]
+    for address in range(0, words, 8):
+        raw = []
+        for _ in range(min(8, words - address)):
+            value = random.randrange(0x4000)
+            raw += [value & 0xFF, value >> 8]
+        lines.append(record(address * 2, 0x00, raw))
+    lines.append(record(0x0000, 0x04, [0x00, 0x01]))
+    lines.append(record(0x000E, 0x00, [0xE4, 0x39, 0xFF, 0x3F]))
+    for address in range(0, data_size, 8):
+        raw = []
+        for _ in range(8):
+            raw += [random.randrange(0x100), 0x00]
+        lines.append(record(0xE000 + address * 2, 0x00, raw))
+    lines.append(record(0x0000, 0x01, []))
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def bench(func, path, device, repeat):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        image = func(path, device)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best, image
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Intel HEX parse time')
+    parser.add_argument('--words', type=int, default=0x1000, help='program memory words in the image')
+    parser.add_argument('--data', type=int, default=0x100, help='data memory bytes in the image')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    device = {'P': [0x0000, args.words, 0x3FFF],
+              'C': [0x8007, 0x0002, 0x3FFF],
+              'D': [0xF000, args.data, 0x00FF]}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.hex')
+        make_hex(path, args.words, args.data)
+        t_int, image_int = bench(read_hex_file_int, path, device, args.repeat)
+        t_new, image_new = bench(read_hex_file, path, device, args.repeat)
+        bin_path = os.path.join(tmp, 'bench.bin')
+        write_bin_file(bin_path, device, (0, 0), image_new)
+        t_bin, image_bin = bench(lambda name, device: read_bin_file(name, device, (0, 0)),
+                                 bin_path, device, args.repeat)
+
+    if any(image_int[x] != list(image_new[x]) for x in REGIONS) or \
+       image_bin is None or any(image_bin[x] != image_new[x] for x in REGIONS):
+        print('Error: parsers disagree')
+        return 1
+    print(f'int() slicing       : {t_int * 1e3:8.2f} ms')
+    print(f'unhexlify/unpack    : {t_new * 1e3:8.2f} ms  ({t_int / t_new:.1f}x)')
+    print(f'binary image        : {t_bin * 1e3:8.2f} ms  ({t_int / t_bin:.1f}x)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
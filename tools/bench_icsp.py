@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# ICSP throughput on the simulated target (host-side)
+#
+#   $ python3 tools/bench_icsp.py --words 512
+#   $ python3 tools/bench_icsp.py --engine pio --max-clocks-per-word 60    # CI gate
+#   $ python3 tools/bench_icsp.py --timing all
+#   $ python3 tools/bench_icsp.py --engine fast --interleave 64 256 1024
+#   $ python3 tools/bench_icsp.py --blank --pin-time 10e-6
+#
+# Programs `--words` words into a simulated PIC16F1503, verifies them and
+# reports clocks and simulated time per word for each engine and timing profile.
+# --interleave compares WP then VP (two passes) with the one pass of
+# ICSP.write_verify_program_memory() by the read back windows (words).
+# --blank compares BC on a blank device with the bulk erases it lets Auto-Prog skip.
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hexfile import MemoryImage
+from icsp import ICSP, TIMING_PIC16F1XXX
+from sim import Sim_Backend, SimPIC16F1xxx
+from util import NO_Printer
+
+
+def make_image(words, size):
+    image = MemoryImage(0x0000, size, 0x3FFF)
+    for i in range(words):
+        image[i] = (i * 0x0123 + 0x0456) & 0x3FFF
+    return image
+
+
+# see ICSP_TIMING in code.py
+TIMINGS = {'internal': None, 'datasheet': TIMING_PIC16F1XXX,
+           'datasheet-internal': dict(TIMING_PIC16F1XXX, EXTERNAL=False)}
+
+
+def run(engine, image, pin_time, timing=None, latch=16):
+    backend = Sim_Backend(pin_time)
+    target = SimPIC16F1xxx(0x2CE0, program_size=len(image), latch=latch)
+    backend.connect(target, 'MCLR', 'ICSPCLK', 'ICSPDAT')
+    icsp = ICSP('MCLR', 'ICSPCLK', 'ICSPDAT', engine, backend)
+    icsp.set_timing(timing)
+
+    with NO_Printer():
+        icsp.set_lvp_mode()
+        t0, c0 = backend.monotonic(), target.clocks
+        icsp.write_program_memory(image, latch=latch)
+        t1, c1 = backend.monotonic(), target.clocks
+        data = icsp.read_program_memory(len(image))
+        t2, c2 = backend.monotonic(), target.clocks
+        icsp.set_normal_mode()
+
+    return {'engine': icsp.engine_name,
+            'ok': data == image and target.program == list(image),
+            'write_clocks': c1 - c0, 'write_sec': t1 - t0,
+            'read_clocks': c2 - c1, 'read_sec': t2 - t1,
+            'violations': target.violations}
+
+
+def run_interleave(engine, image, pin_time, timing=None, latch=16, window=0):
+    # window 0: two passes
+    backend = Sim_Backend(pin_time)
+    target = SimPIC16F1xxx(0x2CE0, program_size=len(image), latch=latch)
+    backend.connect(target, 'MCLR', 'ICSPCLK', 'ICSPDAT')
+    icsp = ICSP('MCLR', 'ICSPCLK', 'ICSPDAT', engine, backend)
+    icsp.set_timing(timing)
+
+    with NO_Printer():
+        icsp.set_lvp_mode()
+        t0, c0 = backend.monotonic(), target.clocks
+        if window:
+            errors, stats = icsp.write_verify_program_memory(image, latch=latch, window=window)
+        else:
+            icsp.write_program_memory(image, latch=latch)
+            errors = icsp.verify_program_memory(image)
+        t1, c1 = backend.monotonic(), target.clocks
+        icsp.set_normal_mode()
+
+    return {'ok': not errors and target.program == list(image), 'clocks': c1 - c0, 'sec': t1 - t0,
+            'rows': sum(image.used_rows(latch)), 'violations': target.violations}
+
+
+def run_blank(engine, size, pin_time, timing=None):
+    # BC of a blank device (the worst case, every word is read) and the erases of P and D
+    backend = Sim_Backend(pin_time)
+    target = SimPIC16F1xxx(0x2CE0, program_size=size)
+    backend.connect(target, 'MCLR', 'ICSPCLK', 'ICSPDAT')
+    icsp = ICSP('MCLR', 'ICSPCLK', 'ICSPDAT', engine, backend)
+    icsp.set_timing(timing)
+
+    with NO_Printer():
+        icsp.set_lvp_mode()
+        t0 = backend.monotonic()
+        found = icsp.blank_check((0x0000, size, 0x3FFF), (0x8007, 2, 0x3FFF), (0xF000, target.data_size, 0xFF))
+        t1 = backend.monotonic()
+        icsp.erase_program_memory()
+        icsp.erase_data_memory()
+        t2 = backend.monotonic()
+        icsp.set_normal_mode()
+
+    return {'ok': found is None, 'blank_sec': t1 - t0, 'erase_sec': t2 - t1, 'violations': target.violations}
+
+
+def blank(args, engines, timings):
+    print(f'{"engine":6} {"timing":18} {"result":6} {"BC[s]":>9} {"erase[s]":>9}')
+    failed = False
+    for engine, timing in [(e, t) for e in engines for t in timings]:
+        r = run_blank(engine, args.size, args.pin_time, TIMINGS[timing])
+        ok = r['ok'] and not r['violations']
+        print(f'{engine:6} {timing:18} {"OK" if ok else "NG":6} {r["blank_sec"]:9.4f} {r["erase_sec"]:9.4f}')
+        failed = failed or not ok
+    return 1 if failed else 0
+
+
+def interleave(args, image, engines, timings):
+    print(f'{"engine":6} {"timing":18} {"pass":10} {"result":6} {"clk/word":>9} {"sec":>9} {"ms/row":>9}')
+    failed = False
+    for engine, timing in [(e, t) for e in engines for t in timings]:
+        for window in [0] + args.interleave:
+            r = run_interleave(engine, image, args.pin_time, TIMINGS[timing], args.latch, window)
+            ok = r['ok'] and not r['violations']
+            name = f'one/{window}' if window else 'two'
+            print(f'{engine:6} {timing:18} {name:10} {"OK" if ok else "NG":6} {r["clocks"] / len(image):9.1f} '
+                  f'{r["sec"]:9.4f} {r["sec"] * 1000 / r["rows"]:9.3f}')
+            failed = failed or not ok
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ICSP throughput on the simulated target')
+    parser.add_argument('--engine', choices=['gpio', 'fast', 'pio', 'all'], default='all')
+    parser.add_argument('--timing', choices=list(TIMINGS) + ['all'], default='internal',
+                        help='timing profile, see ICSP.TIMING and TIMING_PIC16F1XXX')
+    parser.add_argument('--words', type=int, default=512, help='words of the image (non-blank)')
+    parser.add_argument('--size', type=int, default=0x0800, help='program memory size in words')
+    parser.add_argument('--latch', type=int, default=16, help='write latches of the target (words)')
+    parser.add_argument('--pin-time', type=float, default=0.0,
+                        help='seconds per GPIO write by the CPU (e.g. 10e-6 for CircuitPython)')
+    parser.add_argument('--max-clocks-per-word', type=float, default=None,
+                        help='exit 1 when program+verify clocks per word exceeds this')
+    parser.add_argument('--interleave', type=int, nargs='+', default=None, metavar='WINDOW',
+                        help='compare two passes with one pass by these read back windows (words)')
+    parser.add_argument('--blank', action='store_true', help='compare BC of a blank device with the bulk erases')
+    args = parser.parse_args()
+
+    image = make_image(args.words, args.size)
+    engines = ['gpio', 'fast', 'pio'] if args.engine == 'all' else [args.engine]
+    timings = list(TIMINGS) if args.timing == 'all' else [args.timing]
+    if args.blank:
+        return blank(args, engines, timings)
+    if args.interleave:
+        return interleave(args, image, engines, timings)
+    failed = False
+    print(f'{"engine":6} {"timing":18} {"result":6} {"clk/word":>9} {"write[s]":>9} {"read[s]":>9} {"words/s":>9}')
+    for engine, timing in [(e, t) for e in engines for t in timings]:
+        r = run(engine, image, args.pin_time, TIMINGS[timing], args.latch)
+        clocks_per_word = (r['write_clocks'] + r['read_clocks']) / len(image)
+        sec = r['write_sec'] + r['read_sec']
+        ok = r['ok'] and not r['violations']
+        print(f'{r["engine"]:6} {timing:18} {"OK" if ok else "NG":6} {clocks_per_word:9.1f} '
+              f'{r["write_sec"]:9.4f} {r["read_sec"]:9.4f} {len(image) / sec:9.0f}')
+        if not ok:
+            failed = True
+        if args.max_clocks_per_word is not None and clocks_per_word > args.max_clocks_per_word:
+            print(f'Error: {clocks_per_word:.1f} clocks/word exceeds {args.max_clocks_per_word}')
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
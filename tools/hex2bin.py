@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Intel HEX to RP2PIC binary image (host-side)
+#
+#   $ python3 tools/hex2bin.py blink.hex --device 2CE0
+#
+# Writes blink.bin next to blink.hex in the format of hexfile.write_bin_file(),
+# the same file RP2PIC generates on the first load. Copy both to CIRCUITPY
+# (the .bin is used while the CRC32 and size of the .hex file match, otherwise
+# RP2PIC parses the .hex file, and rewrites the .bin if CIRCUITPY is writable).
+
+import argparse
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from devicedb import find_device
+from hexfile import bin_file_name, hex_key, read_hex_file, write_bin_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Intel HEX to RP2PIC binary image')
+    parser.add_argument('hex', help='.hex file')
+    parser.add_argument('--device', required=True, help='Device ID in hex, e.g. 2CE0 (see devices.txt)')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'devices.txt'), help='device database')
+    parser.add_argument('-o', '--output', help='binary image (default: .bin next to the .hex)')
+    args = parser.parse_args()
+
+    device_id = int(args.device, 16) & 0x3FE0
+    device = find_device(device_id, args.db)
+    if device is None:
+        print(f'Error: Device ID {device_id:04X} is not in {args.db}')
+        return 1
+    device['device_id'] = device_id
+
+    image = read_hex_file(args.hex, device)
+    if image is None:
+        print(f'Error: Can not parse {args.hex}')
+        return 1
+    output = args.output or bin_file_name(args.hex)
+    if not write_bin_file(output, device, hex_key(args.hex), image):
+        print(f'Error: Can not write {output}')
+        return 1
+    print(f'{output}: {device["N"]}, ' + ', '.join(f'{x} {len(image[x])} words' for x in image))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
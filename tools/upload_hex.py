@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Uploads a .hex file to RP2PIC over the upload channel (host-side)
+#
+#   $ python3 tools/upload_hex.py blink.hex --port /dev/ttyACM1          # upload and program
+#   $ python3 tools/upload_hex.py blink.hex --port /dev/ttyACM1 --write  # upload only
+#   $ python3 tools/upload_hex.py golden.hex --port /dev/ttyACM1 --read  # read the device out
+#
+# The port is the second serial of RP2PIC (usb_cdc.data, see boot.py), not
+# the console. The .hex file is parsed here into the regions of the device
+# RP2PIC reports, and sent as a binary image (see upload.py).
+# tools/upload_stub.py is a stand-in of RP2PIC on a pty for testing.
+
+import argparse
+import io
+import os
+import sys
+import time
+from struct import pack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hexfile import REGIONS, bin_image_size, read_bin_image, read_hex_file, write_bin_image, write_hex_file
+from upload import UPLOAD_MAGIC
+
+CHUNK = 512
+
+
+class Port:
+    # pyserial if installed, otherwise a raw tty (e.g. a pty of upload_stub.py)
+    def __init__(self, path, timeout=10.0):
+        self.timeout = timeout
+        try:
+            import serial
+            self.serial = serial.Serial(path, timeout=timeout)
+            self.fd = None
+        except ImportError:
+            import termios
+            import tty
+            self.serial = None
+            self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+            tty.setraw(self.fd, termios.TCSANOW)
+
+    def write(self, data):
+        if self.serial:
+            self.serial.write(data)
+            return
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+    def read(self, size):
+        if self.serial:
+            return self.serial.read(size)
+        import select
+        data = b''
+        deadline = time.monotonic() + self.timeout
+        while len(data) < size:
+            if not select.select([self.fd], [], [], max(0, deadline - time.monotonic()))[0]:
+                break
+            data += os.read(self.fd, size - len(data))
+        return data
+
+    def readline(self):
+        if self.serial:
+            return self.serial.readline().decode().strip()
+        import select
+        line = b''
+        deadline = time.monotonic() + self.timeout
+        while not line.endswith(b'\n'):
+            if not select.select([self.fd], [], [], max(0, deadline - time.monotonic()))[0]:
+                break
+            line += os.read(self.fd, 1)
+        return line.decode().strip()
+
+    def close(self):
+        if self.serial:
+            self.serial.close()
+        else:
+            os.close(self.fd)
+
+
+def device_info(port):
+    # 'INFO 2CE0 P 0000 0800 3FFF ...' -> device
+    port.write(UPLOAD_MAGIC + b'I')
+    fields = port.readline().split()
+    if not fields or fields[0] != 'INFO':
+        raise RuntimeError(f'no answer from RP2PIC: {fields}')
+    device = {'device_id': fields[1]}
+    for i in range(2, len(fields), 4):
+        device[fields[i]] = [int(x, 16) for x in fields[i + 1 : i + 4]]
+    for x in REGIONS:
+        if x not in device:
+            raise RuntimeError(f'device {fields[1]} is not supported by RP2PIC')
+    return device
+
+
+def upload(port, name, program=True, log=print):
+    t0 = time.monotonic()
+    device = device_info(port)
+    image = read_hex_file(name, device)
+    if image is None:
+        raise RuntimeError(f'can not parse {name}')
+    buffer = io.BytesIO()
+    write_bin_image(buffer, device, (0, 0), image)
+    data = buffer.getvalue()
+    assert len(data) == bin_image_size(image)
+
+    t1 = time.monotonic()
+    port.write(UPLOAD_MAGIC + (b'P' if program else b'W') + pack('<I', len(data)))
+    for offset in range(0, len(data), CHUNK):
+        port.write(data[offset : offset + CHUNK])
+        log(f'\rUpload {device["device_id"]}: {min(offset + CHUNK, len(data))}/{len(data)} bytes', end='')
+    log()
+    reply = port.readline()
+    t2 = time.monotonic()
+    if not reply.startswith('OK'):
+        raise RuntimeError(f'upload failed: {reply}')
+    log(f'Uploaded {len(data)} bytes in {t2 - t1:.3f} s ({len(data) / (t2 - t1) / 1024:.1f} KiB/s)')
+    if not program:
+        return True
+    reply = port.readline()
+    t3 = time.monotonic()
+    log(f'{reply} (programming {t3 - t2:.3f} s, total {t3 - t0:.3f} s)')
+    return reply.startswith('DONE')
+
+
+def readout(port, name, log=print):
+    # reads the device into name (.hex, or .bin for the binary image as received)
+    t0 = time.monotonic()
+    device = device_info(port)
+    port.write(UPLOAD_MAGIC + b'R')
+    reply = port.readline()
+    if not reply.startswith('IMAGE'):
+        raise RuntimeError(f'readout failed: {reply}')
+    data = port.read(int(reply.split()[1]))
+    t1 = time.monotonic()
+    image = read_bin_image(io.BytesIO(data), device)
+    if image is None:
+        raise RuntimeError('broken image')
+    if name.lower().endswith('.bin'):
+        with open(name, 'wb') as file:
+            file.write(data)
+    else:
+        write_hex_file(name, image)
+    log(f'Read {len(data)} bytes in {t1 - t0:.3f} s into {name}')
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Uploads a .hex file to RP2PIC over the upload channel')
+    parser.add_argument('hex', help='.hex file (to write, or to read into)')
+    parser.add_argument('--port', required=True, help='data serial of RP2PIC, e.g. /dev/ttyACM1 or COM5')
+    parser.add_argument('--write', action='store_true', help='upload only, do not program')
+    parser.add_argument('--read', action='store_true', help='read the device out into the file (.hex or .bin)')
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds to wait for RP2PIC')
+    args = parser.parse_args()
+
+    port = Port(args.port, args.timeout)
+    try:
+        if args.read:
+            ok = readout(port, args.hex)
+        else:
+            ok = upload(port, args.hex, not args.write)
+    except RuntimeError as e:
+        print(f'Error: {e}')
+        ok = False
+    finally:
+        port.close()
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Stand-in of RP2PIC for the upload channel on a pty (host-side)
+#
+#   $ python3 tools/upload_stub.py                       # prints the pty to use as --port
+#   $ python3 tools/upload_hex.py blink.hex --port /dev/pts/5
+#   $ python3 tools/upload_stub.py --selftest blink.hex  # both ends in one process
+#
+# Serves upload.Upload_Channel on the pty, programs the uploaded images into
+# a simulated PIC16F1503 (sim.py) by WP/VP/WD/VD/WC/VC as Auto-Prog does, and
+# reads it out.
+
+import argparse
+import os
+import pty
+import select
+import sys
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from devicedb import find_device
+from icsp import ICSP
+from sim import Sim_Backend, SimPIC16F1xxx
+from upload import Upload_Channel
+from util import NO_Printer
+
+
+class Pty_Serial:
+    # usb_cdc.Serial look-alike on the master end of a pty
+    def __init__(self, fd):
+        self.fd = fd
+
+    @property
+    def in_waiting(self):
+        return 1 if select.select([self.fd], [], [], 0)[0] else 0
+
+    def read(self, size):
+        return os.read(self.fd, size)
+
+    def readinto(self, buf):
+        if not select.select([self.fd], [], [], 0.1)[0]:
+            return 0
+        data = os.read(self.fd, len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        os.write(self.fd, data)
+
+
+class Stub:
+    def __init__(self, fd, device_id=0x2CE0):
+        self.channel = Upload_Channel(Pty_Serial(fd))
+        self.device = find_device(device_id, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'devices.txt'))
+        self.device['device_id'] = '%04X' % device_id
+        self.backend = Sim_Backend()
+        self.target = SimPIC16F1xxx(device_id, program_size=self.device['P'][1], data_size=self.device['D'][1])
+        self.backend.connect(self.target, 'MCLR', 'ICSPCLK', 'ICSPDAT')
+        self.icsp = ICSP('MCLR', 'ICSPCLK', 'ICSPDAT', 'pio', self.backend)
+        self.running = True
+
+    def program(self, image):
+        icsp = self.icsp
+        with NO_Printer():
+            icsp.set_lvp_mode()
+            icsp.write_program_memory(image['P'], latch=self.device['L'])
+            errors = icsp.verify_program_memory(image['P'])
+            if image['D'].size and not errors:
+                icsp.write_data_memory(image['D'])
+                errors = icsp.verify_data_memory(image['D'])
+            if not errors:
+                icsp.write_configulation(image['C'])
+                errors = icsp.verify_configuration(image['C'])
+            icsp.set_normal_mode()
+        return errors
+
+    def serve(self):
+        while self.running:
+            request = self.channel.poll(self.device)
+            if request is None:
+                time.sleep(0.001)
+                continue
+            command, image = request
+            if command == 'R':
+                with NO_Printer():
+                    self.icsp.set_lvp_mode()
+                    image = self.icsp.read_image(self.device['P'], self.device['C'], self.device['D'])
+                    self.icsp.set_normal_mode()
+                self.channel.send_image(self.device, image)
+            elif command == 'P':
+                t = self.backend.monotonic()
+                errors = self.program(image)
+                self.channel.reply(f'FAIL Verify {errors[0][0]:04X}' if errors else
+                                   f'DONE {self.backend.monotonic() - t:.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stand-in of RP2PIC for the upload channel on a pty')
+    parser.add_argument('--selftest', metavar='HEX', help='uploads HEX to the stand-in and checks the target')
+    args = parser.parse_args()
+
+    master, slave = pty.openpty()
+    tty.setraw(master)
+    stub = Stub(master)
+    port_name = os.ttyname(slave)
+    if not args.selftest:
+        print(f'RP2PIC stand-in on {port_name}, Ctrl-C to stop')
+        try:
+            stub.serve()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    from upload_hex import Port, readout, upload
+    from hexfile import read_hex_file
+    thread = threading.Thread(target=stub.serve, daemon=True)
+    thread.start()
+    port = Port(port_name)
+    readout_name = os.path.splitext(args.selftest)[0] + '_readout.hex'
+    try:
+        ok = upload(port, args.selftest)
+        ok = ok and readout(port, readout_name)
+    finally:
+        stub.running = False
+        port.close()
+    expected = read_hex_file(args.selftest, stub.device)
+    ok = ok and stub.target.program == list(expected['P'])
+    back = read_hex_file(readout_name, stub.device)
+    ok = ok and all(back[x] == expected[x] for x in expected)
+    print('Selftest ' + ('OK' if ok else 'NG'))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
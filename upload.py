@@ -0,0 +1,131 @@
+# ----------------------------------------------------------------------------
+# Upload Channel
+#
+# Images are pushed over a serial channel (usb_cdc.data, enabled by boot.py)
+# straight into RAM, without copying a .hex file to CIRCUITPY. The host side
+# is tools/upload_hex.py.
+#
+# Request (host -> RP2PIC): UPLOAD_MAGIC, command (1 byte), and for 'W'/'P'
+# the length (u32 little-endian) followed by a binary image of that length,
+# see the binary image in hexfile.py (the words are checked by its CRC32).
+#   'I' : device info, answered by 'INFO <Device ID> <region> <address> <size> <blank> ...'
+#   'W' : loads the image into RAM, used as the hex file by the commands and Auto-Prog
+#   'P' : 'W' and programs it by the Auto-Prog steps
+#   'R' : reads the device, answered by 'IMAGE <length>' and a binary image of that length
+# Reply (RP2PIC -> host): text lines
+#   'OK <bytes> <seconds>', 'ERR <reason>', 'DONE <seconds>', 'FAIL <reason>'
+
+import time
+from struct import pack_into, unpack
+from hexfile import REGIONS, bin_image_size, read_bin_image, write_bin_image
+
+UPLOAD_MAGIC = b'RP2U'
+UPLOAD_TIMEOUT = 2.0        # seconds without a byte in a request
+
+
+class Upload_Error(Exception):
+    pass
+
+
+class Serial_Reader:
+    # read(n)/readinto(array('H')) filled up from a serial, as a file for read_bin_image()
+    CHUNK = 64
+
+    def __init__(self, serial, limit):
+        self.serial = serial
+        self.limit = limit      # bytes of the request left
+        self.chunk = bytearray(self.CHUNK)
+
+    def _fill(self, buf, size):
+        view = memoryview(buf)
+        got = 0
+        deadline = time.monotonic() + UPLOAD_TIMEOUT
+        while got < size:
+            n = self.serial.readinto(view[got:size])
+            if n:
+                got += n
+                deadline = time.monotonic() + UPLOAD_TIMEOUT
+            elif time.monotonic() > deadline:
+                raise Upload_Error('timeout')
+        self.limit -= size
+
+    def read(self, size):
+        size = min(size, self.limit)
+        buf = bytearray(size)
+        self._fill(buf, size)
+        return bytes(buf)
+
+    def readinto(self, words):
+        # words: array('H'), returns the number of bytes
+        size = min(2 * len(words), self.limit)
+        offset = 0
+        while offset < size:
+            n = min(self.CHUNK, size - offset)
+            self._fill(self.chunk, n)
+            pack_into('%ds' % n, words, offset, self.chunk[:n])
+            offset += n
+        return size
+
+
+class Upload_Channel:
+    def __init__(self, serial):
+        self.serial = serial        # usb_cdc.data or a stand-in: in_waiting, read, readinto, write
+
+    def reply(self, text):
+        self.serial.write((text + '\n').encode())
+
+    def send_image(self, device, image):
+        # answer to 'R'
+        self.reply(f'IMAGE {bin_image_size(image)}')
+        write_bin_image(self.serial, device, (0, 0), image)
+
+    def poll(self, device):
+        # serves a request if any, returns (command, image) of 'W'/'P' or ('R', None), or None
+        if not self.serial.in_waiting:
+            return None
+        try:
+            return self.serve(device)
+        except Upload_Error as e:
+            self.reply(f'ERR {e}')
+            self.flush()
+            return None
+
+    def flush(self):
+        while self.serial.in_waiting:
+            self.serial.read(self.serial.in_waiting)
+
+    def serve(self, device):
+        reader = Serial_Reader(self.serial, 5)
+        request = reader.read(5)
+        if request[:4] != UPLOAD_MAGIC:
+            raise Upload_Error('bad magic')
+        command = request[4:5]
+        if command == b'I':
+            self.reply(info_line(device))
+            return None
+        if command not in (b'W', b'P', b'R'):
+            raise Upload_Error('bad command')
+        if not device['P']:
+            raise Upload_Error('no device')
+        if command == b'R':
+            return ('R', None)
+        reader.limit = 4
+        length = unpack('<I', reader.read(4))[0]
+        t = time.monotonic()
+        reader.limit = length
+        image = read_bin_image(reader, device)
+        if image is None:
+            raise Upload_Error('bad image')
+        if reader.limit:
+            raise Upload_Error('bad length')
+        self.reply(f'OK {length} {time.monotonic() - t:.3f}')
+        return (command.decode(), image)
+
+
+def info_line(device):
+    text = f'INFO {device["device_id"] or "0000"}'
+    for x in REGIONS:
+        if device[x]:
+            address, size, blank = device[x]
+            text += f' {x} {address:04X} {size:04X} {blank:04X}'
+    return text
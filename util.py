@@ -0,0 +1,35 @@
+# ----------------------------------------------------------------------------
+# Print Helpers shared by code.py and the modules
+
+COLUMN = 0x10
+
+_mute = 0
+
+
+class NO_Printer:
+    # mutes prinp() inside the with-block, nestable
+    def __enter__(self):
+        global _mute
+        _mute += 1
+
+    def __exit__(self, exc_type, exc_value, tracebak):
+        global _mute
+        _mute -= 1
+
+
+def prinp(*objs, sep='', end='\n'):
+    if not _mute:
+        print(*objs, sep=sep, end=end)
+
+
+def hexstr(data):
+    return ' '.join([('%04X' % value) for value in data])
+
+
+def print_data_line(address, data):
+    prinp(('%04X:' % address), hexstr(data))
+
+
+def print_data(data):
+    for address in range(0, len(data), COLUMN):
+        print_data_line(address, data[address : address + COLUMN])